@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark: sequential vs. parallel DTU/Shelly acquisition.
+
+Starts two local stub servers (OpenDTU status + Shelly EM.GetStatus) with an
+artificial response delay and measures the read latency of one control cycle
+with the old sequential fetch and with nulleinspeisung.acquisition.acquire().
+
+    python3 benchmarks/bench_acquisition.py --dtu-delay 0.8 --shelly-delay 0.3 --cycles 20
+"""
+import argparse, json, os, statistics, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nulleinspeisung.acquisition import acquire, acquire_sequential
+
+DTU_STATUS = {
+    "total": {"Power": {"v": 812.4}},
+    "inverters": [
+        {"serial": "116492226387", "name": "Inverter 1", "reachable": True, "producing": True,
+         "limit_absolute": 800, "AC": {"0": {"Power": {"v": 812.4}}}},
+    ],
+}
+SHELLY_STATUS = {"id": 0, "total_act_power": 42.7}
+
+# ------------------------------------------------------------------------------
+# Stub servers
+# ------------------------------------------------------------------------------
+def start_stub_server(payload, delay):
+    body = json.dumps(payload).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ------------------------------------------------------------------------------
+# Benchmark
+# ------------------------------------------------------------------------------
+def run(mode, fetchers, cycles):
+    durations = []
+    for _ in range(cycles):
+        started = time.monotonic()
+        samples = mode(**fetchers)
+        durations.append(time.monotonic() - started)
+        assert all(sample.value is not None for sample in samples.values())
+    return durations
+
+def report(label, durations):
+    durations = sorted(durations)
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    print(f"{label:<12} mean {statistics.mean(durations) * 1000:8.1f} ms   "
+          f"p95 {p95 * 1000:8.1f} ms   max {durations[-1] * 1000:8.1f} ms")
+    return statistics.mean(durations)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sequential vs. parallel acquisition")
+    parser.add_argument('--dtu-delay', type=float, default=0.8, help="DTU response delay in seconds")
+    parser.add_argument('--shelly-delay', type=float, default=0.3, help="Shelly response delay in seconds")
+    parser.add_argument('--cycles', type=int, default=10, help="Number of cycles per mode")
+    args = parser.parse_args()
+
+    dtu = start_stub_server(DTU_STATUS, args.dtu_delay)
+    shelly = start_stub_server(SHELLY_STATUS, args.shelly_delay)
+    dtu_url = f"http://127.0.0.1:{dtu.server_port}/api/livedata/status/inverters"
+    shelly_url = f"http://127.0.0.1:{shelly.server_port}/rpc/EM.GetStatus?id=0"
+
+    fetchers = {
+        "dtu": lambda: requests.get(dtu_url, timeout=5).json(),
+        "shelly": lambda: requests.get(shelly_url, timeout=5).json().get('total_act_power'),
+    }
+    print(f"DTU delay {args.dtu_delay * 1000:.0f} ms, Shelly delay {args.shelly_delay * 1000:.0f} ms, "
+          f"{args.cycles} cycles per mode")
+    before = report("sequential", run(acquire_sequential, fetchers, args.cycles))
+    after = report("parallel", run(acquire, fetchers, args.cycles))
+    print(f"speedup      {before / after:.2f}x")
+
+    dtu.shutdown()
+    shelly.shutdown()
+
+if __name__ == "__main__":
+    main()
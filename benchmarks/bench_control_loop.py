@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Control-loop benchmark for nulleinspeisungv1.py, v2 and v3 against the local
+OpenDTU/Shelly simulators (nulleinspeisung.simulator).
+
+Each script runs unmodified in its own process; only the endpoint URLs, the
+cycle interval and the limit hold time are patched (time is scaled by --speed).
+The simulator measures POSTs per hour, grid import/export and settling time
+after each load step; the script process measures the busy time per cycle.
+
+    python3 benchmarks/bench_control_loop.py --speed 20 --duration 75
+    python3 benchmarks/bench_control_loop.py --json baseline.json
+    python3 benchmarks/bench_control_loop.py --compare baseline.json
+    python3 benchmarks/bench_control_loop.py --control-laws proportional pi feedforward
+"""
+import argparse, importlib, json, logging, multiprocessing, os, statistics, sys, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from nulleinspeisung.simulator import Faults, Simulation, SimulatorServer
+
+SCRIPTS = ['nulleinspeisungv1', 'nulleinspeisungv2', 'nulleinspeisungv3']
+# Lower is better for every metric compared against a baseline
+COMPARED_METRICS = ['cycle_ms_mean', 'posts_per_hour', 'import_wh', 'export_wh', 'mean_abs_error_w', 'settling_s_median']
+
+# ------------------------------------------------------------------------------
+# Script process
+# ------------------------------------------------------------------------------
+def run_script(script, dtu_url, shelly_url, speed, duration, results, shelly_push=False, dtu_livedata=False,
+               control_law=None, shelly_sampling=False):
+    """Import one script, point it at the simulators and run its main loop for `duration` seconds."""
+    sys.argv = [script]
+    sys.path.insert(0, ROOT)
+    from nulleinspeisung.scheduler import CycleScheduler
+
+    busy = []
+    next_delay = CycleScheduler.next_delay
+    def timed_next_delay(self, *args, **kwargs):
+        busy.append(self.clock() - self._cycle_start)
+        return next_delay(self, *args, **kwargs)
+    CycleScheduler.next_delay = timed_next_delay
+
+    module = importlib.import_module(script)
+    logging.getLogger().setLevel(logging.ERROR)
+    module.dtu_status_url = f"{dtu_url}/api/livedata/status/inverters"
+    module.dtu_config_url = f"{dtu_url}/api/limit/config"
+    module.dtu_limit_status_url = f"{dtu_url}/api/limit/status"
+    module.shelly_status_url = f"{shelly_url}/rpc/EM.GetStatus?id=0"
+    module.cycle_interval /= speed
+    module.fast_interval /= speed
+    if hasattr(module, 'idle_interval'):
+        module.idle_interval /= speed
+        module.idle_marker_interval /= speed
+    if hasattr(module, 'limit_cache'):
+        module.limit_cache.min_hold /= speed
+        module.limit_cache.ack_timeout /= speed
+    if getattr(module, 'limit_status_interval', None):
+        module.limit_status_interval /= speed
+    for client in (getattr(module, 'dtu_client', None), getattr(module, 'shelly_client', None)):
+        breaker = getattr(client, 'breaker', None)
+        if breaker is not None:
+            breaker.base_delay /= speed
+            breaker.max_delay /= speed
+            breaker.delay = breaker.base_delay
+    if hasattr(module, 'limit_command_rate'):
+        module.limit_command_rate *= speed
+    if control_law is not None and hasattr(module, 'controller'):
+        from nulleinspeisung.controller import make_law
+        module.controller.law = make_law(control_law)
+        if hasattr(module.controller.law, 'clock'):
+            # Integral gains are per simulated second
+            module.controller.law.clock = lambda: time.monotonic() * speed
+    if shelly_push and hasattr(module, 'init_shelly_push'):
+        module.shelly_ws_url = f"{shelly_url.replace('http://', 'ws://')}/rpc"
+        module.init_shelly_push()
+    if shelly_sampling and hasattr(module, 'init_shelly_sampling'):
+        module.shelly_sample_interval /= speed
+        module.init_shelly_sampling()
+    if dtu_livedata and hasattr(module, 'init_dtu_livedata'):
+        module.dtu_ws_url = f"{dtu_url.replace('http://', 'ws://')}/livedata"
+        module.init_dtu_livedata()
+    if hasattr(module, 'init_db'):
+        module.db_file = os.path.join(tempfile.mkdtemp(), 'power_data.db')
+        module.init_db()
+    if hasattr(module, 'state_file'):
+        module.state_file = os.path.join(tempfile.mkdtemp(), 'state.json')
+
+    threading.Thread(target=module.main_loop, daemon=True).start()
+    time.sleep(duration)
+    cycle_ms = [value * 1000 for value in busy]
+    results.put({
+        'cycles': len(cycle_ms),
+        'cycle_ms_mean': round(statistics.mean(cycle_ms), 1) if cycle_ms else None,
+        'cycle_ms_p95': round(sorted(cycle_ms)[int(len(cycle_ms) * 0.95)], 1) if cycle_ms else None,
+    })
+    results.close()
+    results.join_thread()
+    os._exit(0)
+
+# ------------------------------------------------------------------------------
+# Benchmark
+# ------------------------------------------------------------------------------
+def bench(script, args, control_law=None):
+    sim = Simulation(speed=args.speed, seed=args.seed, spike_rate=args.spike_rate)
+    sim.dtu_faults = Faults(latency=args.dtu_latency, error_rate=args.error_rate, timeout_rate=args.timeout_rate,
+                            hang=10)
+    sim.shelly_faults = Faults(latency=args.shelly_latency, error_rate=args.error_rate,
+                               timeout_rate=args.timeout_rate, hang=10)
+    server = SimulatorServer(sim).start()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_script, args=(script, server.dtu_url, server.shelly_url,
+                                                       args.speed, args.duration, results, args.shelly_push,
+                                                       args.dtu_livedata, control_law, args.shelly_sampling))
+    process.start()
+    try:
+        loop_stats = results.get(timeout=args.duration + 60)
+    finally:
+        process.join(10)
+        if process.is_alive():
+            process.kill()
+    summary = sim.summary()
+    server.stop()
+    settled = [value for value in summary['settling_s'] if value is not None]
+    return {
+        **loop_stats,
+        'posts_per_hour': summary['posts_per_hour'],
+        'import_wh': summary['import_wh'],
+        'export_wh': summary['export_wh'],
+        'mean_abs_error_w': summary['mean_abs_error_w'],
+        'settling_s_median': round(statistics.median(settled), 1) if settled else None,
+        'unsettled_steps': len(summary['settling_s']) - len(settled),
+        'sim_seconds': summary['sim_seconds'],
+    }
+
+def print_table(results):
+    columns = [('cycles', 'cycles'), ('cycle_ms_mean', 'cycle ms'), ('cycle_ms_p95', 'p95 ms'),
+               ('posts_per_hour', 'POST/h'), ('import_wh', 'import Wh'), ('export_wh', 'export Wh'),
+               ('mean_abs_error_w', '|err| W'), ('settling_s_median', 'settle s'), ('unsettled_steps', 'unsettled')]
+    print(f"{'script':<32}" + "".join(f"{title:>11}" for _, title in columns))
+    for script, result in results.items():
+        print(f"{script:<32}" + "".join(f"{str(result.get(key)):>11}" for key, _ in columns))
+
+def compare(results, baseline, tolerance):
+    """Print metrics that got worse than the baseline by more than `tolerance`; return True if any did."""
+    regressed = False
+    for script, result in results.items():
+        for metric in COMPARED_METRICS:
+            old, new = baseline.get(script, {}).get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > 1:
+                print(f"❌ {script}: {metric} regressed from {old} to {new}")
+                regressed = True
+    if not regressed:
+        print("✅ No regressions against baseline.")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark v1/v2/v3 control loops against the simulators")
+    parser.add_argument('--scripts', nargs='+', default=SCRIPTS, choices=SCRIPTS, help="Scripts to benchmark")
+    parser.add_argument('--speed', type=float, default=20.0, help="Simulated seconds per real second")
+    parser.add_argument('--duration', type=float, default=75.0, help="Real seconds per script")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for the load noise and faults")
+    parser.add_argument('--spike-rate', type=float, default=0.0,
+                        help="Short 1500 W load spikes per simulated minute (e.g. 1)")
+    parser.add_argument('--dtu-latency', type=float, default=0.0, help="DTU response latency in seconds")
+    parser.add_argument('--shelly-latency', type=float, default=0.0, help="Shelly response latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="Share of requests that hang")
+    parser.add_argument('--shelly-push', action='store_true', help="Use Shelly WebSocket push mode (v3 only)")
+    parser.add_argument('--shelly-sampling', action='store_true',
+                        help="Sample the Shelly at 1 Hz and regulate on the filtered value (v3 only)")
+    parser.add_argument('--dtu-livedata', action='store_true', help="Use the OpenDTU /livedata WebSocket (v3 only)")
+    parser.add_argument('--control-laws', nargs='+', choices=['proportional', 'pi', 'feedforward'],
+                        help="Run v3 once per control law (e.g. --control-laws proportional pi feedforward)")
+    parser.add_argument('--json', help="Write the results to this file")
+    parser.add_argument('--compare', help="Baseline JSON file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression (0.2 = 20 %%)")
+    args = parser.parse_args()
+
+    results = {}
+    runs = [(script, None) for script in args.scripts]
+    if args.control_laws:
+        runs = [('nulleinspeisungv3', law) for law in args.control_laws]
+    for script, law in runs:
+        label = f"{script}[{law}]" if law else script
+        print(f"⏳ {label}: {args.duration:g} s at {args.speed:g}x ...", flush=True)
+        results[label] = bench(script, args, law)
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Scale test for fleet mode: N simulated sites in one event loop.
+
+The simulated OpenDTUs and Shellys run in a child process. Every site gets its
+own loopback address (127.1.x.y for the DTU, 127.2.x.y for the Shelly), so
+connection pooling behaves as with real devices. The benchmark process only
+runs the fleet, so its CPU time and memory growth are the cost of the sites.
+
+    python3 benchmarks/bench_fleet.py --sites 200 --interval 2 --duration 20
+"""
+import argparse, asyncio, json, logging, multiprocessing, os, random, subprocess, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nulleinspeisung.controller import Inverter
+from nulleinspeisung.fleet import Fleet, Site
+from nulleinspeisung.storage import PowerDataWriter
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def site_hosts(index):
+    return f"127.1.{index // 250}.{index % 250 + 1}", f"127.2.{index // 250}.{index % 250 + 1}"
+
+def rss_bytes(pid='self'):
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+# ------------------------------------------------------------------------------
+# Simulated devices (child process)
+# ------------------------------------------------------------------------------
+def serve_devices(port, ready):
+    from aiohttp import web
+
+    sites = {}
+
+    def site_for(request):
+        host = request.host.split(':')[0]
+        key = host.split('.', 2)[2]
+        if key not in sites:
+            sites[key] = {'load': random.uniform(300, 1500), 'limit': 800.0}
+        site = sites[key]
+        site['load'] = max(100.0, site['load'] + random.uniform(-30, 30))
+        return site
+
+    async def dtu_status(request):
+        site = site_for(request)
+        power = min(site['limit'], 1600.0)
+        return web.json_response({
+            "total": {"Power": {"v": power}},
+            "inverters": [{"serial": "116492226387", "name": "Inverter 1", "reachable": True, "producing": True,
+                           "limit_absolute": site['limit'], "AC": {"0": {"Power": {"v": power}}}}],
+        })
+
+    async def dtu_config(request):
+        site = site_for(request)
+        data = json.loads((await request.post())['data'])
+        site['limit'] = float(data['limit_value'])
+        return web.json_response({"type": "success"})
+
+    async def shelly_status(request):
+        site = site_for(request)
+        return web.json_response({"id": 0, "total_act_power": round(site['load'] - min(site['limit'], 1600.0), 1)})
+
+    app = web.Application()
+    app.router.add_get('/api/livedata/status/inverters', dtu_status)
+    app.router.add_post('/api/limit/config', dtu_config)
+    app.router.add_get('/rpc/EM.GetStatus', shelly_status)
+    ready.set()
+    web.run_app(app, host='0.0.0.0', port=port, print=None, access_log=None)
+
+# ------------------------------------------------------------------------------
+# Benchmark
+# ------------------------------------------------------------------------------
+def baseline_process_rss():
+    """RSS of one single-site process (interpreter + requests + the shared modules)."""
+    code = ("import os, requests, nulleinspeisung.http_client, nulleinspeisung.controller, "
+            "nulleinspeisung.storage, nulleinspeisung.limits, nulleinspeisung.scheduler;"
+            "print(int(open('/proc/self/statm').read().split()[1]) * os.sysconf('SC_PAGE_SIZE'))")
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return int(out.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description="Fleet mode scale test with simulated sites")
+    parser.add_argument('--sites', type=int, default=200, help="Number of simulated sites")
+    parser.add_argument('--interval', type=float, default=2.0, help="Cycle interval per site in seconds")
+    parser.add_argument('--duration', type=float, default=20.0, help="Benchmark duration in seconds")
+    parser.add_argument('--port', type=int, default=18080, help="Port of the simulated devices")
+    parser.add_argument('--db', default=':memory:', help="SQLite file for the shared writer")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    ready = multiprocessing.Event()
+    devices = multiprocessing.Process(target=serve_devices, args=(args.port, ready), daemon=True)
+    devices.start()
+    ready.wait(10)
+    time.sleep(0.5)
+
+    try:
+        rss_before = rss_bytes()
+        writer = PowerDataWriter(args.db, batch_size=500, flush_interval=5).start()
+        sites = []
+        for index in range(args.sites):
+            dtu_host, shelly_host = site_hosts(index)
+            sites.append(Site(
+                name=f"site{index:03d}",
+                dtu_url=f"http://{dtu_host}:{args.port}",
+                shelly_url=f"http://{shelly_host}:{args.port}",
+                inverters=[Inverter(serial="116492226387", minimum=100, maximum=1600, name="Inverter 1")],
+                interval=args.interval,
+                writer=writer,
+            ))
+        fleet = Fleet(sites)
+        cpu_before = time.process_time()
+        started = time.monotonic()
+        asyncio.run(fleet.run(duration=args.duration))
+        elapsed = time.monotonic() - started
+        cpu = time.process_time() - cpu_before
+        rss_after = rss_bytes()
+        writer.close()
+    finally:
+        devices.terminate()
+
+    stats = fleet.stats()
+    expected = args.sites * args.duration / args.interval
+    cycle_times = sorted(site.last_cycle_duration for site in sites if site.last_cycle_duration is not None)
+    baseline = baseline_process_rss()
+    per_site_rss = max(0, rss_after - rss_before) / args.sites
+    print(f"sites                 {args.sites}")
+    print(f"duration              {elapsed:.1f} s, interval {args.interval:g} s")
+    print(f"cycles                {stats['cycles']} (≈{expected:.0f} expected)")
+    print(f"failed cycles         {stats['errors']}")
+    print(f"missed deadlines      {stats['missed_deadlines']}")
+    print(f"rows written          {writer.rows_written}")
+    if cycle_times:
+        print(f"last cycle latency    median {cycle_times[len(cycle_times) // 2] * 1000:.1f} ms, "
+              f"max {cycle_times[-1] * 1000:.1f} ms")
+    print(f"CPU per site-cycle    {cpu / max(1, stats['cycles']) * 1000:.2f} ms "
+          f"({cpu / elapsed * 100:.1f} % of one core for all sites)")
+    print(f"memory per site       {per_site_rss / 1024:.1f} KiB "
+          f"(one process per site: {baseline / 1024 / 1024:.1f} MiB)")
+
+if __name__ == "__main__":
+    main()
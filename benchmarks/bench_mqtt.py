@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+MQTT publisher against the in-process broker stand-in.
+
+Feeds a simulated day of 10 s cycles (noisy household load, two inverters
+following their setpoints) through MqttPublisher three times: sending every
+cycle, change-only with the default deadbands, and additionally batched to
+one message per 30 s (the defaults). Reports messages and bytes
+the broker received. Then stops the broker in the middle of a run, keeps
+publishing, restarts it and checks that the newest state arrives after the
+reconnect.
+
+    python3 benchmarks/bench_mqtt.py --cycles 8640
+"""
+import argparse, json, os, random, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nulleinspeisung.controller import Inverter
+from nulleinspeisung.mqtt_broker import LocalBroker
+from nulleinspeisung.mqtt_publisher import MqttPublisher
+
+INVERTERS = [Inverter('116492226387', 0, 800, name='Balkon'), Inverter('116492226388', 0, 600, name='Garage')]
+INTERVAL = 10.0
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def snapshots(cycles, seed):
+    """Status snapshots shaped like publish_status() builds them."""
+    rng = random.Random(seed)
+    load = 400.0
+    setpoints = {inverter.serial: 300 for inverter in INVERTERS}
+    for cycle in range(cycles):
+        load = min(3000.0, max(150.0, load + rng.gauss(0, 25) + (rng.random() < 0.01) * rng.uniform(-800, 800)))
+        production = {serial: min(setpoint, inverter.maximum) + rng.gauss(0, 3)
+                      for (serial, setpoint), inverter in zip(setpoints.items(), INVERTERS)}
+        grid = load - sum(production.values()) + rng.gauss(0, 8)
+        if abs(grid) > 50:
+            for inverter in INVERTERS:
+                share = grid / len(INVERTERS)
+                setpoints[inverter.serial] = int(min(inverter.maximum, max(0, setpoints[inverter.serial] + share)))
+        yield {
+            'grid_power': grid,
+            'total_production': sum(production.values()),
+            'idle': False,
+            'inverters': [{'serial': inverter.serial, 'name': inverter.name, 'power': production[inverter.serial],
+                           'limit': setpoints[inverter.serial], 'setpoint': setpoints[inverter.serial],
+                           'reachable': True, 'producing': True, 'limit_pending': False}
+                          for inverter in INVERTERS],
+        }
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def state_messages(broker, publisher):
+    return [payload for client_id, topic, payload, _ in list(broker.received)
+            if topic == publisher.state_topic and client_id == publisher.client._client_id.decode()]
+
+def run(broker, cycles, seed, label, heartbeat, min_interval=0, deadbands=None):
+    clock = FakeClock()
+    publisher = MqttPublisher(broker.host, INVERTERS, port=broker.port, topic=f'bench/{label}',
+                              min_interval=min_interval, heartbeat=heartbeat, deadbands=deadbands, client_id=f'bench-{label}', clock=clock).start()
+    wait_for(lambda: publisher.connected)
+    start = time.perf_counter()
+    for snapshot in snapshots(cycles, seed):
+        publisher.update(snapshot)
+        clock.now += INTERVAL
+    elapsed = time.perf_counter() - start
+    wait_for(lambda: len(state_messages(broker, publisher)) >= publisher.published)
+    publisher.close()
+    messages = [payload for client_id, _, payload, _ in broker.received if client_id == f'bench-{label}']
+    states = state_messages(broker, publisher)
+    print(f"{label:>12}: {len(states):5d} state messages ({len(states) / cycles * 100:5.1f} % of cycles), "
+          f"{len(messages):5d} messages total, {sum(map(len, messages)) / 1024:7.1f} KiB, "
+          f"{elapsed / cycles * 1e6:5.1f} µs per update")
+    return len(states)
+
+def outage(broker, cycles, seed):
+    """Broker down for the middle third of the run; the newest state has to arrive after the restart."""
+    clock = FakeClock()
+    publisher = MqttPublisher(broker.host, INVERTERS, port=broker.port, topic='bench/outage',
+                              min_interval=0, heartbeat=0, client_id='bench-outage', clock=clock).start()
+    wait_for(lambda: publisher.connected)
+    last = None
+    for index, snapshot in enumerate(snapshots(cycles, seed)):
+        if index == cycles // 3:
+            broker.stop()
+            wait_for(lambda: not publisher.connected)
+        elif index == 2 * cycles // 3:
+            queued = len(publisher._pending)
+            broker.start()
+            down = time.monotonic()
+            wait_for(lambda: publisher.connected, timeout=90)
+            reconnect = time.monotonic() - down
+        publisher.update(snapshot)
+        last = publisher.values(snapshot)
+        clock.now += INTERVAL
+    delivered = wait_for(lambda: broker.retained.get(publisher.state_topic) == json.dumps(last, separators=(',', ':')).encode())
+    online = broker.retained.get(publisher.availability_topic) == b'online'
+    publisher.close()
+    offline = wait_for(lambda: broker.retained.get(publisher.availability_topic) == b'offline')
+    print(f"      outage: {queued} queued message(s) while down, reconnected after {reconnect:.1f} s, "
+          f"newest state delivered: {delivered}, availability online/offline: {online}/{offline}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=8640, help="10 s cycles to simulate (8640 = one day)")
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args()
+
+    broker = LocalBroker().start()
+    entities = 3 + 4 * len(INVERTERS)
+    print(f"one topic per entity and cycle would be {options.cycles * entities} messages")
+    every = run(broker, options.cycles, options.seed, 'every-cycle', heartbeat=0)
+    changed = run(broker, options.cycles, options.seed, 'deadbands', heartbeat=300)
+    batched = run(broker, options.cycles, options.seed, 'default', min_interval=30, heartbeat=300)
+    print(f"deadbands alone send {changed / every * 100:.1f} %, with the 30 s minimum interval "
+          f"{batched / every * 100:.1f} % of the state messages")
+    outage(broker, min(options.cycles, 300), options.seed)
+    broker.stop()
+
+if __name__ == '__main__':
+    main()
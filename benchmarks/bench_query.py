@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the history queries: builds a power_data table without epoch
+column (as written by older versions), lets PowerDataWriter migrate it and
+build the rollups, then compares the query API against ad-hoc scans on the
+TEXT timestamp column.
+
+    python3 benchmarks/bench_query.py --days 30
+"""
+import argparse, datetime, os, random, sqlite3, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nulleinspeisung import query
+from nulleinspeisung.storage import PowerDataWriter
+
+OLD_SCHEMA = '''
+    CREATE TABLE power_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        grid_power REAL, inverter1_power REAL, inverter2_power REAL, total_production REAL,
+        inverter1_setpoint REAL, inverter2_setpoint REAL, inverter1_reachable INTEGER,
+        inverter2_reachable INTEGER, dtus_error INTEGER, shelly_error INTEGER
+    )
+'''
+
+# Old databases only have the inverter1/2 columns of power_data
+LEGACY_FIELDS = ('inverter1_power', 'inverter2_power')
+
+def old_rows(days, end):
+    rng = random.Random(1)
+    for step in range(days * 8640, 0, -1):
+        t = end - datetime.timedelta(seconds=10 * step)
+        p1, p2 = rng.uniform(0, 2000), rng.uniform(0, 1500)
+        yield (t.strftime('%Y-%m-%d %H:%M:%S'), rng.uniform(-50, 500), p1, p2, p1 + p2, p1, p2, 1, 1, 0, 0)
+
+def timed(label, func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<44} {best * 1000:9.2f} ms  ({count} results)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indexed history queries against full-table scans")
+    parser.add_argument('--days', type=int, default=30, help="Days of 10 s history")
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), 'power_data.db')
+    end = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    conn = sqlite3.connect(db_file)
+    conn.execute(OLD_SCHEMA)
+    conn.executemany("INSERT INTO power_data (timestamp, grid_power, inverter1_power, inverter2_power, "
+                     "total_production, inverter1_setpoint, inverter2_setpoint, inverter1_reachable, "
+                     "inverter2_reachable, dtus_error, shelly_error) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                     old_rows(args.days, end))
+    conn.commit()
+    conn.close()
+    started = time.monotonic()
+    PowerDataWriter(db_file).start(timeout=600).close(timeout=600)
+    print(f"migrated {args.days * 8640} rows and built rollups in {time.monotonic() - started:.1f} s")
+
+    conn = query.connect(db_file)
+    day_start = (end - datetime.timedelta(days=args.days // 2)).strftime('%Y-%m-%d')
+    day_end = (end - datetime.timedelta(days=args.days // 2 - 1)).strftime('%Y-%m-%d')
+    month_start = (end - datetime.timedelta(days=args.days)).strftime('%Y-%m-%d %H:%M:%S')
+    month_end = end.strftime('%Y-%m-%d %H:%M:%S')
+
+    timed("one day, TEXT timestamp scan", lambda: len(conn.execute(
+        "SELECT * FROM power_data WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+        (day_start, day_end)).fetchall()))
+    timed("one day, range_rows (epoch index)", lambda: sum(1 for _ in query.range_rows(conn, day_start, day_end)))
+    timed("latest 10, ORDER BY timestamp", lambda: len(conn.execute(
+        "SELECT * FROM power_data ORDER BY timestamp DESC LIMIT 10").fetchall()))
+    timed("latest 10, latest()", lambda: sum(1 for _ in query.latest(conn, 10)))
+    timed("month per inverter, AVG over raw rows", lambda: len(conn.execute(
+        "SELECT avg(inverter1_power), min(inverter1_power), max(inverter1_power), avg(inverter2_power), "
+        "min(inverter2_power), max(inverter2_power) FROM power_data WHERE timestamp >= ? AND timestamp < ?",
+        (month_start, month_end)).fetchall()))
+    timed("month per inverter, inverter_summary()",
+          lambda: sum(1 for _ in query.inverter_summary(conn, month_start, month_end, fields=LEGACY_FIELDS)))
+    timed("month hourly, GROUP BY over raw rows", lambda: len(conn.execute(
+        "SELECT strftime('%Y-%m-%d %H', timestamp), avg(inverter1_power), avg(inverter2_power) "
+        "FROM power_data WHERE timestamp >= ? AND timestamp < ? GROUP BY 1", (month_start, month_end)).fetchall()))
+    timed("month hourly, aggregates('hour')",
+          lambda: sum(1 for _ in query.aggregates(conn, month_start, month_end, 'hour', fields=LEGACY_FIELDS)))
+
+if __name__ == "__main__":
+    main()
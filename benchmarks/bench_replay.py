@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the offline replay: builds a synthetic power_data history
+(one row per 10 s) and times loading it and replaying a settings sweep.
+
+    python3 benchmarks/bench_replay.py --days 365
+"""
+import argparse, datetime, math, os, random, resource, sqlite3, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nulleinspeisung.replay import load_history, recorded, sweep
+from nulleinspeisung.storage import POWER_DATA_INDEXES, POWER_DATA_SCHEMA
+
+def synthetic_rows(days, interval=10):
+    """House load with noise and a daily solar curve; the inverter tracks the load up to the sun."""
+    rng = random.Random(1)
+    start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    load = 500.0
+    setpoint = 200.0
+    for step in range(days * 86400 // interval):
+        t = start + datetime.timedelta(seconds=step * interval)
+        hour = t.hour + t.minute / 60
+        sun = max(0.0, math.sin((hour - 6) / 12 * math.pi)) * 1800
+        load = min(3500.0, max(150.0, load + rng.gauss(0, 40)))
+        power = min(setpoint, sun)
+        grid = load - power
+        yield (t.strftime('%Y-%m-%d %H:%M:%S'), int(t.timestamp()), grid, power, None, power, setpoint, None)
+        setpoint = min(2000.0, max(200.0, grid + setpoint - 5))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized power_data replay")
+    parser.add_argument('--days', type=int, default=365, help="Days of synthetic 10 s history")
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), 'power_data.db')
+    conn = sqlite3.connect(db_file)
+    conn.execute(POWER_DATA_SCHEMA)
+    started = time.monotonic()
+    conn.executemany("INSERT INTO power_data (timestamp, epoch, grid_power, inverter1_power, inverter2_power, "
+                     "total_production, inverter1_setpoint, inverter2_setpoint) VALUES (?,?,?,?,?,?,?,?)",
+                     synthetic_rows(args.days))
+    for statement in POWER_DATA_INDEXES:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+    print(f"generated {args.days} days in {time.monotonic() - started:.1f} s")
+
+    started = time.monotonic()
+    history = load_history(db_file)
+    print(f"loaded {len(history.grid)} samples in {time.monotonic() - started:.2f} s "
+          f"(peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB)")
+    actual = recorded(history)
+    print(f"recorded: import {actual.import_wh / 1000:.1f} kWh, export {actual.export_wh / 1000:.1f} kWh")
+
+    started = time.monotonic()
+    results = list(sweep(history, [1600, 1800, 2000], [100, 200], [0, 5, 20, 50]))
+    elapsed = time.monotonic() - started
+    print(f"replayed {len(results)} settings in {elapsed:.2f} s ({elapsed / len(results) * 1000:.0f} ms each)")
+    best = min(results, key=lambda item: item[1].import_wh + item[1].export_wh)
+    print(f"best: {best[0]} import {best[1].import_wh / 1000:.1f} kWh, export {best[1].export_wh / 1000:.1f} kWh")
+
+if __name__ == "__main__":
+    main()
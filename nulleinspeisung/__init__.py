@@ -0,0 +1 @@
+"""Shared building blocks for the nulleinspeisung control scripts."""
@@ -0,0 +1,152 @@
+"""Command line entry point: python3 -m nulleinspeisung <command> ..."""
+import argparse, asyncio, logging, signal, sys
+
+from nulleinspeisung.logsetup import setup_logging
+
+# ------------------------------------------------------------------------------
+# Subcommands
+# ------------------------------------------------------------------------------
+def cmd_fleet(args):
+    from nulleinspeisung.fleet import Fleet, load_config, sites_from_config
+    from nulleinspeisung.storage import PowerDataWriter
+
+    config = load_config(args.config)
+    writer = None
+    if config.get('db_file'):
+        writer = PowerDataWriter(config['db_file'], batch_size=config.get('db_batch_size', 500),
+                                 flush_interval=config.get('db_flush_interval', 60),
+                                 retention_days=config.get('db_retention_days'),
+                                 minute_retention_days=config.get('db_minute_retention_days')).start()
+    sites = sites_from_config(config, writer=writer)
+    if config.get('metrics_port'):
+        from nulleinspeisung.metrics import start_http_server
+        start_http_server(config['metrics_port'])
+        logging.info(f"📈 Prometheus metrics available on port {config['metrics_port']} (/metrics).")
+    logging.info(f"🚀 Starting fleet mode with {len(sites)} sites")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        asyncio.run(Fleet(sites, connections_per_host=config.get('connections_per_host', 2)).run())
+    except (KeyboardInterrupt, SystemExit):
+        logging.info("🛑 Fleet stopped.")
+    finally:
+        if writer is not None:
+            writer.close()
+
+def cmd_query(args):
+    import csv, json
+    from nulleinspeisung import query
+
+    conn = query.connect(args.db)
+    if args.latest:
+        results = query.latest(conn, args.latest, site=args.site)
+    elif args.aggregate:
+        results = query.aggregates(conn, args.start, args.end, args.aggregate, site=args.site, fields=args.fields,
+                                   serial=args.serial)
+    elif args.summary:
+        results = query.inverter_summary(conn, args.start, args.end, site=args.site, fields=args.fields,
+                                         serial=args.serial)
+    elif args.inverters or args.serial:
+        results = query.inverter_rows(conn, args.start, args.end, site=args.site, serial=args.serial)
+    else:
+        results = query.range_rows(conn, args.start, args.end, site=args.site)
+
+    writer = csv.writer(sys.stdout) if args.format == 'csv' else None
+    header = True
+    try:
+        for item in results:
+            if writer is None:
+                print(json.dumps(item._asdict()))
+                continue
+            if header:
+                writer.writerow(item._fields)
+                header = False
+            writer.writerow(item)
+    except BrokenPipeError:
+        # Output piped into head & co.; stop quietly
+        sys.stdout = None
+    finally:
+        conn.close()
+
+def cmd_replay(args):
+    import time
+    from nulleinspeisung.replay import load_history, recorded, sweep
+
+    started = time.monotonic()
+    history = load_history(args.db, start=args.start, end=args.end, site=args.site, serials=args.serials)
+    loaded = time.monotonic()
+    if not len(history.grid):
+        logging.error("❌ No power_data rows in the selected range.")
+        sys.exit(1)
+    actual = recorded(history)
+    print(f"{len(history.grid)} samples loaded in {loaded - started:.2f} s")
+    print(f"{'recorded':<44} import {actual.import_wh / 1000:9.2f} kWh   export {actual.export_wh / 1000:9.2f} kWh")
+    results = list(sweep(history, args.maximum_wr, args.minimum_wr, args.offset,
+                         args.maximum_wr2 or (), args.minimum_wr2 or ()))
+    for settings, result in sorted(results, key=lambda item: item[1].export_wh + item[1].import_wh):
+        label = " ".join(f"{key}={value}" for key, value in settings.items())
+        print(f"{label:<44} import {result.import_wh / 1000:9.2f} kWh   export {result.export_wh / 1000:9.2f} kWh")
+    print(f"{len(results)} settings replayed in {time.monotonic() - loaded:.2f} s")
+
+def cmd_simulate(args):
+    from nulleinspeisung.simulator import run_standalone
+    run_standalone(args.host, args.dtu_port, args.shelly_port, speed=args.speed, seed=args.seed)
+
+# ------------------------------------------------------------------------------
+# Argument parsing
+# ------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m nulleinspeisung",
+                                     description="Nulleinspeisung tools for OpenDTU and Shelly 3EM Pro")
+    parser.add_argument('--debug', action='store_true', help="Enable debug mode with detailed logging output")
+    parser.add_argument('--json-logs', action='store_true', help="Write log records as JSON lines")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fleet = subparsers.add_parser('fleet', help="Control many DTU/Shelly sites from one process")
+    fleet.add_argument('--config', required=True, help="Fleet configuration file (JSON)")
+    fleet.set_defaults(func=cmd_fleet)
+
+    query = subparsers.add_parser('query', help="Read stored power_data history (range, latest rows, aggregates)")
+    query.add_argument('--db', default='power_data.db', help="SQLite database written by v3 or fleet mode")
+    query.add_argument('--from', dest='start', help="Start (UTC), e.g. 2025-01-01 or '2025-01-01 12:00'")
+    query.add_argument('--to', dest='end', help="End (UTC, exclusive)")
+    query.add_argument('--site', help="Only rows of this fleet site ('' = single-site rows)")
+    query.add_argument('--serial', help="Only this inverter (per-inverter rows and fields)")
+    mode = query.add_mutually_exclusive_group()
+    mode.add_argument('--latest', type=int, metavar='N', help="Newest N raw rows")
+    mode.add_argument('--aggregate', choices=['minute', 'hour', 'day'], help="Per-inverter averages per bucket")
+    mode.add_argument('--summary', action='store_true', help="Per-inverter averages over the whole range")
+    mode.add_argument('--inverters', action='store_true', help="Raw per-inverter rows (every configured inverter)")
+    query.add_argument('--fields', nargs='+', default=['power'],
+                       help="Fields for --aggregate/--summary: power/setpoint per inverter, or grid_power, "
+                            "total_production, inverter1_power, inverter2_power per site")
+    query.add_argument('--format', choices=['csv', 'json'], default='csv', help="Output format (json = one object per line)")
+    query.set_defaults(func=cmd_query)
+
+    replay = subparsers.add_parser('replay', help="Replay power_data history under different controller settings")
+    replay.add_argument('--db', default='power_data.db', help="SQLite database written by v3 or fleet mode")
+    replay.add_argument('--from', dest='start', help="Start date (UTC), e.g. 2025-01-01")
+    replay.add_argument('--to', dest='end', help="End date (UTC, exclusive)")
+    replay.add_argument('--site', help="Only rows of this fleet site")
+    replay.add_argument('--serials', nargs='+', help="Read the power of these inverters (any number) instead of "
+                                                     "the inverter1/2 columns, e.g. all inverters of a site")
+    replay.add_argument('--maximum-wr', type=int, nargs='+', default=[2000], help="Maximum output(s) of inverter 1 (W)")
+    replay.add_argument('--minimum-wr', type=int, nargs='+', default=[200], help="Minimum output(s) of inverter 1 (W)")
+    replay.add_argument('--offset', type=int, nargs='+', default=[5], help="Grid import margin(s) (W)")
+    replay.add_argument('--maximum-wr2', type=int, nargs='+', help="Maximum output(s) of inverter 2 (W)")
+    replay.add_argument('--minimum-wr2', type=int, nargs='+', help="Minimum output(s) of inverter 2 (W)")
+    replay.set_defaults(func=cmd_replay)
+
+    simulate = subparsers.add_parser('simulate', help="Run local OpenDTU and Shelly 3EM simulators")
+    simulate.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    simulate.add_argument('--dtu-port', type=int, default=8081, help="Port of the simulated OpenDTU")
+    simulate.add_argument('--shelly-port', type=int, default=8082, help="Port of the simulated Shelly")
+    simulate.add_argument('--speed', type=float, default=1.0, help="Simulated seconds per real second")
+    simulate.add_argument('--seed', type=int, default=None, help="Random seed for the load noise")
+    simulate.set_defaults(func=cmd_simulate)
+
+    args = parser.parse_args(argv)
+    setup_logging(logging.DEBUG if args.debug else logging.INFO, json_output=args.json_logs)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
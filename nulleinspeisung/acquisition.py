@@ -0,0 +1,42 @@
+"""Concurrent acquisition of DTU and Shelly readings for one control cycle."""
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# ------------------------------------------------------------------------------
+# Timestamped sample
+# ------------------------------------------------------------------------------
+# value     -> whatever the fetch function returned (None on error)
+# timestamp -> wall clock time (time.time()) when the response arrived
+# latency   -> duration of the request in seconds
+Sample = namedtuple('Sample', ['value', 'timestamp', 'latency'])
+
+# One small pool for the whole process; a cycle only ever has a few requests in flight.
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='acquire')
+
+def timed_fetch(fetch):
+    """Call a fetch function and wrap its result in a timestamped Sample."""
+    started = time.monotonic()
+    value = fetch()
+    latency = time.monotonic() - started
+    return Sample(value, time.time(), latency)
+
+def acquire(**fetchers):
+    """
+    Run all fetch functions in parallel and return a dict name -> Sample.
+    The call takes as long as the slowest fetch, not the sum of all of them.
+    """
+    return run_parallel({name: (lambda fetch=fetch: timed_fetch(fetch)) for name, fetch in fetchers.items()})
+
+def run_parallel(calls):
+    """Run {key: callable} on the shared pool and return {key: result} once all are done."""
+    futures = submit_parallel(calls)
+    return {key: future.result() for key, future in futures.items()}
+
+def submit_parallel(calls):
+    """Start {key: callable} on the shared pool and return {key: Future} without waiting."""
+    return {key: _executor.submit(call) for key, call in calls.items()}
+
+def acquire_sequential(**fetchers):
+    """Same interface as acquire(), but one request after the other (reference/benchmark)."""
+    return {name: timed_fetch(fetch) for name, fetch in fetchers.items()}
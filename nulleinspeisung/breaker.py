@@ -0,0 +1,119 @@
+"""Per-device circuit breaker: skip requests to a device that is down instead of waiting for its timeout."""
+import logging, random, threading, time
+
+# ------------------------------------------------------------------------------
+# Defaults
+# ------------------------------------------------------------------------------
+DEFAULT_FAILURE_THRESHOLD = 2   # Consecutive failed requests that open the circuit
+DEFAULT_BASE_DELAY = 10.0       # Seconds until the first probe after the circuit opened
+DEFAULT_MAX_DELAY = 300.0       # Upper bound of the doubled delay after failed probes
+DEFAULT_JITTER = 0.2            # +/- share of the delay, so several clients do not probe in lockstep
+
+# Circuit states
+CLOSED = 'closed'               # Requests go out normally
+OPEN = 'open'                   # Requests fail immediately until the next probe is due
+HALF_OPEN = 'half-open'         # One probe request is out; its result closes or reopens the circuit
+
+# Values of the stored dtus_error / shelly_error columns
+ERROR_NONE = 0
+ERROR_REQUEST = 1               # The request failed (timeout, connection refused, bad response)
+ERROR_CIRCUIT_OPEN = 2          # The device is considered down; no request was sent or it opened the circuit
+ERROR_REASONS = {ERROR_REQUEST: 'request', ERROR_CIRCUIT_OPEN: 'circuit_open'}    # reason label of ERRORS
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit of a device is open."""
+
+class CircuitBreaker:
+    """
+    Counts consecutive transport failures (timeouts, refused connections) of
+    one device. After `failure_threshold` of them the circuit opens: allow()
+    returns False and the caller skips the request. After `base_delay` s
+    (+/- `jitter`) one probe request is allowed (half-open); if it succeeds the
+    circuit closes, otherwise it opens again with twice the delay, up to
+    `max_delay`. State changes are logged once, not every skipped request.
+
+    Thread safe; the control loop and background threads share one breaker per device.
+    """
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, jitter=DEFAULT_JITTER, logger=None,
+                 clock=time.monotonic, rand=random.random):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.log = logger or logging.getLogger()
+        self.clock = clock
+        self.rand = rand
+        self.state = CLOSED
+        self.failures = 0           # Consecutive failures
+        self.delay = base_delay     # Delay before the next probe, without jitter
+        self.retry_at = None
+        self.trips = 0              # Times the circuit opened
+        self.skipped = 0            # Requests not sent because the circuit was open
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a request may go out now (in the half-open state only the probe itself)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() >= self.retry_at:
+                self.state = HALF_OPEN
+                self.log.info(f"🔌 {self.name}: probing whether the device is back (circuit half-open).")
+                return True
+            self.skipped += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                self.log.info(f"✅ {self.name} is reachable again after {self.skipped} skipped requests "
+                              f"(circuit closed).")
+            self.state = CLOSED
+            self.failures = 0
+            self.delay = self.base_delay
+            self.skipped = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.delay = min(self.delay * 2, self.max_delay)
+                self._open()
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self.delay = self.base_delay
+                self._open()
+
+    def release(self):
+        """A probe ended without a result (e.g. it was cancelled): back to open, the next request probes again."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self.retry_at = self.clock()
+
+    def _open(self):
+        wait = self.delay * (1 + self.jitter * (2 * self.rand() - 1))
+        self.retry_at = self.clock() + wait
+        self.state = OPEN
+        self.trips += 1
+        self.log.warning(f"⛔ {self.name} unreachable after {self.failures} failed requests; "
+                         f"skipping it for {wait:.0f} s (circuit open).")
+
+    def retry_in(self):
+        """Seconds until the next probe (0 unless the circuit is open)."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.retry_at - self.clock())
+
+    def error_code(self):
+        """Value for the dtus_error / shelly_error column after a failed fetch from this device."""
+        return ERROR_CIRCUIT_OPEN if self.state != CLOSED else ERROR_REQUEST
+
+    def format_stats(self):
+        """Short summary for debug logging, e.g. 'dtu open (probe in 37 s, 3 trips, 12 skipped)'."""
+        if self.state == CLOSED:
+            return f"{self.name} {self.state} ({self.trips} trips)"
+        return (f"{self.name} {self.state} (probe in {self.retry_in():.0f} s, {self.trips} trips, "
+                f"{self.skipped} skipped)")
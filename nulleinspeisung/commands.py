@@ -0,0 +1,167 @@
+"""Coalescing, rate-limited queue for DTU limit commands: the control cycle never waits on a POST."""
+import logging, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+# ------------------------------------------------------------------------------
+# Defaults
+# ------------------------------------------------------------------------------
+DEFAULT_RATE = 2.0              # Limit commands per second over all inverters (OpenDTU radios them one by one)
+DEFAULT_BURST = 2               # Commands that may go out back to back after a quiet period
+DEFAULT_MAX_IN_FLIGHT = 2       # POSTs open at the same time (never more than one per inverter)
+
+# Results of submit()
+QUEUED = 'queued'               # Nothing was pending for this serial
+COALESCED = 'coalesced'         # Replaced a pending command that had not been sent yet
+DUPLICATE = 'duplicate'         # The same value is already queued or in flight; nothing changed
+
+class CommandStats:
+    """Counters of one inverter serial."""
+    __slots__ = ('submitted', 'sent', 'failed', 'coalesced', 'duplicates')
+
+    def __init__(self):
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0      # Queued commands replaced by a newer value before they went out
+        self.duplicates = 0     # Commands dropped because the same value was already queued or in flight
+
+# ------------------------------------------------------------------------------
+# Queue
+# ------------------------------------------------------------------------------
+class LimitCommandQueue:
+    """
+    Holds at most one pending limit per inverter serial; a newer value replaces
+    an older one that has not been sent yet (latest wins). A dispatcher thread
+    hands pending commands to `send(serial, limit) -> bool` on a small pool,
+    with at most one request in flight per serial and a token bucket of `rate`
+    commands per second (`burst` at once) across all serials.
+
+    `on_done(serial, limit, ok)` is called from the pool thread after every
+    attempt, e.g. to record the sent limit in a LimitCache.
+    """
+    def __init__(self, send, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 on_done=None, clock=time.monotonic):
+        self.send = send
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.on_done = on_done
+        self.clock = clock
+        self.stats = {}
+        self._pending = {}          # serial -> limit, in submission order
+        self._in_flight = {}        # serial -> limit
+        self._tokens = float(burst)
+        self._refilled = clock()
+        self._closing = False
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='limit-post')
+        self._thread = threading.Thread(target=self._run, name='limit-commands', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self, timeout=5):
+        """Send what is still pending (within `timeout` seconds), then stop."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+
+    # -- called from the control loop -------------------------------------------
+    def submit(self, serial, limit):
+        """Queue a limit and return QUEUED, COALESCED or DUPLICATE without waiting for the DTU."""
+        with self._cond:
+            stats = self._stats(serial)
+            if self._pending.get(serial, self._in_flight.get(serial)) == limit:
+                stats.duplicates += 1
+                return DUPLICATE
+            if serial in self._pending:
+                stats.coalesced += 1
+                if self._in_flight.get(serial) == limit:
+                    # Back to the value that is being sent right now
+                    del self._pending[serial]
+                    return COALESCED
+                self._pending[serial] = limit
+                result = COALESCED
+            else:
+                self._pending[serial] = limit
+                result = QUEUED
+            stats.submitted += 1
+            self._cond.notify_all()
+            return result
+
+    def depth(self, serial):
+        """Commands of this serial that are queued or in flight (0-2)."""
+        with self._cond:
+            return (serial in self._pending) + (serial in self._in_flight)
+
+    def format_stats(self):
+        """One line for debug logging, e.g. '116492226387 depth 1, 12 sent, 0 failed, 3 coalesced'."""
+        with self._cond:
+            return ", ".join(
+                f"{serial} depth {(serial in self._pending) + (serial in self._in_flight)}, "
+                f"{stats.sent} sent, {stats.failed} failed, {stats.coalesced} coalesced"
+                for serial, stats in self.stats.items())
+
+    # -- dispatcher ---------------------------------------------------------------
+    def _stats(self, serial):
+        if serial not in self.stats:
+            self.stats[serial] = CommandStats()
+        return self.stats[serial]
+
+    def _next_serial(self):
+        if len(self._in_flight) >= self.max_in_flight:
+            return None
+        for serial in self._pending:
+            if serial not in self._in_flight:
+                return serial
+        return None
+
+    def _token_wait(self):
+        """Take one token and return 0, or return the seconds until the next token is available."""
+        now = self.clock()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def _run(self):
+        with self._cond:
+            while True:
+                serial = self._next_serial()
+                if serial is None:
+                    if self._closing and not self._pending and not self._in_flight:
+                        return
+                    self._cond.wait()
+                    continue
+                wait = self._token_wait()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                limit = self._pending.pop(serial)
+                self._in_flight[serial] = limit
+                self._executor.submit(self._send, serial, limit)
+
+    def _send(self, serial, limit):
+        ok = False
+        try:
+            ok = bool(self.send(serial, limit))
+        except Exception as e:
+            logging.error(f"❌ Limit command for {serial} failed: {e!r}")
+        with self._cond:
+            del self._in_flight[serial]
+            stats = self._stats(serial)
+            if ok:
+                stats.sent += 1
+            else:
+                stats.failed += 1
+            self._cond.notify_all()
+        if self.on_done is not None:
+            try:
+                self.on_done(serial, limit, ok)
+            except Exception as e:
+                logging.error(f"❌ Limit command callback for {serial} failed: {e!r}")
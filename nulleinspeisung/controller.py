@@ -0,0 +1,268 @@
+"""Setpoint controller for any number of inverters on one OpenDTU."""
+import time
+from collections import namedtuple
+
+# ------------------------------------------------------------------------------
+# Data types
+# ------------------------------------------------------------------------------
+# Static configuration of one inverter. Inverters with a lower priority value are
+# filled first; inside one priority group the power is split by weight.
+Inverter = namedtuple('Inverter', ['serial', 'minimum', 'maximum', 'priority', 'weight', 'name'],
+                      defaults=(0, 1.0, None))
+
+def validate_inverter(inverter):
+    """Raise ValueError for a configuration distribute() cannot work with."""
+    label = inverter.name or inverter.serial
+    if not inverter.weight > 0:
+        raise ValueError(f"{label}: weight must be greater than 0 (got {inverter.weight!r})")
+    if inverter.minimum > inverter.maximum:
+        raise ValueError(f"{label}: minimum ({inverter.minimum} W) is above maximum ({inverter.maximum} W)")
+
+# Live data of one inverter as reported by the DTU
+InverterStatus = namedtuple('InverterStatus', ['serial', 'name', 'reachable', 'producing', 'limit', 'power'])
+
+# Result of one control step
+# setpoints -> {serial: new limit in W} for every reachable inverter
+# target    -> total power the inverters should deliver
+# unserved  -> part of the target above the combined maximum (still imported from the grid)
+# saturated -> True if all reachable inverters are at their maximum
+Allocation = namedtuple('Allocation', ['setpoints', 'target', 'unserved', 'saturated'])
+
+# ------------------------------------------------------------------------------
+# DTU parsing
+# ------------------------------------------------------------------------------
+def parse_inverter(inverter):
+    """Extract the fields the controller needs from one entry of the DTU 'inverters' array."""
+    if 'AC' in inverter:
+        power = inverter.get('AC', {}).get('0', {}).get('Power', {}).get('v', 0)
+    else:
+        power = 0
+    return InverterStatus(
+        serial=str(inverter.get('serial', '')),
+        name=inverter.get('name'),
+        reachable=bool(inverter.get('reachable', False)),
+        producing=bool(inverter.get('producing', False)),
+        limit=int(inverter.get('limit_absolute', 0)),
+        power=power,
+    )
+
+def parse_inverters(dtu_status):
+    """Return {serial: InverterStatus} for all inverters in a DTU livedata response."""
+    statuses = {}
+    for inverter in dtu_status.get('inverters', []):
+        status = parse_inverter(inverter)
+        statuses[status.serial] = status
+    return statuses
+
+# ------------------------------------------------------------------------------
+# Distribution
+# ------------------------------------------------------------------------------
+def distribute(total, inverters):
+    """
+    Split `total` W across `inverters` in one pass.
+
+    Every inverter gets at least its minimum. The rest is given to the priority
+    groups in order; a group is filled completely before the next one gets
+    anything. Inside a group the power is split by weight, and an inverter that
+    reaches its maximum passes its surplus share on to the others in the group.
+    Returns ({serial: setpoint}, unserved).
+    """
+    setpoints = {inverter.serial: inverter.minimum for inverter in inverters}
+    remaining = total - sum(inverter.minimum for inverter in inverters)
+
+    for priority in sorted({inverter.priority for inverter in inverters}):
+        if remaining <= 0:
+            break
+        group = [inverter for inverter in inverters if inverter.priority == priority]
+        # Inverters that saturate first (small headroom per weight) are handled first,
+        # so their surplus can be passed on in the same pass.
+        group.sort(key=lambda inverter: (inverter.maximum - inverter.minimum) / inverter.weight)
+        weight_left = sum(inverter.weight for inverter in group)
+        for inverter in group:
+            headroom = inverter.maximum - inverter.minimum
+            share = min(headroom, remaining * inverter.weight / weight_left)
+            setpoints[inverter.serial] += share
+            remaining -= share
+            weight_left -= inverter.weight
+
+    setpoints = {serial: round(setpoint) for serial, setpoint in setpoints.items()}
+    return setpoints, max(0, remaining)
+
+# ------------------------------------------------------------------------------
+# Control laws: total inverter power from grid power and inverter status
+# ------------------------------------------------------------------------------
+class ProportionalLaw:
+    """
+    The original rule: grid power plus the limits the DTU reports, minus the
+    offset. It reacts to the full error in one step, but counts a limit the
+    inverter has not reached yet (command pending, power still ramping) as
+    already delivered, so it overshoots after load steps.
+    """
+    name = 'proportional'
+
+    def target(self, grid_power, statuses, active, offset):
+        return grid_power + sum(statuses[inverter.serial].limit for inverter in active) - offset
+
+    def reset(self):
+        pass
+
+    def snapshot(self):
+        return {}
+
+    def restore(self, snapshot):
+        pass
+
+class FeedForwardLaw(ProportionalLaw):
+    """
+    House load estimated from grid power plus the measured AC power of the
+    inverters (both from the same cycle), minus the offset. A limit that is
+    still ramping is not counted, so there is no overshoot.
+
+    An inverter that delivers more than `tracking_band` W less than its
+    reported limit and whose power did not rise since the last cycle is
+    limited by the sun; its reported limit is counted instead (as in the
+    proportional rule), so the next inverter takes over the rest.
+    """
+    name = 'feedforward'
+
+    def __init__(self, tracking_band=50.0):
+        self.tracking_band = tracking_band
+        self._last_power = {}
+
+    def delivered(self, statuses, active):
+        """Measured power of the active inverters, with the reported limit for sun-limited ones."""
+        total = 0.0
+        last_power = {}
+        for inverter in active:
+            status = statuses[inverter.serial]
+            previous = self._last_power.get(inverter.serial)
+            stuck = (status.limit - status.power > self.tracking_band
+                     and previous is not None and status.power - previous < self.tracking_band)
+            total += status.limit if stuck else status.power
+            last_power[inverter.serial] = status.power
+        self._last_power = last_power
+        return total
+
+    def target(self, grid_power, statuses, active, offset):
+        return grid_power + self.delivered(statuses, active) - offset
+
+    def reset(self):
+        self._last_power = {}
+
+    def snapshot(self):
+        return {'last_power': self._last_power}
+
+    def restore(self, snapshot):
+        self._last_power = dict(snapshot.get('last_power', {}))
+
+class PILaw(FeedForwardLaw):
+    """
+    PI controller on the grid error (grid power - offset), around the power
+    the inverters deliver (see FeedForwardLaw.delivered):
+
+        output = delivered + kp * error + integral
+        integral += ki * dt * error
+
+    With kp = 1 and ki = 0 this is the feed-forward law; kp < 1 filters noise
+    in the DTU and Shelly readings, and the integral removes what is left over
+    (e.g. errors below the limit deadband). Anti-windup: the integral does not
+    grow while the inverters are still ramping towards their reported limits,
+    and when the output is clamped to the combined minimum/maximum of the
+    active inverters the integral is pulled back by the clamped amount.
+    """
+    name = 'pi'
+
+    def __init__(self, kp=0.8, ki=0.02, tracking_band=50.0, max_dt=30.0, clock=time.monotonic):
+        super().__init__(tracking_band)
+        self.kp = kp
+        self.ki = ki
+        self.max_dt = max_dt
+        self.clock = clock
+        self.integral = 0.0
+        self.last_time = None
+        self.held = 0
+
+    def target(self, grid_power, statuses, active, offset):
+        now = self.clock()
+        error = grid_power - offset
+        delivered = self.delivered(statuses, active)
+        reported = sum(statuses[inverter.serial].limit for inverter in active)
+        dt = 0.0 if self.last_time is None else min(max(0.0, now - self.last_time), self.max_dt)
+        self.last_time = now
+        if error > 0 and reported - delivered > self.tracking_band:
+            self.held += 1
+        else:
+            self.integral += self.ki * dt * error
+        output = delivered + self.kp * error + self.integral
+        lower = sum(inverter.minimum for inverter in active)
+        upper = sum(inverter.maximum for inverter in active)
+        clamped = max(lower, min(upper, output))
+        self.integral -= output - clamped
+        return clamped
+
+    def reset(self):
+        super().reset()
+        self.integral = 0.0
+        self.last_time = None
+
+    def snapshot(self):
+        return {**super().snapshot(), 'integral': round(self.integral, 1)}
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self.integral = snapshot.get('integral', 0.0)
+
+CONTROL_LAWS = {law.name: law for law in (ProportionalLaw, PILaw, FeedForwardLaw)}
+
+def make_law(name='proportional', **params):
+    """Control law by name ('proportional', 'pi', 'feedforward'); params go to its constructor."""
+    try:
+        return CONTROL_LAWS[name](**params)
+    except KeyError:
+        raise ValueError(f"Unknown control law {name!r}; available: {', '.join(CONTROL_LAWS)}") from None
+
+# ------------------------------------------------------------------------------
+# Controller
+# ------------------------------------------------------------------------------
+class Controller:
+    """
+    Computes new limits for all configured inverters from the grid power.
+
+    The control law turns grid power and inverter status into the total power
+    the inverters should deliver (default: the reported limits plus the grid
+    power, minus `offset` W so a small import remains); the total is then split
+    with distribute(). Inverters are matched to the DTU data by serial;
+    unreachable or missing inverters are left out of the distribution.
+    """
+    def __init__(self, inverters, offset=5, law=None):
+        self.inverters = list(inverters)
+        for inverter in self.inverters:
+            validate_inverter(inverter)
+        self.offset = offset
+        self.law = law if law is not None else ProportionalLaw()
+
+    def active(self, statuses):
+        """Configured inverters that are present in the DTU data and reachable."""
+        return [inverter for inverter in self.inverters
+                if inverter.serial in statuses and statuses[inverter.serial].reachable]
+
+    def target(self, grid_power, statuses):
+        return self.law.target(grid_power, statuses, self.active(statuses), self.offset)
+
+    def snapshot(self):
+        """State of the control law for the state file."""
+        return {'law': self.law.name, **self.law.snapshot()}
+
+    def restore(self, snapshot):
+        # State of a different law (configuration changed) is of no use
+        if snapshot.get('law') == self.law.name:
+            self.law.restore(snapshot)
+
+    def allocate(self, grid_power, statuses):
+        active = self.active(statuses)
+        if not active:
+            return Allocation({}, 0, 0, False)
+        target = self.target(grid_power, statuses)
+        setpoints, unserved = distribute(target, active)
+        saturated = all(setpoints[inverter.serial] >= inverter.maximum for inverter in active)
+        return Allocation(setpoints, target, unserved, saturated)
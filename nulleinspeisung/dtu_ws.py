@@ -0,0 +1,91 @@
+"""Streaming OpenDTU livedata: a per-serial state cache fed by the /livedata WebSocket."""
+import logging, time
+
+import aiohttp
+
+from nulleinspeisung.websocket import BackgroundWebSocket
+
+DEFAULT_MAX_AGE = 30.0          # Seconds without any livedata message before the cache counts as stale
+SEED_TIMEOUT = 5                # Seconds for the one status request after each connect
+
+def websocket_url(dtu_ip):
+    return f'ws://{dtu_ip}/livedata'
+
+class DtuLiveClient(BackgroundWebSocket):
+    """
+    Keeps reachable, producing, limit_absolute and AC power per inverter serial
+    from the OpenDTU /livedata WebSocket. OpenDTU only sends the inverters that
+    were polled since its last message, so every field is merged into the cache
+    as it arrives; after each (re)connect the cache is seeded once from the
+    status endpoint.
+
+    dtu_status() returns the cache in the shape of /api/livedata/status/inverters
+    without any I/O, or None while the socket is down or stale; the caller then
+    polls the status endpoint as before.
+    """
+    label = 'OpenDTU WebSocket'
+
+    def __init__(self, url, status_url, auth=None, max_age=DEFAULT_MAX_AGE, clock=time.monotonic):
+        super().__init__(url, auth=aiohttp.BasicAuth(*auth) if auth else None)
+        self.status_url = status_url
+        self.max_age = max_age
+        self.clock = clock
+        self.messages = 0
+        self._inverters = {}
+        self._total = None
+        self._updated = None
+
+    # -- called from the control loop -------------------------------------------
+    def dtu_status(self):
+        """Cached livedata as a DTU status dict, or None if it is not current."""
+        with self._lock:
+            if not self.connected or self._updated is None or self.clock() - self._updated > self.max_age:
+                return None
+            inverters = []
+            for state in self._inverters.values():
+                entry = {key: value for key, value in state.items() if key != 'power'}
+                if 'power' in state:
+                    entry['AC'] = {'0': {'Power': {'v': state['power']}}}
+                inverters.append(entry)
+            status = {'inverters': inverters}
+            if self._total is not None:
+                status['total'] = {'Power': {'v': self._total}}
+            return status
+
+    def format_stats(self):
+        return (f"{'connected' if self.connected else 'disconnected'}, {self.messages} messages, "
+                f"{len(self._inverters)} inverters, {self.connects} connects")
+
+    # -- WebSocket side ---------------------------------------------------------
+    async def on_connect(self, session, ws):
+        async with session.get(self.status_url, timeout=aiohttp.ClientTimeout(total=SEED_TIMEOUT)) as response:
+            response.raise_for_status()
+            self.on_message(await response.json(content_type=None))
+        logging.debug(f"OpenDTU livedata cache seeded: {self.format_stats()}")
+
+    def on_message(self, message):
+        with self._lock:
+            for inverter in message.get('inverters', []):
+                serial = str(inverter.get('serial', ''))
+                if not serial:
+                    continue
+                state = self._inverters.setdefault(serial, {'serial': serial})
+                for key in ('name', 'reachable', 'producing', 'limit_absolute'):
+                    if key in inverter:
+                        state[key] = inverter[key]
+                power = inverter.get('AC', {}).get('0', {}).get('Power', {}).get('v')
+                if power is not None:
+                    state['power'] = power
+            total = message.get('total', {}).get('Power', {}).get('v')
+            if total is not None:
+                self._total = total
+            self._updated = self.clock()
+            self.connected = True
+            self.messages += 1
+
+    def on_disconnect(self):
+        # A reconnect seeds a fresh snapshot; inverters removed from the DTU must not linger
+        with self._lock:
+            self._inverters.clear()
+            self._total = None
+            self._updated = None
@@ -0,0 +1,277 @@
+"""Fleet mode: many DTU/Shelly sites controlled from one asyncio event loop."""
+import asyncio, json, logging, random, time
+
+import aiohttp
+
+from nulleinspeisung import metrics
+from nulleinspeisung.breaker import CircuitBreaker, CircuitOpenError
+from nulleinspeisung.controller import Controller, Inverter, make_law, parse_inverters, validate_inverter
+from nulleinspeisung.limits import DEFAULT_DEADBAND, DEFAULT_MIN_HOLD, LimitCache
+from nulleinspeisung.scheduler import CycleScheduler
+
+# ------------------------------------------------------------------------------
+# Defaults
+# ------------------------------------------------------------------------------
+DEFAULT_TIMEOUT = 5             # Seconds per request, as in the single-site scripts
+DEFAULT_CONNECTIONS_PER_HOST = 2
+SUMMARY_INTERVAL = 60           # Seconds between two fleet summary log lines
+
+class SiteLogger(logging.LoggerAdapter):
+    """Prefixes every message with the site name."""
+    def process(self, msg, kwargs):
+        return f"[{self.extra['site']}] {msg}", kwargs
+
+# ------------------------------------------------------------------------------
+# One site (DTU + Shelly + its inverters)
+# ------------------------------------------------------------------------------
+class Site:
+    """
+    All state of one house: controller, limit cache and scheduler are per site,
+    so one site failing or regulating badly never affects another one.
+    """
+    def __init__(self, name, dtu_url, shelly_url, inverters, dtu_user='admin', dtu_password='',
+                 offset=5, deadband=DEFAULT_DEADBAND, min_hold=DEFAULT_MIN_HOLD, interval=10.0,
+                 timeout=DEFAULT_TIMEOUT, writer=None, control_law='proportional'):
+        self.name = name
+        self.dtu_status_url = f'{dtu_url}/api/livedata/status/inverters'
+        self.dtu_config_url = f'{dtu_url}/api/limit/config'
+        self.shelly_status_url = f'{shelly_url}/rpc/EM.GetStatus?id=0'
+        self.auth = aiohttp.BasicAuth(dtu_user, dtu_password)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.inverters = list(inverters)
+        self.controller = Controller(self.inverters, offset=offset, law=make_law(control_law))
+        self.limit_cache = LimitCache(deadband=deadband, min_hold=min_hold)
+        self.log = SiteLogger(logging.getLogger(), {'site': name})
+        self.scheduler = CycleScheduler(interval=interval, logger=self.log)
+        # A dead device of this site is skipped instead of costing a timeout every cycle
+        self.dtu_breaker = CircuitBreaker('DTU', logger=self.log)
+        self.shelly_breaker = CircuitBreaker('Shelly', logger=self.log)
+        self.writer = writer
+        self.cycles = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_cycle_duration = None
+
+    async def request(self, session, breaker, method, url, **kwargs):
+        """Send one request through the circuit breaker of its device and return the JSON body."""
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} circuit open, next probe in {breaker.retry_in():.0f} s")
+        resolved = False
+        try:
+            async with session.request(method, url, timeout=self.timeout, **kwargs) as response:
+                # Any HTTP answer, even an error status, means the device is up
+                breaker.record_success()
+                resolved = True
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            breaker.record_failure()
+            resolved = True
+            raise
+        except Exception:
+            # Not a transport failure (e.g. a malformed reply); the device did answer
+            breaker.record_success()
+            resolved = True
+            raise
+        finally:
+            if not resolved:
+                # Cancelled before any answer: a half-open probe must not keep the circuit blocked
+                breaker.release()
+
+    async def fetch_dtu_status(self, session):
+        try:
+            with metrics.STAGE_DURATION.time(site=self.name, stage='dtu_fetch'):
+                return await self.request(session, self.dtu_breaker, 'GET', self.dtu_status_url)
+        except CircuitOpenError:
+            metrics.ERRORS.inc(site=self.name, source='dtu', reason='circuit_open')
+            return None
+        except Exception as e:
+            metrics.ERRORS.inc(site=self.name, source='dtu', reason='request')
+            self.log.error("❌ Error fetching DTU status: %r", e)
+            return None
+
+    async def fetch_shelly_data(self, session):
+        try:
+            with metrics.STAGE_DURATION.time(site=self.name, stage='shelly_fetch'):
+                r = await self.request(session, self.shelly_breaker, 'GET', self.shelly_status_url)
+            grid_sum = r.get('total_act_power', None)
+            if grid_sum is None:
+                raise ValueError("total_act_power not found in Shelly response")
+            return grid_sum
+        except CircuitOpenError:
+            metrics.ERRORS.inc(site=self.name, source='shelly', reason='circuit_open')
+            return None
+        except Exception as e:
+            metrics.ERRORS.inc(site=self.name, source='shelly', reason='request')
+            self.log.error("❌ Error fetching Shelly data: %r", e)
+            return None
+
+    async def update_inverter_limit(self, session, inverter, old_limit, new_limit):
+        if not self.limit_cache.should_send(inverter.serial, new_limit):
+            return
+        data_payload = f'data={{"serial":"{inverter.serial}", "limit_type":0, "limit_value":{new_limit}}}'
+        self.log.debug("🔄 Updating %s limit from %s W to %s W", inverter.name, old_limit, new_limit)
+        try:
+            with metrics.STAGE_DURATION.time(site=self.name, stage='limit_post', inverter=inverter.serial):
+                await self.request(session, self.dtu_breaker, 'POST', self.dtu_config_url, data=data_payload,
+                                   auth=self.auth, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+            self.limit_cache.record_sent(inverter.serial, new_limit)
+        except Exception as e:
+            metrics.ERRORS.inc(site=self.name, source='limit_update')
+            self.log.error("❌ Error updating inverter limit for serial %s: %r", inverter.serial, e)
+
+    async def run_cycle(self, session):
+        """One control cycle: fetch both devices in parallel, distribute, send, store."""
+        started = time.monotonic()
+        dtu_status, grid_sum = await asyncio.gather(self.fetch_dtu_status(session),
+                                                    self.fetch_shelly_data(session))
+        statuses = parse_inverters(dtu_status) if dtu_status is not None else {}
+        for status in statuses.values():
+            if status.reachable:
+                self.limit_cache.record_ack(status.serial, status.limit)
+
+        allocation = None
+        if grid_sum is not None and statuses:
+            with metrics.STAGE_DURATION.time(site=self.name, stage='compute'):
+                allocation = self.controller.allocate(grid_sum, statuses)
+            await asyncio.gather(*(
+                self.update_inverter_limit(session, inverter, statuses[inverter.serial].limit,
+                                           allocation.setpoints[inverter.serial])
+                for inverter in self.controller.active(statuses)))
+
+        total_production = dtu_status.get('total', {}).get('Power', {}).get('v', 0) if dtu_status else None
+        self.log.debug("⚡ Grid Power: %s W | 🏭 Total Production: %s W | setpoints %s",
+                       grid_sum, total_production, allocation.setpoints if allocation else None)
+        metrics.GRID_POWER.set(grid_sum, site=self.name)
+        metrics.TOTAL_PRODUCTION.set(total_production, site=self.name)
+        metrics.record_circuit(self.dtu_breaker, site=self.name)
+        metrics.record_circuit(self.shelly_breaker, site=self.name)
+        for inverter in self.inverters:
+            metrics.record_inverter(inverter, statuses.get(inverter.serial),
+                                    allocation.setpoints.get(inverter.serial) if allocation else None, site=self.name)
+        if self.writer is not None:
+            rows = []
+            for inverter in self.inverters:
+                status = statuses.get(inverter.serial)
+                rows.append((inverter.serial, status.power if status is not None else None,
+                             allocation.setpoints.get(inverter.serial) if allocation else None,
+                             1 if status is not None and status.reachable else 0))
+            # power_data keeps its inverter columns for the first two inverters; inverter_data has all of them
+            columns = {}
+            for index, (_, power, setpoint, reachable) in enumerate(rows[:2], start=1):
+                columns[f'inverter{index}_power'] = power
+                columns[f'inverter{index}_reachable'] = reachable
+                columns[f'inverter{index}_setpoint'] = setpoint
+            self.writer.submit(site=self.name, inverters=rows, grid_power=grid_sum, total_production=total_production,
+                               dtus_error=0 if dtu_status is not None else self.dtu_breaker.error_code(),
+                               shelly_error=0 if grid_sum is not None else self.shelly_breaker.error_code(),
+                               **columns)
+        self.last_cycle_duration = time.monotonic() - started
+        metrics.STAGE_DURATION.observe(self.last_cycle_duration, site=self.name, stage='cycle')
+        metrics.CYCLES.inc(site=self.name)
+        return grid_sum, allocation
+
+    async def run(self, session, start_delay=0.0):
+        """Run control cycles until cancelled. Exceptions are logged and counted per site."""
+        if start_delay:
+            await asyncio.sleep(start_delay)
+        self.scheduler.reset()
+        while True:
+            grid_sum, saturated = None, False
+            try:
+                grid_sum, allocation = await self.run_cycle(session)
+                saturated = allocation is not None and allocation.saturated
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = repr(e)
+                self.log.error("❌ Control cycle failed: %r", e, exc_info=True)
+            self.cycles += 1
+            await asyncio.sleep(self.scheduler.next_delay(grid_power=grid_sum, saturated=saturated))
+
+# ------------------------------------------------------------------------------
+# Fleet runner
+# ------------------------------------------------------------------------------
+class Fleet:
+    """Runs the control loop of every site as a task in one event loop with one shared HTTP session."""
+    def __init__(self, sites, connections_per_host=DEFAULT_CONNECTIONS_PER_HOST):
+        self.sites = list(sites)
+        self.connections_per_host = connections_per_host
+
+    async def run(self, duration=None):
+        """Run all sites; forever, or for `duration` seconds (benchmarks)."""
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.connections_per_host,
+                                         keepalive_timeout=30)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            # Spread the sites over one interval so they do not all poll at the same moment
+            tasks = [asyncio.create_task(site.run(session, random.uniform(0, site.scheduler.interval)),
+                                         name=f"site-{site.name}")
+                     for site in self.sites]
+            summary = asyncio.create_task(self._log_summary())
+            try:
+                if duration is None:
+                    await asyncio.gather(*tasks)
+                else:
+                    await asyncio.sleep(duration)
+            finally:
+                for task in tasks + [summary]:
+                    task.cancel()
+                await asyncio.gather(*tasks, summary, return_exceptions=True)
+
+    async def _log_summary(self):
+        while True:
+            await asyncio.sleep(SUMMARY_INTERVAL)
+            stats = self.stats()
+            logging.info("🏘️ Fleet: %s sites, %s cycles, %s failed cycles, %s missed deadlines.",
+                         stats['sites'], stats['cycles'], stats['errors'], stats['missed_deadlines'])
+
+    def stats(self):
+        return {
+            'sites': len(self.sites),
+            'cycles': sum(site.cycles for site in self.sites),
+            'errors': sum(site.errors for site in self.sites),
+            'missed_deadlines': sum(site.scheduler.missed for site in self.sites),
+        }
+
+# ------------------------------------------------------------------------------
+# Configuration
+# ------------------------------------------------------------------------------
+def load_config(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def sites_from_config(config, writer=None):
+    """
+    Build Site objects from a fleet config dict. Each site needs dtu_ip (or dtu_url),
+    shelly_ip (or shelly_url) and an inverters list; everything else has defaults.
+    """
+    defaults = config.get('defaults', {})
+    sites = []
+    for entry in config['sites']:
+        entry = {**defaults, **entry}
+        inverters = [Inverter(serial=str(inv['serial']), minimum=inv['minimum'], maximum=inv['maximum'],
+                              priority=inv.get('priority', 0), weight=inv.get('weight', 1.0),
+                              name=inv.get('name', f"Inverter {index}"))
+                     for index, inv in enumerate(entry['inverters'], start=1)]
+        for inverter in inverters:
+            try:
+                validate_inverter(inverter)
+            except ValueError as e:
+                raise ValueError(f"Site {entry['name']}: {e}") from None
+        sites.append(Site(
+            name=entry['name'],
+            dtu_url=entry.get('dtu_url', f"http://{entry.get('dtu_ip')}"),
+            shelly_url=entry.get('shelly_url', f"http://{entry.get('shelly_ip')}"),
+            inverters=inverters,
+            dtu_user=entry.get('dtu_user', 'admin'),
+            dtu_password=entry.get('dtu_password', ''),
+            offset=entry.get('power_offset', 5),
+            deadband=entry.get('limit_deadband', DEFAULT_DEADBAND),
+            min_hold=entry.get('limit_min_hold', DEFAULT_MIN_HOLD),
+            interval=entry.get('cycle_interval', 10),
+            timeout=entry.get('timeout', DEFAULT_TIMEOUT),
+            writer=writer,
+            control_law=entry.get('control_law', 'proportional'),
+        ))
+    return sites
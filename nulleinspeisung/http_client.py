@@ -0,0 +1,144 @@
+"""Shared keep-alive HTTP layer for all OpenDTU and Shelly requests."""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+from nulleinspeisung.breaker import CircuitOpenError
+
+# ------------------------------------------------------------------------------
+# Defaults
+# ------------------------------------------------------------------------------
+DEFAULT_TIMEOUT = 5         # Seconds, same as the scripts used before
+DEFAULT_POOL_MAXSIZE = 2    # Keep-alive connections per device; the ESP32s handle only a few sockets
+
+class KeepAliveRetry(Retry):
+    """
+    Retry that never repeats a request after a timeout: a hung device would
+    otherwise cost the timeout twice per request. Only resets (a stale
+    keep-alive socket) and refused connections are retried.
+
+    Timeouts are raised the way requests expects them from an exhausted Retry
+    (connect timeouts wrapped in MaxRetryError), so they still arrive as
+    requests.ConnectTimeout / requests.ReadTimeout.
+    """
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if isinstance(error, ReadTimeoutError):
+            raise error.with_traceback(_stacktrace)
+        if isinstance(error, ConnectTimeoutError) and not isinstance(error, NewConnectionError):
+            raise MaxRetryError(_pool, url, error) from error
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+# A stale keep-alive socket is replaced once. Connect errors are retried for every
+# method (nothing was sent yet), read errors only for GETs so a limit POST is never sent twice.
+DEFAULT_RETRY = KeepAliveRetry(total=1, connect=1, read=1, status=0, allowed_methods=frozenset({'GET'}))
+
+_clients = []
+_clients_lock = threading.Lock()
+
+# ------------------------------------------------------------------------------
+# Device client
+# ------------------------------------------------------------------------------
+class DeviceClient:
+    """
+    One requests.Session per device (host) with a small connection pool.
+    Authentication and default headers are built once and reused for every call.
+
+    With a CircuitBreaker, timeouts and refused connections are counted and
+    requests raise CircuitOpenError right away while the device is considered
+    down, instead of waiting for the timeout again.
+    """
+    def __init__(self, name, auth=None, headers=None, timeout=DEFAULT_TIMEOUT,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, retry=DEFAULT_RETRY, breaker=None):
+        self.name = name
+        self.timeout = timeout
+        self.breaker = breaker
+        self.session = requests.Session()
+        if auth is not None:
+            self.session.auth = HTTPBasicAuth(*auth) if isinstance(auth, tuple) else auth
+        if headers:
+            self.session.headers.update(headers)
+        # One host per client, so a single pool is enough; pool_block keeps the
+        # socket count on the device bounded even if several threads send at once.
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize,
+                                   max_retries=retry, pool_block=True)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        with _clients_lock:
+            _clients.append(self)
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.breaker is None:
+            return self.session.request(method, url, **kwargs)
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit open, next probe in {self.breaker.retry_in():.0f} s")
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            # Not a transport failure (e.g. an invalid URL); says nothing about the device
+            self.breaker.record_success()
+            raise
+        # Any HTTP answer, even an error status, means the device is up
+        self.breaker.record_success()
+        return response
+
+    def get(self, url, **kwargs):
+        response = self._request('GET', url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def get_json(self, url, **kwargs):
+        return self.get(url, **kwargs).json()
+
+    def post(self, url, data=None, **kwargs):
+        response = self._request('POST', url, data=data, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def stats(self):
+        """
+        Connection reuse metrics summed over all pools of this client:
+        requests sent, TCP connections opened and requests served on a reused connection.
+        """
+        requests_sent = 0
+        connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+        return {
+            'requests': requests_sent,
+            'connections': connections,
+            'reused': max(0, requests_sent - connections),
+        }
+
+    def close(self):
+        self.session.close()
+        with _clients_lock:
+            if self in _clients:
+                _clients.remove(self)
+
+# ------------------------------------------------------------------------------
+# Helpers
+# ------------------------------------------------------------------------------
+def connection_stats():
+    """Return {client name: stats} for every open DeviceClient."""
+    with _clients_lock:
+        clients = list(_clients)
+    return {client.name: client.stats() for client in clients}
+
+def format_connection_stats():
+    """One-line summary for debug logging, e.g. 'dtu 120 req/3 conn, shelly 60 req/1 conn'."""
+    return ", ".join(f"{name} {s['requests']} req/{s['connections']} conn"
+                     for name, s in connection_stats().items())
@@ -0,0 +1,75 @@
+"""Confirmation of sent limit commands from the OpenDTU limit status API."""
+import logging, threading
+
+DEFAULT_INTERVAL = 1.0          # Seconds between two polls while a command is pending
+
+class LimitStatusPoller:
+    """
+    While the LimitCache has pending commands, GETs /api/limit/status every
+    `interval` seconds on a background thread. OpenDTU answers per serial with
+    limit_relative, max_power and limit_set_status ('Ok', 'Pending',
+    'Failure'). A pending command is confirmed once the status is Ok and the
+    limit matches, and rejected on Failure so the next cycle can send again.
+    Nothing is polled while no command is pending.
+    """
+    def __init__(self, client, url, cache, interval=DEFAULT_INTERVAL):
+        self.client = client
+        self.url = url
+        self.cache = cache
+        self.interval = interval
+        self.polls = 0
+        self.errors = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='limit-status', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self):
+        """A command was sent; start polling."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            pending = self.cache.pending_serials()
+            if not pending:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            if self._stop.wait(self.interval):
+                return
+            try:
+                status = self.client.get_json(self.url)
+            except Exception as e:
+                self.errors += 1
+                logging.debug("Limit status request failed: %r", e)
+                continue
+            self.polls += 1
+            self.apply(status, pending)
+
+    def apply(self, status, serials):
+        """Confirm or reject the pending commands of `serials` from one limit status response."""
+        for serial in serials:
+            inverter = status.get(serial)
+            if not isinstance(inverter, dict):
+                continue
+            state = inverter.get('limit_set_status')
+            if state == 'Failure':
+                logging.warning("⚠️ DTU reports that the limit command for %s failed.", serial)
+                self.cache.reject(serial)
+            elif state == 'Ok':
+                pending = self.cache.entry(serial).pending
+                max_power = inverter.get('max_power') or 0
+                if pending is None:
+                    continue
+                # Without max_power the relative limit cannot be checked; Ok after our command must do
+                if max_power and abs(inverter.get('limit_relative', 0) * max_power / 100 - pending) \
+                        > self.cache.ack_tolerance:
+                    continue
+                self.cache.confirm(serial)
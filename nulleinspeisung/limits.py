@@ -0,0 +1,194 @@
+"""Per-inverter cache of commanded/acknowledged limits to suppress redundant DTU writes."""
+import threading, time
+
+# ------------------------------------------------------------------------------
+# Defaults
+# ------------------------------------------------------------------------------
+DEFAULT_DEADBAND = 20       # W; smaller changes are not sent
+DEFAULT_MIN_HOLD = 30.0     # s; minimum time between two commands to the same inverter
+DEFAULT_URGENT_DELTA = 200  # W; changes at least this big ignore the hold time
+DEFAULT_ACK_TOLERANCE = 10  # W; a reported limit this close to the command counts as applied
+DEFAULT_ACK_TIMEOUT = 30.0  # s; a command not applied by then counts as lost
+
+class LimitEntry:
+    """
+    Last commanded and last acknowledged (DTU reported) limit of one inverter,
+    and the command that was sent but is not applied yet (pending).
+    """
+    __slots__ = ('commanded', 'commanded_at', 'acknowledged', 'acknowledged_at', 'sent', 'suppressed',
+                 'pending', 'pending_since', 'apply_latency', 'applied', 'lost')
+
+    def __init__(self):
+        self.commanded = None
+        self.commanded_at = None
+        self.acknowledged = None
+        self.acknowledged_at = None
+        self.sent = 0
+        self.suppressed = 0
+        self.pending = None
+        self.pending_since = None
+        self.apply_latency = None   # s from the POST to the confirmation of the last applied command
+        self.applied = 0
+        self.lost = 0
+
+# ------------------------------------------------------------------------------
+# Limit cache
+# ------------------------------------------------------------------------------
+class LimitCache:
+    """
+    Decides per serial whether a new setpoint is worth a radio command.
+
+    A limit is sent when it differs from the last commanded limit by at least
+    `deadband` W and the last command is older than `min_hold` s (or the change
+    is at least `urgent_delta` W). A command is repeated when the DTU keeps
+    reporting a limit that is off by more than the deadband after the hold time,
+    so lost commands are retried.
+
+    A sent command stays pending until the DTU reports it as applied
+    (record_ack() with a limit within `ack_tolerance` W, or confirm() from the
+    limit status API) or `ack_timeout` s have passed. While a command is
+    pending, no further command is sent to that inverter. `on_applied(serial,
+    limit, latency)` is called for every confirmed command.
+    """
+    def __init__(self, deadband=DEFAULT_DEADBAND, min_hold=DEFAULT_MIN_HOLD,
+                 urgent_delta=DEFAULT_URGENT_DELTA, ack_tolerance=DEFAULT_ACK_TOLERANCE,
+                 ack_timeout=DEFAULT_ACK_TIMEOUT, on_applied=None, clock=time.monotonic):
+        self.deadband = deadband
+        self.min_hold = min_hold
+        self.urgent_delta = urgent_delta
+        self.ack_tolerance = ack_tolerance
+        self.ack_timeout = ack_timeout
+        self.on_applied = on_applied
+        self.clock = clock
+        self.entries = {}
+        # record_sent() and confirm() may run on other threads than the control loop
+        self._lock = threading.Lock()
+
+    def entry(self, serial):
+        if serial not in self.entries:
+            self.entries[serial] = LimitEntry()
+        return self.entries[serial]
+
+    def record_ack(self, serial, limit):
+        """Remember the limit the DTU currently reports (limit_absolute) for this inverter."""
+        entry = self.entry(serial)
+        entry.acknowledged = limit
+        entry.acknowledged_at = self.clock()
+        pending = entry.pending
+        if pending is not None and abs(limit - pending) <= self.ack_tolerance:
+            self.confirm(serial)
+
+    def confirm(self, serial):
+        """The pending command of this inverter is applied; returns the apply latency (None if none was pending)."""
+        with self._lock:
+            entry = self.entry(serial)
+            if entry.pending is None:
+                return None
+            limit, latency = entry.pending, self.clock() - entry.pending_since
+            entry.pending = entry.pending_since = None
+            entry.apply_latency = latency
+            entry.applied += 1
+        if self.on_applied is not None:
+            self.on_applied(serial, limit, latency)
+        return latency
+
+    def reject(self, serial):
+        """The DTU reports that the pending command failed; the next cycle may send again."""
+        with self._lock:
+            entry = self.entry(serial)
+            if entry.pending is not None:
+                entry.pending = entry.pending_since = None
+                entry.lost += 1
+
+    def is_pending(self, serial):
+        """True while a sent command waits for its confirmation (expires after ack_timeout)."""
+        with self._lock:
+            entry = self.entry(serial)
+            if entry.pending is None:
+                return False
+            if self.clock() - entry.pending_since < self.ack_timeout:
+                return True
+            entry.pending = entry.pending_since = None
+            entry.lost += 1
+            return False
+
+    def pending_serials(self):
+        return [serial for serial in list(self.entries) if self.is_pending(serial)]
+
+    def should_send(self, serial, new_limit):
+        """Return True if new_limit should be sent; counts suppressed writes otherwise."""
+        entry = self.entry(serial)
+        if self.is_pending(serial):
+            # The DTU has not applied the last command yet, so its limit_absolute is stale
+            entry.suppressed += 1
+            return False
+        now = self.clock()
+        reference = entry.commanded if entry.commanded is not None else entry.acknowledged
+        held = entry.commanded_at is not None and now - entry.commanded_at < self.min_hold
+
+        if reference is None:
+            send = True
+        else:
+            delta = abs(new_limit - reference)
+            if delta >= self.urgent_delta:
+                send = True
+            elif delta >= self.deadband:
+                send = not held
+            else:
+                # Same as last command; resend only if the DTU never applied it
+                unapplied = (entry.acknowledged is not None
+                             and abs(entry.acknowledged - new_limit) >= self.deadband)
+                send = unapplied and not held
+        if not send:
+            entry.suppressed += 1
+        return send
+
+    def record_sent(self, serial, limit):
+        """Remember a limit that was successfully posted to the DTU; it is pending until confirmed."""
+        with self._lock:
+            entry = self.entry(serial)
+            entry.commanded = limit
+            entry.commanded_at = self.clock()
+            entry.sent += 1
+            entry.pending = limit
+            entry.pending_since = entry.commanded_at
+
+    def snapshot(self, wall=time.time):
+        """
+        Commanded/acknowledged limits per serial for the state file. Timestamps
+        are converted from this cache's clock to wall clock time, so they stay
+        meaningful across a restart.
+        """
+        offset = wall() - self.clock()
+        return {serial: {
+                    'commanded': entry.commanded,
+                    'commanded_at': None if entry.commanded_at is None else round(entry.commanded_at + offset, 3),
+                    'acknowledged': entry.acknowledged,
+                    'acknowledged_at': None if entry.acknowledged_at is None else round(entry.acknowledged_at + offset, 3),
+                } for serial, entry in self.entries.items()}
+
+    def restore(self, snapshot, serials=None, wall=time.time):
+        """Load a snapshot() (only `serials` if given); the hold time keeps running from the saved command."""
+        offset = wall() - self.clock()
+        for serial, saved in snapshot.items():
+            if serials is not None and serial not in serials:
+                continue
+            entry = self.entry(serial)
+            entry.commanded = saved.get('commanded')
+            entry.acknowledged = saved.get('acknowledged')
+            for field in ('commanded_at', 'acknowledged_at'):
+                if saved.get(field) is not None:
+                    setattr(entry, field, saved[field] - offset)
+
+    @property
+    def sent(self):
+        return sum(entry.sent for entry in self.entries.values())
+
+    @property
+    def suppressed(self):
+        return sum(entry.suppressed for entry in self.entries.values())
+
+    def format_stats(self):
+        """Short summary for logging, e.g. '12 sent, 348 suppressed, 1 pending'."""
+        pending = sum(entry.pending is not None for entry in list(self.entries.values()))
+        return f"{self.sent} sent, {self.suppressed} suppressed, {pending} pending"
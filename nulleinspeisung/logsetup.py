@@ -0,0 +1,102 @@
+"""Queue-based logging: the control loop only enqueues records, a listener thread formats and writes them."""
+import atexit, datetime, json, logging, logging.handlers, queue, sys
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+LOG_DATEFMT = '%H:%M:%S'
+MAX_QUEUED_RECORDS = 10000      # Records beyond this are dropped instead of blocking the loop
+
+# ------------------------------------------------------------------------------
+# Formatters
+# ------------------------------------------------------------------------------
+class ColorFormatter(logging.Formatter):
+    """Colored level names with emojis for interactive terminals. Leaves the record itself unchanged."""
+    COLORS = {
+        "DEBUG": "\033[34m",    # Blue
+        "INFO": "\033[32m",     # Green
+        "WARNING": "\033[33m",  # Yellow
+        "ERROR": "\033[31m",    # Red
+        "CRITICAL": "\033[1;31m"  # Bold Red
+    }
+    RESET = "\033[0m"
+    EMOJIS = {
+        "DEBUG": "🔍",
+        "INFO": "💡",
+        "WARNING": "⚠️",
+        "ERROR": "❌",
+        "CRITICAL": "🛑"
+    }
+    def format(self, record):
+        levelname = record.levelname
+        if levelname not in self.COLORS:
+            return super().format(record)
+        record.levelname = f"{self.COLORS[levelname]}{self.EMOJIS[levelname]} {levelname}{self.RESET}"
+        try:
+            return super().format(record)
+        finally:
+            # Other handlers (e.g. the JSON output) must see the plain level name
+            record.levelname = levelname
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line (journald, Loki, jq)."""
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec='milliseconds'),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'logger': record.name,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# ------------------------------------------------------------------------------
+# Queue handler
+# ------------------------------------------------------------------------------
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    The stock QueueHandler formats the message in the calling thread. This one
+    enqueues the record as is, so merging %-style arguments, formatting
+    tracebacks and writing to the terminal all happen on the listener thread.
+    A full queue drops the record instead of blocking the control loop.
+    """
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LazyQueueHandler.dropped += 1
+
+def setup_logging(level=logging.INFO, json_output=False, stream=None, fmt=LOG_FORMAT, datefmt=LOG_DATEFMT,
+                  color=None):
+    """
+    Route all logging through a queue to a listener thread writing to `stream`
+    (default stdout). ColorFormatter is used only if the stream is a TTY (or
+    color=True), JsonFormatter with json_output. Returns the started listener;
+    it is stopped (and the queue drained) at exit.
+    """
+    stream = stream if stream is not None else sys.stdout
+    use_color = stream.isatty() if color is None else color
+    handler = logging.StreamHandler(stream)
+    if json_output:
+        handler.setFormatter(JsonFormatter())
+    elif use_color:
+        handler.setFormatter(ColorFormatter(fmt=fmt, datefmt=datefmt))
+    else:
+        handler.setFormatter(logging.Formatter(fmt=fmt, datefmt=datefmt))
+
+    log_queue = queue.Queue(MAX_QUEUED_RECORDS)
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,247 @@
+"""Prometheus/OpenMetrics endpoint with gauges, error counters and per-stage latency histograms."""
+import bisect, logging, math, threading, time, urllib.parse
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from nulleinspeisung.breaker import CLOSED
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Seconds; covers a fast LAN request (a few ms) up to the 5 s request timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _format_labels(pairs):
+    """Label set in exposition format; empty values are left out (Prometheus treats them as absent)."""
+    pairs = [(name, value) for name, value in pairs if value != '']
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+# ------------------------------------------------------------------------------
+# Metric types
+# ------------------------------------------------------------------------------
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        unknown = set(labels) - set(self.labelnames)
+        if unknown:
+            raise ValueError(f"Unknown labels for {self.name}: {sorted(unknown)}")
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def family_name(self, openmetrics):
+        return self.name
+
+    def samples(self):
+        """(suffix, label pairs, value) for every series."""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', list(zip(self.labelnames, key)), value
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        """Set the gauge; None (no measurement) removes the series instead of exporting a stale value."""
+        if value is None:
+            self.remove(**labels)
+            return
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirror a running total that is counted elsewhere (it must never decrease)."""
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def family_name(self, openmetrics):
+        # OpenMetrics names the family without the _total suffix of its sample
+        if openmetrics and self.name.endswith('_total'):
+            return self.name[:-len('_total')]
+        return self.name
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in items:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield '_bucket', pairs + [('le', _format_value(bound))], cumulative
+            yield '_count', pairs, cumulative
+            yield '_sum', pairs, total
+
+# ------------------------------------------------------------------------------
+# Registry and exposition
+# ------------------------------------------------------------------------------
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, openmetrics=False):
+        """All metrics in Prometheus text format 0.0.4, or OpenMetrics 1.0 if requested."""
+        lines = []
+        for metric in self._metrics:
+            family = metric.family_name(openmetrics)
+            lines.append(f"# HELP {family} {metric.documentation}")
+            lines.append(f"# TYPE {family} {metric.type}")
+            for suffix, pairs, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(pairs)} {_format_value(value)}")
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+# ------------------------------------------------------------------------------
+# Control loop metrics (site is only set in fleet mode)
+# ------------------------------------------------------------------------------
+GRID_POWER = REGISTRY.register(Gauge(
+    'nulleinspeisung_grid_power_watts', "Grid power from the Shelly 3EM, positive = import", ['site']))
+TOTAL_PRODUCTION = REGISTRY.register(Gauge(
+    'nulleinspeisung_total_production_watts', "Total AC power reported by OpenDTU", ['site']))
+INVERTER_POWER = REGISTRY.register(Gauge(
+    'nulleinspeisung_inverter_power_watts', "AC power per inverter", ['site', 'inverter']))
+INVERTER_SETPOINT = REGISTRY.register(Gauge(
+    'nulleinspeisung_inverter_setpoint_watts', "Setpoint computed in the last cycle per inverter",
+    ['site', 'inverter']))
+INVERTER_REACHABLE = REGISTRY.register(Gauge(
+    'nulleinspeisung_inverter_reachable', "1 if OpenDTU reports the inverter as reachable", ['site', 'inverter']))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    'nulleinspeisung_stage_duration_seconds',
+    "Latency per control loop stage (dtu_fetch, shelly_fetch, compute, limit_post, limit_apply, sqlite_write, state_write, cycle)",
+    ['site', 'stage', 'inverter']))
+ERRORS = REGISTRY.register(Counter(
+    'nulleinspeisung_errors_total',
+    "Failures per source; for dtu and shelly, reason is request (dtus_error/shelly_error = 1) "
+    "or circuit_open (= 2, the device was skipped)",
+    ['site', 'source', 'reason']))
+CYCLES = REGISTRY.register(Counter(
+    'nulleinspeisung_cycles_total', "Completed control cycles", ['site']))
+IDLE = REGISTRY.register(Gauge(
+    'nulleinspeisung_idle', "1 while no inverter is producing and only the DTU is probed", ['site']))
+CIRCUIT_OPEN = REGISTRY.register(Gauge(
+    'nulleinspeisung_circuit_open', "1 while requests to the device are skipped (circuit open or half-open)",
+    ['site', 'device']))
+LIMIT_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'nulleinspeisung_limit_queue_depth', "Limit commands queued or in flight per inverter", ['site', 'inverter']))
+LOG_RECORDS_DROPPED = REGISTRY.register(Counter(
+    'nulleinspeisung_log_records_dropped_total',
+    "Log records dropped because the log queue was full (the terminal or journal did not keep up)", ['site']))
+LIMIT_COMMANDS_DROPPED = REGISTRY.register(Counter(
+    'nulleinspeisung_limit_commands_dropped_total',
+    "Limit commands that never went out: replaced by a newer value (coalesced) or already queued (duplicate)",
+    ['site', 'inverter', 'reason']))
+
+def record_inverter(inverter, status, setpoint, site=''):
+    """Export power, setpoint and reachability of one configured inverter (status may be None)."""
+    INVERTER_POWER.set(status.power if status is not None else None, site=site, inverter=inverter.name)
+    INVERTER_SETPOINT.set(setpoint, site=site, inverter=inverter.name)
+    INVERTER_REACHABLE.set(1 if status is not None and status.reachable else 0, site=site, inverter=inverter.name)
+
+def record_circuit(breaker, site=''):
+    """Export the state of one device's CircuitBreaker."""
+    CIRCUIT_OPEN.set(0 if breaker.state == CLOSED else 1, site=site, device=breaker.name)
+
+# ------------------------------------------------------------------------------
+# HTTP endpoint
+# ------------------------------------------------------------------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+    routes = {}
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        route = self.routes.get(path)
+        if route is not None:
+            status, content_type, body = route(urllib.parse.parse_qs(query))
+            self._reply(status, content_type, body, {'Access-Control-Allow-Origin': '*', 'Cache-Control': 'no-store'})
+            return
+        if path not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        body = self.registry.render(openmetrics=openmetrics).encode('utf-8')
+        self._reply(200, OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE, body)
+
+    def _reply(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics request from %s: " + format, self.client_address[0], *args)
+
+def start_http_server(port, addr='', registry=REGISTRY, routes=None):
+    """
+    Serve /metrics on a daemon thread; returns the server (server.shutdown() stops it).
+    `routes` adds GET paths: {path: handler(query dict) -> (status, content type, body bytes)}.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry, 'routes': dict(routes or {})})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
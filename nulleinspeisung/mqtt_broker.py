@@ -0,0 +1,187 @@
+"""Minimal in-process MQTT 3.1.1 broker: a local stand-in for tests and benchmarks, not for production."""
+import asyncio, logging, struct, threading
+
+# Packet types
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK = 1, 2, 3, 4, 8, 9
+UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 10, 11, 12, 13, 14
+
+def topic_matches(topic_filter, topic):
+    """MQTT wildcard match: '+' is one level, a trailing '#' any number of levels."""
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or (level != '+' and level != topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+def _packet(packet_type, body, flags=0):
+    header = bytearray([packet_type << 4 | flags])
+    length = len(body)
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+def _string(data, offset):
+    (length,) = struct.unpack_from('!H', data, offset)
+    return data[offset + 2:offset + 2 + length], offset + 2 + length
+
+def _encode_string(value):
+    value = value.encode('utf-8') if isinstance(value, str) else value
+    return struct.pack('!H', len(value)) + value
+
+class _Session:
+    def __init__(self, writer):
+        self.writer = writer
+        self.client_id = None
+        self.subscriptions = set()
+        self.will = None            # (topic, payload, retain)
+
+class LocalBroker:
+    """
+    Accepts any client (no authentication), QoS 0 and 1 publishes, retained
+    messages, wildcard subscriptions and last wills. Everything is delivered
+    with QoS 0. Every PUBLISH received is also recorded in `received` as
+    (client id, topic, payload bytes, retain), so a benchmark can inspect what
+    a client sent.
+
+    Runs on its own event loop in a background thread; stop() and start() again
+    keep the port, so a client's reconnect can be exercised.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.received = []
+        self.retained = {}
+        self.connections = 0
+        self.loop = None
+        self._server = None
+        self._sessions = set()
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name='mqtt-broker', daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self):
+        """Close the listener and drop every client connection (without sending their wills)."""
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(10)
+        self.loop = None
+
+    def messages(self, topic_filter='#'):
+        """Received (topic, payload) pairs matching topic_filter, in arrival order."""
+        return [(topic, payload) for _, topic, payload, _ in list(self.received) if topic_matches(topic_filter, topic)]
+
+    # -- event loop ---------------------------------------------------------------
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    async def _shutdown(self):
+        self._server.close()
+        for session in list(self._sessions):
+            session.will = None
+            session.writer.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        session = _Session(writer)
+        self._sessions.add(session)
+        self.connections += 1
+        clean = False
+        try:
+            while True:
+                first = await reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b''
+                packet_type, flags = first[0] >> 4, first[0] & 0x0F
+                if packet_type == DISCONNECT:
+                    clean = True
+                    break
+                self._dispatch(session, packet_type, flags, body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logging.debug(f"MQTT stand-in dropped {session.client_id}: {e!r}")
+        finally:
+            self._sessions.discard(session)
+            if not clean and session.will is not None:
+                self._route(*session.will)
+            writer.close()
+
+    def _dispatch(self, session, packet_type, flags, body):
+        if packet_type == CONNECT:
+            _, offset = _string(body, 0)                    # protocol name
+            connect_flags = body[offset + 1]
+            offset += 4                                     # level, flags, keep alive
+            client_id, offset = _string(body, offset)
+            session.client_id = client_id.decode('utf-8')
+            if connect_flags & 0x04:
+                will_topic, offset = _string(body, offset)
+                will_payload, offset = _string(body, offset)
+                session.will = (will_topic.decode('utf-8'), will_payload, bool(connect_flags & 0x20))
+            session.writer.write(_packet(CONNACK, b'\x00\x00'))
+        elif packet_type == PUBLISH:
+            qos, retain = (flags >> 1) & 0x03, bool(flags & 0x01)
+            topic, offset = _string(body, 0)
+            if qos:
+                packet_id = body[offset:offset + 2]
+                offset += 2
+                session.writer.write(_packet(PUBACK, packet_id))
+            topic, payload = topic.decode('utf-8'), body[offset:]
+            self.received.append((session.client_id, topic, payload, retain))
+            self._route(topic, payload, retain)
+        elif packet_type == SUBSCRIBE:
+            packet_id, offset, granted = body[:2], 2, bytearray()
+            while offset < len(body):
+                topic_filter, offset = _string(body, offset)
+                offset += 1                                 # requested QoS; everything is delivered with QoS 0
+                topic_filter = topic_filter.decode('utf-8')
+                session.subscriptions.add(topic_filter)
+                granted.append(0)
+                for topic, payload in self.retained.items():
+                    if topic_matches(topic_filter, topic):
+                        session.writer.write(_packet(PUBLISH, _encode_string(topic) + payload, flags=0x01))
+            session.writer.write(_packet(SUBACK, packet_id + bytes(granted)))
+        elif packet_type == UNSUBSCRIBE:
+            offset = 2
+            while offset < len(body):
+                topic_filter, offset = _string(body, offset)
+                session.subscriptions.discard(topic_filter.decode('utf-8'))
+            session.writer.write(_packet(UNSUBACK, body[:2]))
+        elif packet_type == PINGREQ:
+            session.writer.write(_packet(PINGRESP, b''))
+
+    def _route(self, topic, payload, retain):
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        message = _packet(PUBLISH, _encode_string(topic) + payload)
+        for session in list(self._sessions):
+            if any(topic_matches(topic_filter, topic) for topic_filter in session.subscriptions):
+                session.writer.write(message)
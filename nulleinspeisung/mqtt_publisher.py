@@ -0,0 +1,234 @@
+"""MQTT publisher for Home Assistant: discovery, change-only batched state and an outbound queue for outages."""
+import json, logging, threading, time
+from collections import OrderedDict
+
+import paho.mqtt.client as mqtt
+
+# ------------------------------------------------------------------------------
+# Defaults
+# ------------------------------------------------------------------------------
+DEFAULT_PORT = 1883
+DEFAULT_TOPIC = 'nulleinspeisung'
+DEFAULT_DISCOVERY_PREFIX = 'homeassistant'
+DEFAULT_MIN_INTERVAL = 30.0     # Seconds; changes within this time after a message wait for the next cycle
+DEFAULT_HEARTBEAT = 300.0       # Seconds; the state is sent at least this often, even if nothing changed
+DEFAULT_DEADBANDS = {           # Smallest change (W) that is worth a message, per kind of value
+    'grid_power': 20.0,
+    'power': 10.0,              # total_production and the AC power per inverter
+    'setpoint': 1.0,            # Setpoints and limits already change in LimitCache steps only
+}
+
+ONLINE, OFFLINE = 'online', 'offline'
+
+# Entities: (key suffix, name, component, unit, device class, deadband kind)
+GLOBAL_ENTITIES = [
+    ('grid_power', "Grid power", 'sensor', 'W', 'power', 'grid_power'),
+    ('total_production', "Total production", 'sensor', 'W', 'power', 'power'),
+    ('idle', "Idle", 'binary_sensor', None, None, None),
+]
+INVERTER_ENTITIES = [
+    ('power', "power", 'sensor', 'W', 'power', 'power'),
+    ('setpoint', "setpoint", 'sensor', 'W', 'power', 'setpoint'),
+    ('limit', "limit", 'sensor', 'W', 'power', 'setpoint'),
+    ('reachable', "reachable", 'binary_sensor', None, 'connectivity', None),
+]
+
+def _flag(value):
+    return 'ON' if value else 'OFF'
+
+# ------------------------------------------------------------------------------
+# Publisher
+# ------------------------------------------------------------------------------
+class MqttPublisher:
+    """
+    Publishes the status snapshot of each control cycle (the /api/status
+    document) as one retained JSON message on <topic>/state. Home Assistant
+    discovery configs point every entity at a key of that message, so one
+    message per cycle carries all readings and setpoints.
+
+    update() sends only when a value moved by more than its deadband since the
+    last message, a flag or setpoint changed, or `heartbeat` seconds passed.
+    Changes are batched: at most one message per `min_interval`, carrying the
+    newest values of the cycle that sends it.
+    While the broker is unreachable, messages wait in a local queue that keeps
+    the newest message per topic and is sent after the reconnect (paho retries
+    every 1-60 s); availability is reported on <topic>/availability, with a
+    last will for crashes.
+    """
+    def __init__(self, host, inverters, port=DEFAULT_PORT, username=None, password=None, topic=DEFAULT_TOPIC,
+                 discovery_prefix=DEFAULT_DISCOVERY_PREFIX, min_interval=DEFAULT_MIN_INTERVAL,
+                 heartbeat=DEFAULT_HEARTBEAT, deadbands=None, client_id=None, clock=time.monotonic):
+        self.host = host
+        self.port = port
+        self.inverters = list(inverters)
+        self.topic = topic
+        self.discovery_prefix = discovery_prefix
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+        self.deadbands = {**DEFAULT_DEADBANDS, **(deadbands or {})}
+        self.clock = clock
+        self.node_id = topic.replace('/', '_')
+        self.state_topic = f'{topic}/state'
+        self.availability_topic = f'{topic}/availability'
+        self.published = 0          # State messages handed to the client
+        self.suppressed = 0         # Cycles without a change worth a message, or too soon after the last one
+        self.queued = 0             # Messages that had to wait for a connection
+        self.connects = 0
+        self.connected = False
+        self._closing = False
+        self._kinds = self._entity_kinds()
+        self._last_values = None
+        self._last_sent = None
+        self._pending = OrderedDict()   # topic -> (payload, retain); newest message per topic
+        self._lock = threading.Lock()
+
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id or f'{self.node_id}-publisher')
+        if username is not None:
+            self.client.username_pw_set(username, password)
+        self.client.will_set(self.availability_topic, OFFLINE, qos=1, retain=True)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+
+    def start(self):
+        self.client.connect_async(self.host, self.port, keepalive=60)
+        self.client.loop_start()
+        return self
+
+    def close(self, timeout=2.0):
+        """Report offline and disconnect (pending messages are dropped)."""
+        with self._lock:
+            connected = self.connected
+            self._closing = True
+        if connected:
+            self.client.publish(self.availability_topic, OFFLINE, qos=1, retain=True).wait_for_publish(timeout)
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    # -- called from the control loop -------------------------------------------
+    def update(self, snapshot):
+        """Publish the snapshot if it differs enough from the last message; returns True if it was sent."""
+        values = self.values(snapshot)
+        now = self.clock()
+        with self._lock:
+            since = now - self._last_sent if self._last_sent is not None else None
+            due = since is None or since >= self.heartbeat
+            if not due and (since < self.min_interval or not self._changed(values)):
+                self.suppressed += 1
+                return False
+            self._last_values = values
+            self._last_sent = now
+            self.published += 1
+            self._send(self.state_topic, json.dumps(values, separators=(',', ':')), retain=True)
+            return True
+
+    def values(self, snapshot):
+        """Flat {key: value} state message from a status snapshot."""
+        values = {
+            'grid_power': _round(snapshot.get('grid_power')),
+            'total_production': _round(snapshot.get('total_production')),
+            'idle': _flag(snapshot.get('idle')),
+        }
+        for inverter in snapshot.get('inverters', []):
+            serial = inverter['serial']
+            values[f'{serial}_power'] = _round(inverter.get('power'))
+            values[f'{serial}_setpoint'] = inverter.get('setpoint')
+            values[f'{serial}_limit'] = inverter.get('limit')
+            values[f'{serial}_reachable'] = _flag(inverter.get('reachable'))
+        return values
+
+    def format_stats(self):
+        return (f"{'connected' if self.connected else 'disconnected'}, {self.published} sent, "
+                f"{self.suppressed} unchanged, {len(self._pending)} queued, {self.connects} connects")
+
+    # -- change detection -------------------------------------------------------
+    def _entity_kinds(self):
+        kinds = {key: kind for key, _, _, _, _, kind in GLOBAL_ENTITIES}
+        for inverter in self.inverters:
+            for suffix, _, _, _, _, kind in INVERTER_ENTITIES:
+                kinds[f'{inverter.serial}_{suffix}'] = kind
+        return kinds
+
+    def _changed(self, values):
+        last = self._last_values
+        if last is None or last.keys() != values.keys():
+            return True
+        for key, value in values.items():
+            previous = last[key]
+            if value == previous:
+                continue
+            kind = self._kinds.get(key)
+            if kind is None or value is None or previous is None or isinstance(value, str):
+                return True
+            if abs(value - previous) >= self.deadbands[kind]:
+                return True
+        return False
+
+    # -- connection -------------------------------------------------------------
+    def _send(self, topic, payload, retain):
+        """Publish now if connected, otherwise keep it (newest per topic) until the next connect. Needs _lock."""
+        if self.connected:
+            info = self.client.publish(topic, payload, qos=0, retain=retain)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self._pending.pop(topic, None)
+                return
+        self.queued += 1
+        self._pending[topic] = (payload, retain)
+        self._pending.move_to_end(topic)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logging.warning(f"⚠️ MQTT broker {self.host}:{self.port} refused the connection: {reason_code}")
+            return
+        with self._lock:
+            self.connected = True
+            self.connects += 1
+            pending, self._pending = self._pending, OrderedDict()
+            self._send(self.availability_topic, ONLINE, retain=True)
+            for topic, payload in self.discovery_messages():
+                self._send(topic, payload, retain=True)
+            for topic, (payload, retain) in pending.items():
+                self._send(topic, payload, retain)
+        logging.info(f"✅ Connected to MQTT broker {self.host}:{self.port}"
+                     f"{f' ({len(pending)} queued messages sent)' if pending else ''}.")
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        with self._lock:
+            was_connected, self.connected = self.connected, False
+        if was_connected and not self._closing:
+            logging.warning(f"⚠️ Lost connection to MQTT broker {self.host}:{self.port} ({reason_code}); "
+                            f"queueing messages until it is back.")
+
+    # -- Home Assistant discovery -----------------------------------------------
+    def discovery_messages(self):
+        """(topic, payload) of the retained discovery config of every entity."""
+        device = {'identifiers': [self.node_id], 'name': "Nulleinspeisung",
+                  'model': "OpenDTU + Shelly Pro 3EM zero export", 'manufacturer': "nulleinspeisung"}
+        entities = [(key, name, component, unit, device_class)
+                    for key, name, component, unit, device_class, _ in GLOBAL_ENTITIES]
+        for inverter in self.inverters:
+            label = inverter.name or inverter.serial
+            entities += [(f'{inverter.serial}_{suffix}', f"{label} {name}", component, unit, device_class)
+                         for suffix, name, component, unit, device_class, _ in INVERTER_ENTITIES]
+        messages = []
+        for key, name, component, unit, device_class in entities:
+            config = {
+                'name': name,
+                'unique_id': f'{self.node_id}_{key}',
+                'state_topic': self.state_topic,
+                'value_template': f'{{{{ value_json.{key} }}}}' if not key[0].isdigit()
+                                  else f"{{{{ value_json['{key}'] }}}}",
+                'availability_topic': self.availability_topic,
+                'device': device,
+            }
+            if unit is not None:
+                config['unit_of_measurement'] = unit
+                config['state_class'] = 'measurement'
+            if device_class is not None:
+                config['device_class'] = device_class
+            messages.append((f'{self.discovery_prefix}/{component}/{self.node_id}/{key}/config',
+                             json.dumps(config, separators=(',', ':'))))
+        return messages
+
+def _round(value):
+    return round(value, 1) if isinstance(value, float) else value
@@ -0,0 +1,81 @@
+"""Read-only startup probe: all device endpoints are checked in parallel under one short deadline."""
+import logging, time
+from collections import namedtuple
+from concurrent.futures import wait
+
+from nulleinspeisung.acquisition import submit_parallel
+
+DEFAULT_DEADLINE = 2.0          # Seconds for the whole probe, not per request
+
+# ok      -> the endpoint answered in time and the check passed
+# detail  -> 'ok' or the reason it failed
+# latency -> seconds until the answer (None if there was none)
+ProbeResult = namedtuple('ProbeResult', ['name', 'url', 'ok', 'detail', 'latency'])
+
+# ------------------------------------------------------------------------------
+# Response checks (raise if the answer is not usable)
+# ------------------------------------------------------------------------------
+def known_serials(serials):
+    """
+    Check for GET /api/limit/status: OpenDTU answers {serial: {limit_relative,
+    max_power, limit_set_status}}, so this confirms the limit API is there and
+    knows every configured inverter without changing any limit.
+    """
+    def check(response):
+        status = response.json()
+        missing = [serial for serial in serials if serial not in status]
+        if missing:
+            raise ValueError(f"inverter(s) {', '.join(missing)} unknown to the DTU")
+    return check
+
+def has_inverters(response):
+    """Check for the DTU livedata status."""
+    if 'inverters' not in response.json():
+        raise ValueError("no 'inverters' in the DTU status")
+
+def has_grid_power(response):
+    """Check for the Shelly EM.GetStatus response."""
+    if response.json().get('total_act_power') is None:
+        raise ValueError("no 'total_act_power' in the Shelly status")
+
+# ------------------------------------------------------------------------------
+# Probe
+# ------------------------------------------------------------------------------
+def _timed_get(client, url, check, timeout):
+    started = time.monotonic()
+    response = client.get(url, timeout=timeout)
+    if check is not None:
+        check(response)
+    return time.monotonic() - started
+
+def probe(endpoints, deadline=DEFAULT_DEADLINE):
+    """
+    GET every endpoint at the same time and return one ProbeResult each, in
+    order. `endpoints` maps a name to (client, url, check); check(response) may
+    raise to reject the answer. Only GETs are sent, so a restart never touches
+    the inverter limits, and the call returns after `deadline` at the latest.
+    """
+    futures = submit_parallel({name: (lambda client=client, url=url, check=check:
+                                      _timed_get(client, url, check, deadline))
+                               for name, (client, url, check) in endpoints.items()})
+    wait(futures.values(), timeout=deadline)
+    results = []
+    for name, future in futures.items():
+        url = endpoints[name][1]
+        if not future.done():
+            # The request itself gives up at its own timeout; nobody waits for it
+            results.append(ProbeResult(name, url, False, f"no answer within {deadline:g} s", None))
+        elif future.exception() is not None:
+            results.append(ProbeResult(name, url, False, str(future.exception()), None))
+        else:
+            results.append(ProbeResult(name, url, True, 'ok', future.result()))
+    return results
+
+def log_results(results):
+    """Log one line per endpoint and return True if all of them passed."""
+    for result in results:
+        if result.ok:
+            logging.info(f"✅ {result.name} reachable ({result.url}, {result.latency * 1000:.0f} ms)")
+        else:
+            logging.error(f"❌ {result.name} check failed ({result.url}): {result.detail}")
+    return all(result.ok for result in results)
@@ -0,0 +1,215 @@
+"""Read-only queries over power_data, inverter_data and their rollups; all results are streamed as generators."""
+import calendar, datetime, sqlite3, time
+from collections import namedtuple
+
+from nulleinspeisung.storage import (INVERTER_DATA_COLUMNS, INVERTER_DATA_ROLLUPS, INVERTER_ROLLUP_FIELDS,
+                                     POWER_DATA_COLUMNS, POWER_DATA_ROLLUPS, ROLLUP_FAMILIES, ROLLUP_FIELDS, ROLLUPS)
+
+# ------------------------------------------------------------------------------
+# Data types
+# ------------------------------------------------------------------------------
+# One power_data row; epoch is UTC seconds
+Row = namedtuple('Row', POWER_DATA_COLUMNS)
+
+# One inverter_data row (one per inverter and cycle)
+InverterRow = namedtuple('InverterRow', INVERTER_DATA_COLUMNS)
+
+# One field of one rollup bucket; energy_wh assumes the average held for the whole
+# bucket (for the current bucket: up to now). serial is set for per-inverter fields.
+Aggregate = namedtuple('Aggregate', ['bucket', 'site', 'field', 'samples', 'average', 'minimum', 'maximum',
+                                     'energy_wh', 'serial'], defaults=(None,))
+
+RESOLUTIONS = dict(ROLLUPS)
+INVERTER_FIELDS = ('power',)
+
+# Rollup family of each field: power/setpoint per inverter serial, the others per site from power_data
+_FAMILIES = {**{field: POWER_DATA_ROLLUPS for field in ROLLUP_FIELDS},
+             **{field: INVERTER_DATA_ROLLUPS for field in INVERTER_ROLLUP_FIELDS}}
+
+_SELECT = f"SELECT {', '.join(POWER_DATA_COLUMNS)} FROM power_data"
+
+# ------------------------------------------------------------------------------
+# Helpers
+# ------------------------------------------------------------------------------
+def connect(db_file):
+    """Open the database read-only, so a query can never block or modify the writer's data."""
+    return sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+
+def to_epoch(value):
+    """
+    Epoch seconds from an int/float, a datetime (naive = UTC) or a UTC string
+    'YYYY-MM-DD', 'YYYY-MM-DD HH:MM' or 'YYYY-MM-DD HH:MM:SS'. None stays None.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return int(value.timestamp())
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise ValueError(f"Unsupported time format: {value!r}")
+
+def _where(start, end, site, column, serial=None):
+    clauses, params = [], []
+    if start is not None:
+        clauses.append(f'{column} >= ?')
+        params.append(to_epoch(start))
+    if end is not None:
+        clauses.append(f'{column} < ?')
+        params.append(to_epoch(end))
+    if site is not None:
+        clauses.append(f"coalesce(site, '') = ?")
+        params.append(site)
+    if serial is not None:
+        clauses.append('serial = ?')
+        params.append(serial)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+def _stream(cursor, factory):
+    """Fetch in chunks instead of fetchall(), so a long range never sits in memory at once."""
+    while True:
+        chunk = cursor.fetchmany(1000)
+        if not chunk:
+            return
+        for row in chunk:
+            yield factory(row)
+
+# ------------------------------------------------------------------------------
+# Queries
+# ------------------------------------------------------------------------------
+def range_rows(conn, start=None, end=None, site=None):
+    """Raw rows with start <= epoch < end, oldest first. site='' selects single-site (v3) rows."""
+    where, params = _where(start, end, site, 'epoch')
+    return _stream(conn.execute(f'{_SELECT}{where} ORDER BY epoch', params), Row._make)
+
+def latest(conn, count=10, site=None):
+    """The newest `count` raw rows, newest first."""
+    where, params = _where(None, None, site, 'epoch')
+    return _stream(conn.execute(f'{_SELECT}{where} ORDER BY epoch DESC LIMIT ?', params + [count]), Row._make)
+
+def inverter_rows(conn, start=None, end=None, site=None, serial=None):
+    """Raw inverter_data rows with start <= epoch < end, oldest first; one row per inverter and cycle."""
+    where, params = _where(start, end, site, 'epoch', serial)
+    return _stream(conn.execute(f"SELECT {', '.join(INVERTER_DATA_COLUMNS)} FROM inverter_data{where} "
+                                f"ORDER BY epoch, serial", params), InverterRow._make)
+
+def aggregates(conn, start=None, end=None, resolution='hour', site=None, fields=INVERTER_FIELDS, serial=None):
+    """
+    Average/min/max and energy per bucket for each of `fields` (default: the
+    power of every inverter), read from the minute, hour or day rollup tables.
+    power and setpoint are reported per inverter (Aggregate.serial, optionally
+    only `serial`); grid_power, total_production and the legacy inverter1/2
+    columns per site.
+    A bucket that start or end cuts is filled from the next finer rollup (raw
+    rows below minutes, as far as they are still kept) and covers only the part
+    inside the range; the first one is labelled with start instead of its bucket.
+    """
+    unknown = set(fields) - set(_FAMILIES)
+    if unknown:
+        raise ValueError(f"No rollups for {sorted(unknown)}; available: {', '.join(_FAMILIES)}")
+    start, end = to_epoch(start), to_epoch(end)
+    for family in ROLLUP_FAMILIES:
+        family_fields = tuple(field for field in fields if _FAMILIES[field] is family)
+        if family_fields:
+            yield from _aggregates(conn, family, start, end, resolution, site,
+                                   serial if 'serial' in family.keys else None, family_fields)
+
+def inverter_summary(conn, start=None, end=None, site=None, fields=INVERTER_FIELDS, serial=None):
+    """
+    One Aggregate per inverter and field over the whole range (bucket = start
+    of the range), summed from the day rollups; partial days come from finer
+    data (see aggregates()). Per-site fields are summed over all sites unless
+    `site` is given.
+    """
+    start = to_epoch(start)
+    items = aggregates(conn, start, end, 'day', site, fields, serial)
+    for (_, item_serial, field), total in _merge(items, by_site=False).items():
+        samples, weighted, minimum, maximum, energy = total
+        yield Aggregate(start, site, field, samples, weighted / samples, minimum, maximum, energy, item_serial)
+
+def _aggregates(conn, family, start, end, resolution, site, serial, fields):
+    seconds = RESOLUTIONS[resolution]
+    first = None if start is None else -(-start // seconds) * seconds
+    last = None if end is None else end // seconds * seconds
+    if first is not None and last is not None and first > last:
+        yield from _partial(conn, family, start, end, resolution, site, serial, fields)
+        return
+    if start is not None and start < first:
+        yield from _partial(conn, family, start, first, resolution, site, serial, fields)
+    yield from _buckets(conn, family, first, last, resolution, site, serial, fields)
+    if end is not None and last < end:
+        yield from _partial(conn, family, last, end, resolution, site, serial, fields)
+
+def _buckets(conn, family, start, end, resolution, site, serial, fields):
+    """Whole buckets of one rollup table with start <= bucket < end."""
+    seconds = RESOLUTIONS[resolution]
+    where, params = _where(start, end, site, 'bucket', serial)
+    keys = ', '.join(family.keys)
+    columns = ', '.join(f'{field}_sum, {field}_count, {field}_min, {field}_max' for field in fields)
+    cursor = conn.execute(f'SELECT bucket, {keys}, {columns} FROM {family.table}_{resolution}{where} '
+                          f'ORDER BY bucket, {keys}', params)
+    now = time.time()
+    for bucket, *values in _stream(cursor, tuple):
+        bucket_site, bucket_serial = _keys(family, values)
+        values = values[len(family.keys):]
+        hours = min(seconds, max(0, now - bucket)) / 3600
+        for position, field in enumerate(fields):
+            total, count, minimum, maximum = values[position * 4:position * 4 + 4]
+            if not count:
+                continue
+            average = total / count
+            yield Aggregate(bucket, bucket_site, field, count, average, minimum, maximum, average * hours,
+                            bucket_serial)
+
+def _partial(conn, family, start, end, resolution, site, serial, fields):
+    """One Aggregate per key and field for start <= t < end inside a single bucket of `resolution`."""
+    finer = [name for name, _ in ROLLUPS[:list(RESOLUTIONS).index(resolution)]]
+    if finer:
+        items = _aggregates(conn, family, start, end, finer[-1], site, serial, fields)
+    else:
+        items = _raw(conn, family, start, end, site, serial, fields)
+    for (bucket_site, bucket_serial, field), total in _merge(items).items():
+        samples, weighted, minimum, maximum, energy = total
+        yield Aggregate(start, bucket_site, field, samples, weighted / samples, minimum, maximum, energy,
+                        bucket_serial)
+
+def _raw(conn, family, start, end, site, serial, fields):
+    """Aggregate raw rows with start <= epoch < end per key, like one rollup bucket."""
+    where, params = _where(start, end, site, 'epoch', serial)
+    keys = ', '.join(f"coalesce({key}, '')" for key in family.keys)
+    groups = ', '.join(str(position) for position in range(1, len(family.keys) + 1))
+    columns = ', '.join(f'sum({field}), count({field}), min({field}), max({field})' for field in fields)
+    hours = max(0, min(end, time.time()) - start) / 3600
+    for values in conn.execute(f"SELECT {keys}, {columns} FROM {family.table}{where} "
+                               f"GROUP BY {groups} ORDER BY {groups}", params):
+        bucket_site, bucket_serial = _keys(family, values)
+        values = values[len(family.keys):]
+        for position, field in enumerate(fields):
+            total, count, minimum, maximum = values[position * 4:position * 4 + 4]
+            if count:
+                yield Aggregate(start, bucket_site, field, count, total / count, minimum, maximum,
+                                total / count * hours, bucket_serial)
+
+def _keys(family, values):
+    """(site, serial) from the key columns at the start of `values`; serial is None for power_data."""
+    return values[0], values[1] if len(family.keys) > 1 else None
+
+def _merge(items, by_site=True):
+    """
+    {(site, serial, field): [samples, average * samples, min, max, energy]} over
+    Aggregates, in first-seen order.
+    """
+    totals = {}
+    for item in items:
+        total = totals.setdefault((item.site if by_site else None, item.serial, item.field),
+                                  [0, 0.0, None, None, 0.0])
+        total[0] += item.samples
+        total[1] += item.average * item.samples
+        total[2] = item.minimum if total[2] is None else min(total[2], item.minimum)
+        total[3] = item.maximum if total[3] is None else max(total[3], item.maximum)
+        total[4] += item.energy_wh
+    return totals
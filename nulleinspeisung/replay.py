@@ -0,0 +1,187 @@
+"""Offline, vectorized replay of power_data history under different controller settings."""
+import itertools, sqlite3
+from collections import namedtuple
+
+import numpy as np
+
+from nulleinspeisung.controller import Inverter
+from nulleinspeisung.query import to_epoch
+
+# ------------------------------------------------------------------------------
+# Data types
+# ------------------------------------------------------------------------------
+# time     -> epoch seconds (float64, shape n)
+# grid     -> measured grid power in W (shape n)
+# power    -> measured AC power per inverter column (shape n x k: inverter1/2, or one column per serial)
+# setpoint -> setpoint sent in that cycle per inverter column (shape n x k)
+History = namedtuple('History', ['time', 'grid', 'power', 'setpoint'])
+
+ReplayResult = namedtuple('ReplayResult', ['import_wh', 'export_wh', 'production_wh', 'samples'])
+
+MAX_GAP = 60            # s; longer gaps between rows (outages) count as one nominal cycle
+NOMINAL_INTERVAL = 10   # s
+LIMITED_TOLERANCE = 30  # W; inverter below setpoint by more than this is solar-limited
+CHUNK_ROWS = 65536      # Rows converted to NumPy per fetch while loading
+
+# ------------------------------------------------------------------------------
+# Loading
+# ------------------------------------------------------------------------------
+def load_history(db_file, start=None, end=None, site=None, serials=None):
+    """
+    Load power_data rows (start <= epoch < end; epoch seconds or a UTC string
+    'YYYY-MM-DD[ HH:MM[:SS]]') into NumPy arrays. Rows without grid power are skipped.
+    Power and setpoint come from the inverter1/2 columns, or with `serials` from
+    inverter_data, one column per serial (any number of inverters).
+    """
+    if serials:
+        columns = [f"max(CASE WHEN i.serial = ? THEN i.{field} END)" for field in ('power', 'setpoint')
+                   for _ in serials]
+        query = (f"SELECT p.epoch, p.grid_power, {', '.join(columns)} FROM power_data p "
+                 f"LEFT JOIN inverter_data i ON i.epoch = p.epoch AND i.site = coalesce(p.site, '') "
+                 f"WHERE p.grid_power IS NOT NULL AND p.epoch IS NOT NULL")
+        params = list(serials) * 2
+        group = " GROUP BY p.id"
+    else:
+        query = ("SELECT p.epoch, p.grid_power, inverter1_power, inverter2_power, inverter1_setpoint, "
+                 "inverter2_setpoint FROM power_data p WHERE p.grid_power IS NOT NULL AND p.epoch IS NOT NULL")
+        params = []
+        group = ""
+    if start:
+        query += " AND p.epoch >= ?"
+        params.append(to_epoch(start))
+    if end:
+        query += " AND p.epoch < ?"
+        params.append(to_epoch(end))
+    if site:
+        query += " AND p.site = ?"
+        params.append(site)
+    query += f"{group} ORDER BY p.epoch, p.id"
+
+    k = len(serials) if serials else 2
+    conn = sqlite3.connect(db_file)
+    try:
+        data = _read_array(conn.execute(query, params), 2 + 2 * k)
+    finally:
+        conn.close()
+    return History(time=data[:, 0], grid=data[:, 1], power=data[:, 2:2 + k], setpoint=data[:, 2 + k:])
+
+def _read_array(cursor, width):
+    """
+    Read the result into a float64 array chunk by chunk (NULL = NaN), so the
+    rows never sit in memory as one big list of tuples.
+    """
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(CHUNK_ROWS)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.float64))
+    return np.concatenate(chunks) if chunks else np.empty((0, width))
+
+def durations(time, max_gap=MAX_GAP):
+    """Seconds each sample stands for (time to the next sample, gaps capped)."""
+    dt = np.diff(time, append=time[-1] + NOMINAL_INTERVAL) if len(time) else np.zeros(0)
+    return np.where((dt > 0) & (dt <= max_gap), dt, NOMINAL_INTERVAL)
+
+# ------------------------------------------------------------------------------
+# Vectorized controller
+# ------------------------------------------------------------------------------
+def distribute_array(total, inverters):
+    """
+    Array version of controller.distribute(): the same one-pass priority/weight
+    split, evaluated for every sample at once. Returns an (n x len(inverters)) array.
+    """
+    n = len(total)
+    setpoints = np.empty((n, len(inverters)))
+    for column, inverter in enumerate(inverters):
+        setpoints[:, column] = inverter.minimum
+    remaining = total - sum(inverter.minimum for inverter in inverters)
+    for priority in sorted({inverter.priority for inverter in inverters}):
+        group = sorted((column for column, inverter in enumerate(inverters) if inverter.priority == priority),
+                       key=lambda column: (inverters[column].maximum - inverters[column].minimum)
+                       / inverters[column].weight)
+        weight_left = sum(inverters[column].weight for column in group)
+        for column in group:
+            inverter = inverters[column]
+            share = np.clip(remaining * inverter.weight / weight_left, 0, inverter.maximum - inverter.minimum)
+            setpoints[:, column] += share
+            remaining = remaining - share
+            weight_left -= inverter.weight
+    return np.round(setpoints)
+
+def available_power(history):
+    """
+    Estimate the solar power each inverter could have delivered. Where the
+    inverter stayed clearly below the setpoint of the previous cycle it was
+    solar-limited and its measured power is the cap; elsewhere it was held back
+    by the limit, so the cap is unknown (infinite). Without a previous
+    setpoint the measured power is taken as the cap.
+    """
+    previous = np.vstack([history.setpoint[:1], history.setpoint[:-1]])
+    missing = np.isnan(history.power)
+    power = np.where(missing, 0.0, history.power)
+    limited = np.isnan(previous) | (power < previous - LIMITED_TOLERANCE)
+    # No data (inverter unreachable, e.g. at night) counts as no production
+    return np.where(missing, 0.0, np.where(limited, power, np.inf))
+
+def replay(history, inverters, offset=5, available=None):
+    """
+    Re-run the setpoint logic of main_loop over the history with other settings.
+
+    The inverters share the target with the priority/weight split of v3
+    (controller.distribute()), not with the baseline shortfall rule of v1/v2,
+    where inverter 2 moves in 5 W steps from its own last limit. Those steps
+    depend on the previous cycle and cannot be computed for all samples at
+    once; the split is what the rule settles to (inverter 2 takes what
+    inverter 1 cannot deliver), so ramp-down transients of inverter 2 are
+    not part of the result.
+
+    The house load is grid + inverter power. The controller computes its target
+    as grid + current limits - offset; while the inverters deliver their limits
+    that equals load - offset, so every setpoint can be computed directly from
+    the load (no recursion). The new setpoint applies one sample later and the
+    inverter delivers min(setpoint, available solar power).
+    """
+    if available is None:
+        available = available_power(history)
+    power = np.nan_to_num(history.power, nan=0.0)
+    load = history.grid + power.sum(axis=1)
+    setpoints = distribute_array(load - offset, inverters)
+    applied = np.vstack([setpoints[:1], setpoints[:-1]])
+    delivered = np.minimum(applied, available[:, :len(inverters)])
+    grid = load - delivered.sum(axis=1)
+    dt = durations(history.time)
+    return ReplayResult(
+        import_wh=float(np.sum(np.clip(grid, 0, None) * dt) / 3600),
+        export_wh=float(np.sum(np.clip(-grid, 0, None) * dt) / 3600),
+        production_wh=float(np.sum(delivered.sum(axis=1) * dt) / 3600),
+        samples=len(grid),
+    )
+
+def recorded(history):
+    """Import/export energy that was actually measured over the history."""
+    dt = durations(history.time)
+    power = np.nan_to_num(history.power, nan=0.0)
+    return ReplayResult(
+        import_wh=float(np.sum(np.clip(history.grid, 0, None) * dt) / 3600),
+        export_wh=float(np.sum(np.clip(-history.grid, 0, None) * dt) / 3600),
+        production_wh=float(np.sum(power.sum(axis=1) * dt) / 3600),
+        samples=len(history.grid),
+    )
+
+def sweep(history, maximum_wr, minimum_wr, offsets, maximum_wr2=(), minimum_wr2=()):
+    """
+    Replay every combination of the given settings. Inverter 2 is only part of
+    the replay when maximum_wr2 is given (priority 1, takes the shortfall as in
+    the v3 priority split, see replay()).
+    Yields (settings dict, ReplayResult).
+    """
+    available = available_power(history)
+    second = list(itertools.product(maximum_wr2, minimum_wr2 or (0,))) if maximum_wr2 else [None]
+    for maximum, minimum, offset, inverter2 in itertools.product(maximum_wr, minimum_wr, offsets, second):
+        inverters = [Inverter('inverter1', minimum, maximum, priority=0)]
+        settings = {'maximum_wr': maximum, 'minimum_wr': minimum, 'offset': offset}
+        if inverter2 is not None:
+            inverters.append(Inverter('inverter2', inverter2[1], inverter2[0], priority=1))
+            settings.update(maximum_wr2=inverter2[0], minimum_wr2=inverter2[1])
+        yield settings, replay(history, inverters, offset=offset, available=available)
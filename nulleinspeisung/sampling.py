@@ -0,0 +1,219 @@
+"""Fast background sampling of the Shelly grid power with incrementally filtered windows."""
+import bisect, logging, threading, time
+from array import array
+from collections import deque
+
+from nulleinspeisung.breaker import CircuitOpenError
+
+# ------------------------------------------------------------------------------
+# Defaults
+# ------------------------------------------------------------------------------
+DEFAULT_INTERVAL = 1.0      # Seconds between two Shelly requests
+DEFAULT_WINDOW = 10         # Samples in the median/min/max window
+DEFAULT_ALPHA = 0.3         # EMA weight of the newest sample
+DEFAULT_MAX_AGE = 5.0       # Seconds without a new sample until the filtered value is stale
+
+FILTERS = ('median', 'ema', 'latest')
+
+# ------------------------------------------------------------------------------
+# Ring buffer and window statistics
+# ------------------------------------------------------------------------------
+class RingBuffer:
+    """Fixed-size window of floats in one preallocated array; memory does not grow with the sample count."""
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.size = size
+        self._values = array('d', bytes(8 * size))
+        self._next = 0
+        self._count = 0
+
+    def append(self, value):
+        """Store value; returns the sample it overwrote, or None while the buffer is filling up."""
+        evicted = self._values[self._next] if self._count == self.size else None
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+        return evicted
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def __iter__(self):
+        """Oldest to newest."""
+        start = (self._next - self._count) % self.size
+        for offset in range(self._count):
+            yield self._values[(start + offset) % self.size]
+
+    @property
+    def latest(self):
+        return self._values[(self._next - 1) % self.size] if self._count else None
+
+class WindowStats:
+    """
+    Median, min and max over the last `size` samples and an EMA over all of
+    them, updated per sample without rescanning the window: the median from a
+    sorted copy of the window (bisect), min/max from monotonic deques.
+    """
+    def __init__(self, size=DEFAULT_WINDOW, alpha=DEFAULT_ALPHA):
+        self.alpha = alpha
+        self.ring = RingBuffer(size)
+        self.ema = None
+        self.samples = 0
+        self._sorted = []
+        self._min = deque()         # (sample number, value), values ascending
+        self._max = deque()         # (sample number, value), values descending
+
+    def add(self, value):
+        value = float(value)
+        evicted = self.ring.append(value)
+        if evicted is not None:
+            del self._sorted[bisect.bisect_left(self._sorted, evicted)]
+        bisect.insort(self._sorted, value)
+        self.ema = value if self.ema is None else self.ema + self.alpha * (value - self.ema)
+
+        number = self.samples
+        self.samples += 1
+        for window, better in ((self._min, float.__le__), (self._max, float.__ge__)):
+            while window and better(value, window[-1][1]):
+                window.pop()
+            window.append((number, value))
+            if window[0][0] <= number - self.ring.size:
+                window.popleft()
+
+    def __len__(self):
+        return len(self.ring)
+
+    def clear(self):
+        """Forget the window (the EMA restarts with the next sample, too)."""
+        self.ring.clear()
+        self.ema = None
+        self._sorted.clear()
+        self._min.clear()
+        self._max.clear()
+
+    @property
+    def latest(self):
+        return self.ring.latest
+
+    @property
+    def median(self):
+        count = len(self._sorted)
+        if not count:
+            return None
+        middle = count // 2
+        return self._sorted[middle] if count % 2 else (self._sorted[middle - 1] + self._sorted[middle]) / 2
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else None
+
+    def value(self, kind):
+        """The filtered value by name: 'median', 'ema' or 'latest'."""
+        if kind == 'median':
+            return self.median
+        if kind == 'ema':
+            return self.ema
+        if kind == 'latest':
+            return self.latest
+        raise ValueError(f"Unknown filter {kind!r} (expected one of: {', '.join(FILTERS)})")
+
+# ------------------------------------------------------------------------------
+# Sampler
+# ------------------------------------------------------------------------------
+class ShellySampler:
+    """
+    Polls EM.GetStatus every `interval` seconds on a background thread (fixed
+    rate on the monotonic clock) and feeds total_act_power into a WindowStats.
+    The control loop reads grid_power() without any I/O; it returns None when
+    the newest sample is older than `max_age`, and the caller then polls itself.
+
+    Call reset() when an inverter limit changed: samples from before the change
+    describe a different production, and mixing them into the filtered value
+    makes the controller correct the same difference twice.
+    """
+    def __init__(self, client, url, interval=DEFAULT_INTERVAL, window=DEFAULT_WINDOW, alpha=DEFAULT_ALPHA,
+                 filter='median', max_age=DEFAULT_MAX_AGE, clock=time.monotonic):
+        if filter not in FILTERS:
+            raise ValueError(f"Unknown filter {filter!r} (expected one of: {', '.join(FILTERS)})")
+        self.client = client
+        self.url = url
+        self.interval = interval
+        self.filter = filter
+        self.max_age = max_age
+        self.clock = clock
+        self.stats = WindowStats(window, alpha)
+        self.errors = 0
+        self.paused = False         # No requests while set (e.g. at night)
+        self._updated = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='shelly-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    # -- called from the control loop -------------------------------------------
+    def grid_power(self):
+        """Filtered grid power over the recent samples, or None if sampling is not current."""
+        with self._lock:
+            if self._updated is None or self.clock() - self._updated > self.max_age:
+                return None
+            return self.stats.value(self.filter)
+
+    def reset(self):
+        """Drop all samples; grid_power() is None until the next one arrives."""
+        with self._lock:
+            self.stats.clear()
+            self._updated = None
+
+    def format_stats(self):
+        """e.g. '10 samples, latest 512 W, median 498 W, EMA 503 W, min 320 W, max 700 W, 0 errors'."""
+        with self._lock:
+            stats = self.stats
+            if not len(stats):
+                return f"no samples, {self.errors} errors"
+            return (f"{len(stats)} samples, latest {stats.latest:.0f} W, median {stats.median:.0f} W, "
+                    f"EMA {stats.ema:.0f} W, min {stats.min:.0f} W, max {stats.max:.0f} W, {self.errors} errors")
+
+    # -- sampling thread ----------------------------------------------------------
+    def sample(self):
+        """One request; returns True if a sample was added."""
+        try:
+            value = self.client.get_json(self.url).get('total_act_power')
+            if value is None:
+                raise ValueError("total_act_power not found in Shelly response")
+        except CircuitOpenError:
+            return False
+        except Exception as e:
+            self.errors += 1
+            logging.debug("Shelly sample failed: %r", e)
+            return False
+        with self._lock:
+            self.stats.add(value)
+            self._updated = self.clock()
+        return True
+
+    def _run(self):
+        next_tick = self.clock()
+        while not self._stop.is_set():
+            if not self.paused:
+                self.sample()
+            next_tick += self.interval
+            now = self.clock()
+            if next_tick < now:
+                # A slow request; skip the missed ticks instead of sampling in a burst
+                next_tick = now
+            self._stop.wait(next_tick - now)
@@ -0,0 +1,170 @@
+"""Drift-free cycle scheduler with optional adaptive polling rate."""
+import logging, time
+
+# ------------------------------------------------------------------------------
+# Scheduler
+# ------------------------------------------------------------------------------
+class CycleScheduler:
+    """
+    Fixed-rate scheduling on the monotonic clock: each cycle starts `interval`
+    seconds after the previous *deadline*, not after the previous cycle ended,
+    so HTTP and DB time no longer add up to drift. A cycle that runs past its
+    deadline is counted as missed and the next one starts immediately.
+
+    In adaptive mode the interval drops to `fast_interval` when grid power
+    changes by at least `change_threshold` W between cycles or the inverters
+    are saturated. After `steady_cycles` quiet cycles it doubles again, up to
+    `slow_interval`.
+
+    With a `wake` event (threading.Event), setting the event ends the wait
+    early and the next cycle starts right away; the fixed-rate schedule then
+    continues from that moment.
+
+    wait(idle=True) uses `idle_interval` instead (e.g. at night) and ignores
+    the wake event.
+    """
+    def __init__(self, interval=10.0, adaptive=False, fast_interval=2.0, slow_interval=None,
+                 change_threshold=100.0, steady_cycles=3, clock=time.monotonic, sleep=time.sleep,
+                 logger=None, wake=None, idle_interval=None):
+        self.interval = interval
+        self.idle_interval = idle_interval if idle_interval is not None else interval
+        self.adaptive = adaptive
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval if slow_interval is not None else interval
+        self.change_threshold = change_threshold
+        self.steady_cycles = steady_cycles
+        self.clock = clock
+        self.sleep = sleep
+        self.log = logger or logging.getLogger()
+        self.wake = wake
+        self.current_interval = interval
+        self.cycles = 0
+        self.missed = 0
+        self.triggered = 0
+        self.last_overrun = 0.0
+        self._cycle_start = clock()
+        self._last_grid = None
+        self._steady = 0
+
+    def reset(self):
+        """Start counting the current cycle from now (e.g. after an initial delay)."""
+        self._cycle_start = self.clock()
+
+    def elapsed(self):
+        """Seconds since the current cycle started."""
+        return self.clock() - self._cycle_start
+
+    def wait(self, grid_power=None, saturated=False, idle=False):
+        """Sleep until the next cycle is due. Returns the interval used for it."""
+        delay = self.next_delay(grid_power, saturated, idle)
+        interval = self.idle_interval if idle else self.current_interval
+        if delay <= 0:
+            return interval
+        if self.wake is None or idle:
+            self.sleep(delay)
+        elif self.wake.wait(delay):
+            self.wake.clear()
+            self.triggered += 1
+            self._cycle_start = self.clock()
+        return interval
+
+    def next_delay(self, grid_power=None, saturated=False, idle=False):
+        """
+        Close the current cycle and return the seconds until the next one is due,
+        without sleeping (for callers that sleep themselves, e.g. asyncio.sleep).
+        """
+        if self.adaptive and not idle:
+            self.current_interval = self._adapt(grid_power, saturated)
+        deadline = self._cycle_start + (self.idle_interval if idle else self.current_interval)
+        now = self.clock()
+        self.cycles += 1
+        if now > deadline:
+            self.missed += 1
+            self.last_overrun = now - deadline
+            self.log.warning("⏱️ Cycle overran its deadline by %.2f s (%s of %s cycles missed).",
+                             self.last_overrun, self.missed, self.cycles)
+            self._cycle_start = now
+            return 0.0
+        self._cycle_start = deadline
+        return deadline - now
+
+    def _adapt(self, grid_power, saturated):
+        changed = (grid_power is not None and self._last_grid is not None
+                   and abs(grid_power - self._last_grid) >= self.change_threshold)
+        if grid_power is not None:
+            self._last_grid = grid_power
+        if changed or saturated:
+            self._steady = 0
+            if self.current_interval != self.fast_interval:
+                self.log.debug("Fast polling: %s, interval %s s",
+                               'saturated' if saturated else 'grid power step', self.fast_interval)
+            return self.fast_interval
+        self._steady += 1
+        if self._steady >= self.steady_cycles:
+            return min(self.current_interval * 2, self.slow_interval)
+        return self.current_interval
+
+    def snapshot(self):
+        """Adaptive polling state for the state file."""
+        return {'interval': self.current_interval, 'last_grid': self._last_grid, 'steady': self._steady}
+
+    def restore(self, snapshot):
+        # A changed configuration wins over the saved interval
+        interval = snapshot.get('interval')
+        if self.adaptive and interval is not None and self.fast_interval <= interval <= self.slow_interval:
+            self.current_interval = interval
+        self._last_grid = snapshot.get('last_grid')
+        self._steady = snapshot.get('steady', 0)
+
+    def format_stats(self):
+        stats = f"interval {self.current_interval:g} s, {self.missed}/{self.cycles} deadlines missed"
+        if self.wake is not None:
+            stats += f", {self.triggered} triggered early"
+        return stats
+
+# ------------------------------------------------------------------------------
+# Idle (night) detection
+# ------------------------------------------------------------------------------
+class IdleMonitor:
+    """
+    Decides from the DTU data whether the site is idle: after `enter_cycles`
+    cycles in a row in which none of the configured inverters was producing
+    (unreachable or producing = false), and until the first cycle in which one
+    is producing again. Cycles without DTU data do not change the state.
+    """
+    def __init__(self, serials, enter_cycles=3, clock=time.monotonic, logger=None):
+        self.serials = set(serials)
+        self.enter_cycles = enter_cycles
+        self.clock = clock
+        self.log = logger or logging.getLogger()
+        self.idle = False
+        self.since = None
+        self.periods = 0
+        self._quiet = 0
+
+    def update(self, statuses):
+        """Feed {serial: InverterStatus} of one cycle (None without DTU data); returns whether the site is idle."""
+        if statuses is None:
+            return self.idle
+        producing = any(status.reachable and status.producing
+                        for serial, status in statuses.items() if serial in self.serials)
+        if producing:
+            if self.idle:
+                self.log.info(f"☀️ Inverters are producing again after {(self.clock() - self.since) / 60:.0f} min; "
+                              f"back to normal control cycles.")
+                self.idle = False
+                self.since = None
+            self._quiet = 0
+        else:
+            self._quiet += 1
+            if not self.idle and self._quiet >= self.enter_cycles:
+                self.idle = True
+                self.since = self.clock()
+                self.periods += 1
+                self.log.info(f"🌙 No inverter has been producing for {self._quiet} cycles; entering idle mode.")
+        return self.idle
+
+    def format_stats(self):
+        if self.idle:
+            return f"idle for {(self.clock() - self.since) / 60:.0f} min"
+        return f"active, {self.periods} idle periods"
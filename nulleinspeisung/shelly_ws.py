@@ -0,0 +1,109 @@
+"""Push mode for the Shelly Pro 3EM: NotifyStatus over the Gen2 RPC WebSocket."""
+import asyncio, itertools, json, logging, threading, time
+
+from nulleinspeisung.websocket import BackgroundWebSocket
+
+# ------------------------------------------------------------------------------
+# Defaults
+# ------------------------------------------------------------------------------
+CLIENT_SRC = 'nulleinspeisung'   # RPC source id; the Shelly sends its notifications to it
+DEFAULT_THRESHOLD = 150          # W change against the last used value that triggers a cycle
+DEFAULT_MAX_AGE = 15.0           # Seconds a pushed value stays valid without any update
+DEFAULT_REFRESH = 5.0            # Seconds between EM.GetStatus requests over the socket
+MIN_TRIGGER_GAP = 1.0            # Seconds between two triggered cycles
+
+def websocket_url(shelly_ip):
+    return f'ws://{shelly_ip}/rpc'
+
+def total_act_power(message, em_id=0):
+    """
+    total_act_power from a NotifyStatus / NotifyFullStatus frame or from the
+    response to EM.GetStatus; None if the frame does not carry it.
+    """
+    if 'result' in message:
+        status = message['result']
+    elif message.get('method') in ('NotifyStatus', 'NotifyFullStatus'):
+        status = message.get('params', {}).get(f'em:{em_id}', {})
+    else:
+        return None
+    return status.get('total_act_power') if isinstance(status, dict) else None
+
+# ------------------------------------------------------------------------------
+# Client
+# ------------------------------------------------------------------------------
+class ShellyPushClient(BackgroundWebSocket):
+    """
+    Keeps the latest grid power pushed by the Shelly in memory. grid_power()
+    never does I/O; it returns None while the socket is down or the value is
+    older than max_age, and the caller then polls EM.GetStatus over HTTP.
+
+    When a pushed value differs from the value the last cycle used by at least
+    `threshold` W, the `wake` event is set (CycleScheduler(wake=...) starts the
+    next cycle immediately).
+    """
+    label = 'Shelly WebSocket'
+
+    def __init__(self, url, threshold=DEFAULT_THRESHOLD, max_age=DEFAULT_MAX_AGE,
+                 refresh_interval=DEFAULT_REFRESH, em_id=0, wake=None, clock=time.monotonic):
+        super().__init__(url, heartbeat=refresh_interval * 2)
+        self.threshold = threshold
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self.em_id = em_id
+        self.wake = wake if wake is not None else threading.Event()
+        self.clock = clock
+        self.notifications = 0
+        self.triggers = 0
+        self._value = None
+        self._updated = None
+        self._reference = None
+        self._last_trigger = None
+        self._ids = itertools.count(1)
+
+    # -- called from the control loop -------------------------------------------
+    def grid_power(self):
+        """Latest pushed total_act_power, or None if it is not current. Marks it as used."""
+        with self._lock:
+            if not self.connected or self._updated is None or self.clock() - self._updated > self.max_age:
+                return None
+            self._reference = self._value
+            return self._value
+
+    def format_stats(self):
+        return (f"{'connected' if self.connected else 'disconnected'}, {self.notifications} updates, "
+                f"{self.triggers} triggers, {self.connects} connects")
+
+    # -- WebSocket side ---------------------------------------------------------
+    async def on_connect(self, session, ws):
+        self.spawn(self._refresh(ws))
+
+    async def _refresh(self, ws):
+        # The first request registers CLIENT_SRC for notifications; later ones keep the value
+        # current when the meter pushes nothing (NotifyStatus only reports changes)
+        try:
+            while True:
+                await ws.send_str(json.dumps({'id': next(self._ids), 'src': CLIENT_SRC,
+                                              'method': 'EM.GetStatus', 'params': {'id': self.em_id}}))
+                await asyncio.sleep(self.refresh_interval)
+        except ConnectionError:
+            await ws.close()
+
+    def on_message(self, message):
+        value = total_act_power(message, self.em_id)
+        if value is None:
+            return
+        now = self.clock()
+        with self._lock:
+            self._value = value
+            self._updated = now
+            self.connected = True
+            self.notifications += 1
+            trigger = (self._reference is not None and abs(value - self._reference) >= self.threshold
+                       and (self._last_trigger is None or now - self._last_trigger >= MIN_TRIGGER_GAP))
+            if trigger:
+                self._last_trigger = now
+                self._reference = value
+                self.triggers += 1
+        if trigger:
+            logging.debug("⚡ Grid power jumped to %s W; starting a control cycle now.", value)
+            self.wake.set()
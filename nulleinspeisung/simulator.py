@@ -0,0 +1,476 @@
+"""Local stand-ins for OpenDTU and the Shelly 3EM Pro with a simple house/inverter model."""
+import asyncio, json, logging, random, threading, time
+
+from aiohttp import BasicAuth, web
+
+# ------------------------------------------------------------------------------
+# Defaults
+# ------------------------------------------------------------------------------
+DEFAULT_INVERTERS = [
+    # serial, name, maximum AC output (W)
+    ("116492226387", "Inverter 1", 2000),
+    ("1164a00b64e3", "Inverter 2", 1500),
+]
+DEFAULT_LOAD_STEPS = [
+    # (simulated second, house load in W)
+    (0, 600), (300, 1800), (600, 400), (900, 2600), (1200, 900),
+]
+DTU_USER = 'admin'
+DTU_PASSWORD = 'openDTU42'
+CONVERGENCE_BAND = 50           # W around the target grid power that counts as "settled"
+CONVERGENCE_HOLD = 20           # Simulated seconds the grid must stay in the band
+SHELLY_SRC = 'shellypro3em-sim'
+NOTIFY_DELTA = 10               # W change that makes the Shelly stand-in push NotifyStatus
+NOTIFY_PERIOD = 1.0             # Simulated seconds between two checks for a NotifyStatus
+LIVEDATA_PERIOD = 5.0           # Simulated seconds in which OpenDTU polls every inverter once
+
+# ------------------------------------------------------------------------------
+# Fault injection
+# ------------------------------------------------------------------------------
+class Faults:
+    """Per-device latency, timeouts (request hangs) and HTTP 500 errors."""
+    def __init__(self, latency=0.0, jitter=0.0, timeout_rate=0.0, error_rate=0.0, hang=30.0, offline=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.error_rate = error_rate
+        self.hang = hang
+        self.offline = offline
+
+    async def apply(self, rng):
+        """Sleep for the configured latency; return an error response or None."""
+        if self.offline:
+            await asyncio.sleep(self.hang)
+            return web.Response(status=504)
+        delay = self.latency + (rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.timeout_rate and rng.random() < self.timeout_rate:
+            await asyncio.sleep(self.hang)
+        if self.error_rate and rng.random() < self.error_rate:
+            return web.Response(status=500, text="simulated error")
+        return None
+
+# ------------------------------------------------------------------------------
+# Physical model
+# ------------------------------------------------------------------------------
+class SimInverter:
+    """
+    A Hoymiles inverter behind the DTU. A new limit is applied `apply_delay`
+    simulated seconds after the POST (radio + inverter), then the AC power
+    ramps towards min(limit, available solar power) at `ramp` W/s.
+    """
+    def __init__(self, serial, name, max_power, available=None, apply_delay=5.0, ramp=200.0, reachable=True):
+        self.serial = serial
+        self.name = name
+        self.max_power = max_power
+        self.available = max_power if available is None else available
+        self.apply_delay = apply_delay
+        self.ramp = ramp
+        self.reachable = reachable
+        self.limit = max_power / 2
+        self.pending = None         # (limit, apply at simulated second)
+        self.power = 0.0
+
+    def command(self, limit, now):
+        self.pending = (max(0.0, min(float(limit), self.max_power)), now + self.apply_delay)
+
+    def step(self, now, dt):
+        if self.pending is not None and now >= self.pending[1]:
+            self.limit = self.pending[0]
+            self.pending = None
+        target = min(self.limit, self.available) if self.reachable else 0.0
+        change = max(-self.ramp * dt, min(self.ramp * dt, target - self.power))
+        self.power += change
+
+    def to_json(self):
+        return {
+            "serial": self.serial,
+            "name": self.name,
+            "order": 0,
+            "data_age": 0,
+            "poll_enabled": True,
+            "reachable": self.reachable,
+            "producing": self.reachable and self.power > 0,
+            "limit_relative": round(self.limit / self.max_power * 100, 1),
+            "limit_absolute": round(self.limit),
+            "AC": {"0": {"Power": {"v": round(self.power, 1), "u": "W", "d": 1}}},
+        }
+
+class Simulation:
+    """
+    House load, inverters and grid meter. Time runs `speed` times faster than
+    real time. Import/export energy, POSTs and settling after each load step
+    are tracked for benchmarks.
+
+    With `spike_rate` > 0, short load spikes of `spike_power` W lasting
+    `spike_duration` s (a kettle, a compressor starting) occur at random,
+    on average `spike_rate` times per simulated minute.
+    """
+    def __init__(self, inverters=None, load_steps=None, noise=20.0, target=0.0, speed=1.0, seed=None,
+                 apply_delay=5.0, ramp=200.0, spike_rate=0.0, spike_power=1500.0, spike_duration=3.0):
+        self.rng = random.Random(seed)
+        self.inverters = [SimInverter(serial, name, max_power, apply_delay=apply_delay, ramp=ramp)
+                          for serial, name, max_power in (inverters or DEFAULT_INVERTERS)]
+        self.load_steps = sorted(load_steps or DEFAULT_LOAD_STEPS)
+        self.noise = noise
+        self.spike_rate = spike_rate
+        self.spike_power = spike_power
+        self.spike_duration = spike_duration
+        self.target = target
+        self.speed = speed
+        self.dtu_faults = Faults()
+        self.shelly_faults = Faults()
+        self.lock = threading.Lock()
+        self._started = time.monotonic()
+        self._now = 0.0
+        self._noise_value = 0.0
+        self._spike_until = None
+        self.requests = {}
+        self.posts = 0
+        self.import_wh = 0.0
+        self.export_wh = 0.0
+        self.abs_error_ws = 0.0
+        self._settle = {}          # step time -> settled at (or None)
+        self._in_band_since = None
+
+    # -- time -------------------------------------------------------------------
+    def now(self):
+        """Current simulated second."""
+        return (time.monotonic() - self._started) * self.speed
+
+    def base_load(self, t):
+        load = self.load_steps[0][1]
+        for step_time, step_load in self.load_steps:
+            if t >= step_time:
+                load = step_load
+        return load
+
+    def advance(self):
+        """Bring the model up to the current simulated time (called on every request and by the ticker)."""
+        with self.lock:
+            now = self.now()
+            while self._now < now:
+                dt = min(1.0, now - self._now)
+                self._now += dt
+                self._noise_value += self.rng.uniform(-1, 1) * self.noise * dt ** 0.5
+                self._noise_value *= 0.98
+                if self.spike_rate and self.rng.random() < self.spike_rate * dt / 60:
+                    self._spike_until = self._now + self.spike_duration
+                for inverter in self.inverters:
+                    inverter.step(self._now, dt)
+                grid = self._grid()
+                if grid > 0:
+                    self.import_wh += grid * dt / 3600
+                else:
+                    self.export_wh += -grid * dt / 3600
+                self.abs_error_ws += abs(grid - self.target) * dt
+                self._track_settling(grid)
+
+    def load(self):
+        spike = self.spike_power if self._spike_until is not None and self._now < self._spike_until else 0.0
+        return self.base_load(self._now) + self._noise_value + spike
+
+    def _grid(self):
+        return self.load() - sum(inverter.power for inverter in self.inverters)
+
+    def grid_power(self):
+        self.advance()
+        with self.lock:
+            return self._grid()
+
+    def _track_settling(self, grid):
+        current_step = max((t for t, _ in self.load_steps if t <= self._now), default=0)
+        if current_step not in self._settle:
+            self._settle[current_step] = None
+            self._in_band_since = None
+        if abs(grid - self.target) <= CONVERGENCE_BAND:
+            if self._in_band_since is None:
+                self._in_band_since = self._now
+            if self._settle[current_step] is None and self._now - self._in_band_since >= CONVERGENCE_HOLD:
+                self._settle[current_step] = self._in_band_since - current_step
+        else:
+            self._in_band_since = None
+
+    # -- device API -------------------------------------------------------------
+    def count(self, endpoint):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def dtu_status(self):
+        self.advance()
+        with self.lock:
+            return {
+                "inverters": [inverter.to_json() for inverter in self.inverters],
+                "total": {"Power": {"v": round(sum(i.power for i in self.inverters), 1), "u": "W", "d": 1}},
+                "hints": {"time_sync": False, "radio_problem": False, "default_password": False},
+            }
+
+    def limit_status(self):
+        """/api/limit/status: per serial the active limit and whether a new one is still being applied."""
+        self.advance()
+        with self.lock:
+            return {
+                inverter.serial: {
+                    "limit_relative": round(inverter.limit / inverter.max_power * 100, 1),
+                    "max_power": inverter.max_power,
+                    "limit_set_status": "Pending" if inverter.pending is not None else "Ok",
+                }
+                for inverter in self.inverters
+            }
+
+    def set_limit(self, serial, limit):
+        self.advance()
+        with self.lock:
+            for inverter in self.inverters:
+                if inverter.serial == serial:
+                    inverter.command(limit, self._now)
+                    self.posts += 1
+                    return True
+        return False
+
+    def shelly_status(self):
+        grid = self.grid_power()
+        phase = grid / 3
+        return {
+            "id": 0,
+            "a_act_power": round(phase, 1), "b_act_power": round(phase, 1), "c_act_power": round(phase, 1),
+            "total_act_power": round(grid, 1),
+            "total_current": round(abs(grid) / 230, 2),
+        }
+
+    # -- results ----------------------------------------------------------------
+    def summary(self):
+        self.advance()
+        with self.lock:
+            hours = self._now / 3600
+            settled = [value for step, value in sorted(self._settle.items()) if step > 0]
+            return {
+                "sim_seconds": round(self._now, 1),
+                "posts": self.posts,
+                "posts_per_hour": round(self.posts / hours, 1) if hours else 0.0,
+                "import_wh": round(self.import_wh, 2),
+                "export_wh": round(self.export_wh, 2),
+                "mean_abs_error_w": round(self.abs_error_ws / self._now, 1) if self._now else 0.0,
+                "settling_s": settled,
+                "requests": dict(self.requests),
+            }
+
+# ------------------------------------------------------------------------------
+# HTTP servers
+# ------------------------------------------------------------------------------
+async def close_websockets(app):
+    for ws in list(app['websockets']):
+        await ws.close()
+
+def dtu_app(sim):
+    """aiohttp application emulating the OpenDTU web API."""
+    async def livedata(request):
+        sim.count('dtu_status')
+        error = await sim.dtu_faults.apply(sim.rng)
+        if error is not None:
+            return error
+        return web.json_response(sim.dtu_status())
+
+    async def limit_status(request):
+        sim.count('dtu_limit_status')
+        error = await sim.dtu_faults.apply(sim.rng)
+        if error is not None:
+            return error
+        return web.json_response(sim.limit_status())
+
+    async def limit_config(request):
+        sim.count('dtu_limit_config')
+        if request.headers.get('Authorization') is None or \
+                BasicAuth.decode(request.headers['Authorization']) != BasicAuth(DTU_USER, DTU_PASSWORD):
+            return web.Response(status=401, text="unauthorized")
+        error = await sim.dtu_faults.apply(sim.rng)
+        if error is not None:
+            return error
+        form = await request.post()
+        try:
+            data = json.loads(form['data'])
+            serial, limit = str(data['serial']), float(data['limit_value'])
+        except (KeyError, ValueError, TypeError):
+            return web.json_response({"type": "warning", "message": "Invalid request"}, status=400)
+        if not sim.set_limit(serial, limit):
+            return web.json_response({"type": "warning", "message": "Invalid inverter specified!"})
+        return web.json_response({"type": "success", "message": "Settings saved!", "code": 1001})
+
+    async def livedata_websocket(request):
+        """OpenDTU /livedata: one inverter per message in turn, like the DTU after polling each inverter."""
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        request.app['websockets'].add(ws)
+        sim.count('dtu_websocket')
+        try:
+            index = 0
+            while not ws.closed and not sim.dtu_faults.offline:
+                status = sim.dtu_status()
+                inverters = status['inverters']
+                status['inverters'] = [inverters[index % len(inverters)]] if inverters else []
+                index += 1
+                sim.count('dtu_livedata')
+                await ws.send_json(status)
+                await asyncio.sleep(LIVEDATA_PERIOD / max(1, len(inverters)) / sim.speed)
+        except ConnectionError:
+            pass
+        finally:
+            request.app['websockets'].discard(ws)
+        await ws.close()
+        return ws
+
+    app = web.Application()
+    app['websockets'] = set()
+    app.on_shutdown.append(close_websockets)
+    app.router.add_get('/livedata', livedata_websocket)
+    app.router.add_get('/api/livedata/status/inverters', livedata)
+    app.router.add_get('/api/livedata/status', livedata)
+    app.router.add_get('/api/limit/status', limit_status)
+    app.router.add_post('/api/limit/config', limit_config)
+    return app
+
+def shelly_app(sim):
+    """aiohttp application emulating the Shelly Pro 3EM RPC API."""
+    async def em_status(request):
+        sim.count('shelly_status')
+        error = await sim.shelly_faults.apply(sim.rng)
+        if error is not None:
+            return error
+        return web.json_response(sim.shelly_status())
+
+    async def rpc_websocket(request):
+        """
+        Gen2 RPC over WebSocket: answers EM.GetStatus frames and, once a client
+        has sent a request (which registers its src), pushes NotifyStatus with
+        em:0 whenever the grid power changed by NOTIFY_DELTA W.
+        """
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        request.app['websockets'].add(ws)
+        sim.count('shelly_websocket')
+        client = None
+        notifier = None
+
+        async def notify():
+            last = None
+            while not ws.closed:
+                if sim.shelly_faults.offline:
+                    await ws.close()
+                    return
+                status = sim.shelly_status()
+                if last is None or abs(status['total_act_power'] - last) >= NOTIFY_DELTA:
+                    last = status['total_act_power']
+                    sim.count('shelly_notify')
+                    await ws.send_json({'src': SHELLY_SRC, 'dst': client, 'method': 'NotifyStatus',
+                                        'params': {'ts': round(time.time(), 2), 'em:0': status}})
+                await asyncio.sleep(NOTIFY_PERIOD / sim.speed)
+
+        try:
+            async for message in ws:
+                if message.type != web.WSMsgType.TEXT:
+                    break
+                frame = json.loads(message.data)
+                client = frame.get('src')
+                if frame.get('method') == 'EM.GetStatus':
+                    await ws.send_json({'id': frame.get('id'), 'src': SHELLY_SRC, 'dst': client,
+                                        'result': sim.shelly_status()})
+                else:
+                    await ws.send_json({'id': frame.get('id'), 'src': SHELLY_SRC, 'dst': client,
+                                        'error': {'code': 404, 'message': f"No handler for {frame.get('method')}"}})
+                if notifier is None and client:
+                    notifier = asyncio.ensure_future(notify())
+        finally:
+            if notifier is not None:
+                notifier.cancel()
+            request.app['websockets'].discard(ws)
+        return ws
+
+    app = web.Application()
+    app['websockets'] = set()
+    app.on_shutdown.append(close_websockets)
+    app.router.add_get('/rpc/EM.GetStatus', em_status)
+    app.router.add_get('/rpc', rpc_websocket)
+    return app
+
+class SimulatorServer:
+    """
+    Runs the DTU and Shelly stand-ins on their own event loop in a background
+    thread, so synchronous scripts and benchmarks can talk to them.
+    """
+    def __init__(self, sim, host='127.0.0.1', dtu_port=0, shelly_port=0):
+        self.sim = sim
+        self.host = host
+        self.dtu_port = dtu_port
+        self.shelly_port = shelly_port
+        self.loop = None
+        self._ticker = None
+        self._runners = []
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def dtu_url(self):
+        return f"http://{self.host}:{self.dtu_port}"
+
+    @property
+    def shelly_url(self):
+        return f"http://{self.host}:{self.shelly_port}"
+
+    @property
+    def dtu_ws_url(self):
+        return f"ws://{self.host}:{self.dtu_port}/livedata"
+
+    @property
+    def shelly_ws_url(self):
+        return f"ws://{self.host}:{self.shelly_port}/rpc"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='simulator', daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._start_sites())
+        self._ticker = self.loop.create_task(self._tick())
+        self._ready.set()
+        self.loop.run_forever()
+
+    async def _start_sites(self):
+        for app, attr in ((dtu_app(self.sim), 'dtu_port'), (shelly_app(self.sim), 'shelly_port')):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, self.host, getattr(self, attr))
+            await site.start()
+            setattr(self, attr, runner.addresses[0][1])
+            self._runners.append(runner)
+
+    async def _tick(self):
+        # Keep the model (and the energy integration) running between requests
+        while True:
+            self.sim.advance()
+            await asyncio.sleep(0.1)
+
+    def stop(self):
+        if self.loop is None:
+            return
+        async def shutdown():
+            self._ticker.cancel()
+            for runner in self._runners:
+                await runner.cleanup()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(10)
+
+def run_standalone(host, dtu_port, shelly_port, speed=1.0, seed=None):
+    """Serve the simulators until Ctrl+C (python3 -m nulleinspeisung simulate)."""
+    server = SimulatorServer(Simulation(speed=speed, seed=seed), host, dtu_port, shelly_port).start()
+    logging.info(f"🧪 OpenDTU simulator on {server.dtu_url}, Shelly simulator on {server.shelly_url}")
+    try:
+        while True:
+            time.sleep(10)
+            logging.info(f"🧪 {server.sim.summary()}")
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,121 @@
+"""Warm-start state: controller state is written atomically in the background and reloaded at startup."""
+import json, logging, os, threading, time
+
+STATE_VERSION = 1
+DEFAULT_MAX_AGE = 300.0         # Seconds; older state is ignored (the DTU may have been restarted meanwhile)
+DEFAULT_SAVE_INTERVAL = 60.0    # Seconds between writes while only timestamps and measurements change
+
+class StateFile:
+    """
+    A small JSON file holding one dict of sections, e.g. {'limits': ...,
+    'scheduler': ...}. save() writes a temporary file next to the target and
+    renames it over the old one, so a crash or power cut leaves either the
+    previous or the new state, never a half-written file. load() returns the
+    sections only if the file is readable and at most `max_age` seconds old.
+    """
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE, wall=time.time):
+        self.path = path
+        self.max_age = max_age
+        self.wall = wall
+        self.writes = 0
+        self.errors = 0
+
+    def load(self):
+        """Saved sections, or None if there is no usable state."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning("⚠️ Ignoring unreadable state file %s: %s", self.path, e)
+            return None
+        if not isinstance(data, dict) or data.get('version') != STATE_VERSION:
+            logging.warning("⚠️ Ignoring state file %s with unknown format.", self.path)
+            return None
+        age = self.wall() - data.get('saved_at', 0)
+        if not 0 <= age <= self.max_age:
+            logging.info("🕰️ State file is %.0f s old (max. %g s); starting cold.", age, self.max_age)
+            return None
+        return data.get('sections', {})
+
+    def save(self, **sections):
+        """Write all sections at once. Errors are logged and counted; the control loop goes on."""
+        data = {'version': STATE_VERSION, 'saved_at': round(self.wall(), 3), 'sections': sections}
+        temporary = f'{self.path}.tmp'
+        try:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temporary, self.path)
+            self.writes += 1
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            self.errors += 1
+            logging.warning("⚠️ Could not write state file %s: %s", self.path, e)
+            return False
+
+class StateWriter:
+    """
+    Writes a StateFile from a background thread, so the control loop never
+    waits for the SD card. submit() only keeps the newest sections; they are
+    written right away when `key` (e.g. the commanded limits) differs from the
+    key of the last write, otherwise at most every `interval` seconds.
+    close() writes whatever is newer than the file.
+
+    `on_write(seconds)` is called from the writer thread after every write.
+    """
+    def __init__(self, state_file, interval=DEFAULT_SAVE_INTERVAL, on_write=None, clock=time.monotonic):
+        self.file = state_file
+        self.interval = interval
+        self.on_write = on_write
+        self.clock = clock
+        self.submitted = 0
+        self._latest = None         # (key, sections) not written yet
+        self._written_key = None
+        self._written_at = None
+        self._closing = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='state-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self, timeout=5):
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def submit(self, key=None, **sections):
+        """Hand over the state of this cycle; returns without touching the disk."""
+        with self._cond:
+            self._latest = (key, sections)
+            self.submitted += 1
+            if self._due():
+                self._cond.notify()
+
+    def format_stats(self):
+        return f"{self.file.writes} writes for {self.submitted} cycles, {self.file.errors} errors"
+
+    def _due(self):
+        if self._latest is None:
+            return False
+        return (self._closing or self._written_at is None or self._latest[0] != self._written_key
+                or self.clock() - self._written_at >= self.interval)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._closing:
+                        return
+                    self._cond.wait()
+                key, sections = self._latest
+                self._latest = None
+                self._written_key = key
+                self._written_at = self.clock()
+            started = time.perf_counter()
+            self.file.save(**sections)
+            if self.on_write is not None:
+                self.on_write(time.perf_counter() - started)
@@ -0,0 +1,68 @@
+"""In-memory status of the running controller for local consumers (Home Assistant, dashboards, scripts)."""
+import json, threading, time
+from collections import deque
+
+DEFAULT_HISTORY = 360           # Cycles kept for /api/history (one hour at 10 s)
+JSON_CONTENT_TYPE = 'application/json'
+
+def _dump(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+class StatusStore:
+    """
+    Latest cycle snapshot and a short history of cycles, both kept in memory.
+    update() runs once per cycle and serializes right away; requests only hand
+    out the prepared bytes, so a consumer costs no device request and almost
+    no CPU however often it polls.
+
+    routes() returns the handlers for metrics.start_http_server(routes=...):
+      /api/status                 latest snapshot
+      /api/history[?seconds=N]    the history entries (of the last N seconds), oldest first
+    """
+    def __init__(self, history=DEFAULT_HISTORY, wall=time.time):
+        self.wall = wall
+        self.updates = 0
+        self._latest = None
+        self._history = deque(maxlen=history)   # (epoch, serialized entry)
+        self._lock = threading.Lock()
+
+    def update(self, snapshot, entry):
+        """Publish the snapshot of one cycle and append `entry` (a few key values) to the history."""
+        epoch = round(self.wall(), 3)
+        latest = _dump({'timestamp': epoch, **snapshot})
+        line = _dump({'timestamp': epoch, **entry})
+        with self._lock:
+            self._latest = latest
+            self._history.append((epoch, line))
+            self.updates += 1
+
+    def latest(self):
+        """Serialized latest snapshot, or None before the first cycle."""
+        with self._lock:
+            return self._latest
+
+    def history(self, seconds=None):
+        """Serialized JSON array of the history entries, limited to the last `seconds` if given."""
+        since = self.wall() - seconds if seconds is not None else None
+        with self._lock:
+            lines = [line for epoch, line in self._history if since is None or epoch >= since]
+        return b'[' + b','.join(lines) + b']'
+
+    # -- HTTP routes -----------------------------------------------------------------
+    def routes(self):
+        return {'/api/status': self._status_route, '/api/history': self._history_route}
+
+    def _status_route(self, query):
+        latest = self.latest()
+        if latest is None:
+            return 503, JSON_CONTENT_TYPE, _dump({'error': 'no control cycle completed yet'})
+        return 200, JSON_CONTENT_TYPE, latest
+
+    def _history_route(self, query):
+        seconds = None
+        if 'seconds' in query:
+            try:
+                seconds = float(query['seconds'][0])
+            except ValueError:
+                return 400, JSON_CONTENT_TYPE, _dump({'error': 'seconds must be a number'})
+        return 200, JSON_CONTENT_TYPE, self.history(seconds)
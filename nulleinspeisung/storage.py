@@ -0,0 +1,424 @@
+"""Long-lived, batched SQLite writer for the power_data table, its rollups and retention."""
+import calendar, datetime, logging, queue, sqlite3, threading, time
+
+from nulleinspeisung.metrics import ERRORS, STAGE_DURATION
+
+# ------------------------------------------------------------------------------
+# Schema
+# ------------------------------------------------------------------------------
+POWER_DATA_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS power_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        grid_power REAL,
+        inverter1_power REAL,
+        inverter2_power REAL,
+        total_production REAL,
+        inverter1_setpoint REAL,
+        inverter2_setpoint REAL,
+        inverter1_reachable INTEGER,
+        inverter2_reachable INTEGER,
+        dtus_error INTEGER,
+        shelly_error INTEGER,
+        site TEXT,
+        epoch INTEGER,
+        idle INTEGER
+    )
+'''
+
+# timestamp stays for existing consumers; range queries use the indexed integer epoch (UTC seconds)
+POWER_DATA_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS power_data_epoch ON power_data (epoch)',
+)
+
+# Columns written per row, in insert order
+POWER_DATA_COLUMNS = (
+    'timestamp',
+    'grid_power', 'inverter1_power', 'inverter2_power', 'total_production',
+    'inverter1_setpoint', 'inverter2_setpoint',
+    'inverter1_reachable', 'inverter2_reachable',
+    'dtus_error', 'shelly_error',
+    'site', 'epoch', 'idle',
+)
+
+# Columns added after the first release; ALTERed into existing databases on startup
+ADDED_COLUMNS = {
+    'site': 'TEXT',
+    'epoch': 'INTEGER',
+    'idle': 'INTEGER',      # 1 = marker row written while no inverter was producing (the other fields mostly NULL)
+}
+
+INVERTER_DATA_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS inverter_data (
+        epoch INTEGER NOT NULL,
+        site TEXT NOT NULL DEFAULT '',
+        serial TEXT NOT NULL,
+        power REAL,
+        setpoint REAL,
+        reachable INTEGER
+    )
+'''
+
+# One row per configured inverter and cycle; power_data keeps only the first two
+INVERTER_DATA_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS inverter_data_epoch ON inverter_data (epoch)',
+)
+
+INVERTER_DATA_COLUMNS = ('epoch', 'site', 'serial', 'power', 'setpoint', 'reachable')
+
+# ------------------------------------------------------------------------------
+# Rollups: one row per (bucket, site) and resolution, updated with every batch
+# ------------------------------------------------------------------------------
+ROLLUPS = (('minute', 60), ('hour', 3600), ('day', 86400))
+
+# Measurements aggregated as sum/count/min/max; average = sum / count
+ROLLUP_FIELDS = ('grid_power', 'inverter1_power', 'inverter2_power', 'total_production')
+
+# Counted per bucket (number of cycles with the error flag set; 1 = request failed,
+# 2 = device skipped by its circuit breaker)
+ROLLUP_ERROR_FIELDS = ('dtus_error', 'shelly_error')
+
+# inverter_data rollups: one row per (bucket, site, serial); reachable counts the cycles it answered
+INVERTER_ROLLUP_FIELDS = ('power', 'setpoint')
+INVERTER_ROLLUP_COUNTERS = ('reachable',)
+
+ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table}_{name} (
+        bucket INTEGER NOT NULL,
+        {keys},
+        samples INTEGER NOT NULL,
+        {fields},
+        PRIMARY KEY (bucket, {primary})
+    ) WITHOUT ROWID
+'''
+
+class RollupFamily:
+    """
+    Rollup tables <table>_minute/_hour/_day of one raw table: per bucket and
+    key (site, serial, ...) the number of rows, sum/count/min/max of `fields`
+    and the number of rows with each of `counters` set.
+    """
+    def __init__(self, table, columns, keys, fields, counters):
+        self.table = table
+        self.keys = keys
+        self.fields = fields
+        self.counters = counters
+        self.columns = ('bucket',) + keys + ('samples',) + tuple(
+            f'{field}_{stat}' for field in fields for stat in ('sum', 'count', 'min', 'max')
+        ) + counters
+        self._index = {column: position for position, column in enumerate(columns)}
+
+    def schema(self, name):
+        fields = [f'{field}_sum REAL, {field}_count INTEGER, {field}_min REAL, {field}_max REAL'
+                  for field in self.fields]
+        fields += [f'{field} INTEGER' for field in self.counters]
+        return ROLLUP_SCHEMA.format(table=self.table, name=name,
+                                    keys=',\n        '.join(f"{key} TEXT NOT NULL DEFAULT ''" for key in self.keys),
+                                    fields=',\n        '.join(fields), primary=', '.join(self.keys))
+
+    def upsert_sql(self, name):
+        """Merge pre-aggregated rows into an existing bucket (sums and counts add up, min/max combine)."""
+        updates = ['samples = samples + excluded.samples']
+        for field in self.fields:
+            updates += [
+                f'{field}_sum = coalesce({field}_sum, 0) + coalesce(excluded.{field}_sum, 0)',
+                f'{field}_count = {field}_count + excluded.{field}_count',
+                f'{field}_min = min(coalesce({field}_min, excluded.{field}_min), '
+                f'coalesce(excluded.{field}_min, {field}_min))',
+                f'{field}_max = max(coalesce({field}_max, excluded.{field}_max), '
+                f'coalesce(excluded.{field}_max, {field}_max))',
+            ]
+        updates += [f'{field} = {field} + excluded.{field}' for field in self.counters]
+        return (f"INSERT INTO {self.table}_{name} ({', '.join(self.columns)}) "
+                f"VALUES ({','.join('?' * len(self.columns))}) "
+                f"ON CONFLICT (bucket, {', '.join(self.keys)}) DO UPDATE SET {', '.join(updates)}")
+
+    def backfill_sql(self, name, seconds):
+        """Aggregate all existing raw rows into an empty rollup table (databases from older versions)."""
+        columns = [f"epoch / {seconds} * {seconds}"] + [f"coalesce({key}, '')" for key in self.keys] + ['count(*)']
+        for field in self.fields:
+            columns += [f'sum({field})', f'count({field})', f'min({field})', f'max({field})']
+        columns += [f'coalesce(sum({field} != 0), 0)' for field in self.counters]
+        groups = ', '.join(str(position) for position in range(1, len(self.keys) + 2))
+        return (f"INSERT INTO {self.table}_{name} ({', '.join(self.columns)}) "
+                f"SELECT {', '.join(columns)} FROM {self.table} WHERE epoch IS NOT NULL GROUP BY {groups}")
+
+    def aggregate(self, rows, seconds):
+        """Aggregate raw rows (tuples in column order) into rollup rows of `seconds` buckets."""
+        index = self._index
+        buckets = {}
+        for row in rows:
+            epoch = row[index['epoch']]
+            if epoch is None:
+                continue
+            key = (epoch - epoch % seconds,) + tuple(row[index[column]] or '' for column in self.keys)
+            acc = buckets.get(key)
+            if acc is None:
+                acc = buckets[key] = [0] + [None, 0, None, None] * len(self.fields) + [0] * len(self.counters)
+            acc[0] += 1
+            for position, field in enumerate(self.fields):
+                value = row[index[field]]
+                if value is None:
+                    continue
+                base = 1 + position * 4
+                acc[base] = value if acc[base] is None else acc[base] + value
+                acc[base + 1] += 1
+                acc[base + 2] = value if acc[base + 2] is None else min(acc[base + 2], value)
+                acc[base + 3] = value if acc[base + 3] is None else max(acc[base + 3], value)
+            for position, field in enumerate(self.counters, start=1 + len(self.fields) * 4):
+                acc[position] += 1 if row[index[field]] else 0
+        return [key + tuple(acc) for key, acc in buckets.items()]
+
+POWER_DATA_ROLLUPS = RollupFamily('power_data', POWER_DATA_COLUMNS, ('site',), ROLLUP_FIELDS, ROLLUP_ERROR_FIELDS)
+INVERTER_DATA_ROLLUPS = RollupFamily('inverter_data', INVERTER_DATA_COLUMNS, ('site', 'serial'),
+                                     INVERTER_ROLLUP_FIELDS, INVERTER_ROLLUP_COUNTERS)
+ROLLUP_FAMILIES = (POWER_DATA_ROLLUPS, INVERTER_DATA_ROLLUPS)
+
+ROLLUP_COLUMNS = POWER_DATA_ROLLUPS.columns
+
+_STOP = object()
+
+def utc_timestamp(epoch=None):
+    """Time (default: now) in the format SQLite uses for CURRENT_TIMESTAMP."""
+    if epoch is None:
+        epoch = time.time()
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def parse_timestamp(timestamp):
+    """'YYYY-MM-DD HH:MM:SS' (UTC) to epoch seconds."""
+    return calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+
+def migrate(conn):
+    """
+    Add columns and indexes that are missing in a power_data table created by an
+    older version, and fill epoch for rows that only have a timestamp.
+    """
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(power_data)')}
+    for column, column_type in ADDED_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f'ALTER TABLE power_data ADD COLUMN {column} {column_type}')
+    for statement in POWER_DATA_INDEXES:
+        conn.execute(statement)
+    conn.execute("UPDATE power_data SET epoch = CAST(strftime('%s', timestamp) AS INTEGER) "
+                 "WHERE epoch IS NULL AND timestamp IS NOT NULL")
+
+# ------------------------------------------------------------------------------
+# Background writer
+# ------------------------------------------------------------------------------
+class PowerDataWriter:
+    """
+    Owns one SQLite connection on a background thread. submit() only puts the row
+    into a queue, so the control loop never waits on disk I/O. Rows are committed
+    in one transaction per batch, either when batch_size rows are queued or when
+    the oldest queued row is flush_interval seconds old. close() flushes everything.
+
+    The same transaction merges the batch into the minute/hour/day rollup tables.
+    Per-inverter readings passed to submit() go to inverter_data (one row per
+    serial, any number of inverters) and its own rollups in the same transaction.
+    With retention_days (raw rows) or minute_retention_days set, expired rows are
+    deleted every prune_interval seconds in chunks of prune_chunk rows; pruning
+    pauses as soon as new rows are queued. Hour and day rollups are kept.
+    """
+    def __init__(self, db_file, batch_size=50, flush_interval=60.0, max_queue=10000,
+                 retention_days=None, minute_retention_days=None, prune_interval=3600.0, prune_chunk=2000):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.minute_retention_days = minute_retention_days
+        self.prune_interval = prune_interval
+        self.prune_chunk = prune_chunk
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_pruned = 0
+        self.batches_committed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._ready = threading.Event()
+        self._error = None
+        self._insert_sql = (f"INSERT INTO power_data ({', '.join(POWER_DATA_COLUMNS)}) "
+                            f"VALUES ({','.join('?' * len(POWER_DATA_COLUMNS))})")
+        self._inverter_insert_sql = (f"INSERT INTO inverter_data ({', '.join(INVERTER_DATA_COLUMNS)}) "
+                                     f"VALUES ({','.join('?' * len(INVERTER_DATA_COLUMNS))})")
+        self._rollup_sql = {(family.table, name): family.upsert_sql(name)
+                            for family in ROLLUP_FAMILIES for name, _ in ROLLUPS}
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+
+    def start(self, timeout=10):
+        """Start the writer thread and wait until the database is open and the schema exists."""
+        self._thread.start()
+        self._ready.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def submit(self, inverters=(), **fields):
+        """
+        Queue one power_data row and an inverter_data row for each (serial, power,
+        setpoint, reachable) in `inverters`. Never blocks; drops the row if the queue is full.
+        """
+        if 'timestamp' in fields:
+            fields.setdefault('epoch', parse_timestamp(fields['timestamp']))
+        else:
+            fields.setdefault('epoch', int(time.time()))
+            fields['timestamp'] = utc_timestamp(fields['epoch'])
+        row = tuple(fields.get(column) for column in POWER_DATA_COLUMNS)
+        site = fields.get('site') or ''
+        inverter_rows = [(fields['epoch'], site, serial, power, setpoint, reachable)
+                         for serial, power, setpoint, reachable in inverters]
+        try:
+            self._queue.put_nowait((row, inverter_rows))
+        except queue.Full:
+            self.rows_dropped += 1
+            if self.rows_dropped == 1 or self.rows_dropped % 100 == 0:
+                logging.warning("⚠️ SQLite write queue full; %s rows dropped so far.", self.rows_dropped)
+
+    def close(self, timeout=30):
+        """Flush all queued rows and stop the writer thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        logging.debug("SQLite writer closed: %s rows in %s batches, %s dropped.",
+                      self.rows_written, self.batches_committed, self.rows_dropped)
+
+    def _run(self):
+        try:
+            conn = sqlite3.connect(self.db_file)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(POWER_DATA_SCHEMA)
+            migrate(conn)
+            conn.execute(INVERTER_DATA_SCHEMA)
+            for statement in INVERTER_DATA_INDEXES:
+                conn.execute(statement)
+            empty_rollups = []
+            for family in ROLLUP_FAMILIES:
+                for name, seconds in ROLLUPS:
+                    table = f'{family.table}_{name}'
+                    if conn.execute('SELECT name FROM sqlite_master WHERE name = ?', (table,)).fetchone() is None:
+                        empty_rollups.append((family, name, seconds))
+                    conn.execute(family.schema(name))
+            conn.commit()
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        self._backfill(conn, empty_rollups)
+
+        batch = []
+        deadline = None
+        pruning = self.retention_days is not None or self.minute_retention_days is not None
+        next_prune = time.monotonic() if pruning else None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            if next_prune is not None:
+                until_prune = max(0.0, next_prune - time.monotonic())
+                timeout = until_prune if timeout is None else min(timeout, until_prune)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                batch = self._flush(conn, batch)
+                deadline = time.monotonic() + self.flush_interval
+            if next_prune is not None and time.monotonic() >= next_prune and self._queue.empty():
+                # Unfinished pruning (new rows arrived) continues shortly after
+                finished = self._prune(conn)
+                next_prune = time.monotonic() + (self.prune_interval if finished else 1.0)
+
+        # Drain whatever is left after the stop marker was queued
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            self._flush(conn, batch)
+        conn.close()
+
+    def _flush(self, conn, batch):
+        """Commit one batch; on failure keep the rows for the next attempt (bounded)."""
+        try:
+            rows = [row for row, _ in batch]
+            inverter_rows = [row for _, rows_of_cycle in batch for row in rows_of_cycle]
+            with STAGE_DURATION.time(stage='sqlite_write'), conn:
+                conn.executemany(self._insert_sql, rows)
+                conn.executemany(self._inverter_insert_sql, inverter_rows)
+                for family, family_rows in ((POWER_DATA_ROLLUPS, rows), (INVERTER_DATA_ROLLUPS, inverter_rows)):
+                    for name, seconds in ROLLUPS:
+                        conn.executemany(self._rollup_sql[family.table, name], family.aggregate(family_rows, seconds))
+            self.rows_written += len(batch)
+            self.batches_committed += 1
+            logging.debug("Committed %s rows to SQLite database.", len(batch))
+            return []
+        except sqlite3.Error as e:
+            ERRORS.inc(source='sqlite')
+            logging.error("❌ Error storing data in SQLite DB: %s", e)
+            overflow = len(batch) - self._queue.maxsize
+            if overflow > 0:
+                self.rows_dropped += overflow
+                batch = batch[overflow:]
+            return batch
+
+    def _backfill(self, conn, rollups):
+        """Fill newly created rollup tables from the rows already in their raw table."""
+        rollups = [(family, name, seconds) for family, name, seconds in rollups
+                   if conn.execute(f'SELECT 1 FROM {family.table} LIMIT 1').fetchone() is not None]
+        if not rollups:
+            return
+        started = time.monotonic()
+        try:
+            with conn:
+                for family, name, seconds in rollups:
+                    conn.execute(family.backfill_sql(name, seconds))
+            logging.info("✅ Built %s rollups from existing rows in %.1f s.",
+                         ', '.join(f'{family.table}_{name}' for family, name, _ in rollups), time.monotonic() - started)
+        except sqlite3.Error as e:
+            logging.error("❌ Error building rollups from existing rows: %s", e)
+
+    def _prune(self, conn):
+        """
+        Delete expired rows. Returns False if it stopped early because new rows
+        are waiting.
+        """
+        now = time.time()
+        try:
+            if self.minute_retention_days is not None:
+                cutoff = int(now - self.minute_retention_days * 86400)
+                with conn:
+                    for family in ROLLUP_FAMILIES:
+                        conn.execute(f'DELETE FROM {family.table}_minute WHERE bucket < ?', (cutoff,))
+            if self.retention_days is None:
+                return True
+            cutoff = int(now - self.retention_days * 86400)
+            return self._prune_raw(conn, 'power_data', 'id', cutoff) and \
+                self._prune_raw(conn, 'inverter_data', 'rowid', cutoff)
+        except sqlite3.Error as e:
+            logging.error("❌ Error pruning expired raw rows: %s", e)
+            return True
+
+    def _prune_raw(self, conn, table, key, cutoff):
+        """Delete rows older than cutoff by `key` range (keys grow with the epoch), one chunk per transaction."""
+        row = conn.execute(f'SELECT {key} FROM {table} WHERE epoch >= ? ORDER BY epoch LIMIT 1', (cutoff,)).fetchone()
+        keep_from = row[0] if row is not None else conn.execute(
+            f'SELECT coalesce(max({key}), 0) + 1 FROM {table}').fetchone()[0]
+        while True:
+            first = conn.execute(f'SELECT min({key}) FROM {table}').fetchone()[0]
+            if first is None or first >= keep_from:
+                return True
+            with conn:
+                deleted = conn.execute(f'DELETE FROM {table} WHERE {key} < ?',
+                                       (min(keep_from, first + self.prune_chunk),)).rowcount
+            self.rows_pruned += deleted
+            logging.debug("Pruned %s expired %s rows (%s in total).", deleted, table, self.rows_pruned)
+            if not self._queue.empty():
+                return False
@@ -0,0 +1,110 @@
+"""Base class for device WebSocket clients that run on their own background event loop."""
+import asyncio, json, logging, random, threading
+
+import aiohttp
+
+RECONNECT_MIN = 1.0
+RECONNECT_MAX = 30.0
+
+class BackgroundWebSocket:
+    """
+    Keeps one WebSocket to a device open on a background thread with its own
+    event loop, reconnecting with jittered exponential backoff. The synchronous
+    control loop only reads the state the subclass keeps in memory.
+
+    Subclasses implement on_message(message) for every JSON text frame and may
+    override on_connect(session, ws) (e.g. to subscribe or seed their state);
+    tasks started there with spawn() are cancelled when the socket closes.
+    """
+    label = 'WebSocket'
+
+    def __init__(self, url, auth=None, heartbeat=10.0):
+        self.url = url
+        self.auth = auth
+        self.heartbeat = heartbeat
+        self.connected = False
+        self.connects = 0
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._loop = None
+        self._task = None
+        self._thread = None
+
+    # -- hooks ------------------------------------------------------------------
+    async def on_connect(self, session, ws):
+        pass
+
+    def on_message(self, message):
+        """Called for every JSON text frame (already decoded); the default ignores it."""
+
+    def on_disconnect(self):
+        pass
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.append(task)
+        return task
+
+    # -- lifecycle --------------------------------------------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.label.lower().replace(' ', '-'), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join(timeout)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._run_forever())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    def _set_connected(self, connected):
+        with self._lock:
+            self.connected = connected
+
+    async def _run_forever(self):
+        delay = RECONNECT_MIN
+        failures = 0
+        async with aiohttp.ClientSession(auth=self.auth) as session:
+            while True:
+                try:
+                    await self._listen(session)
+                    delay = RECONNECT_MIN
+                    failures = 0
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    failures += 1
+                    # Only the first failed attempt is a warning; retries while the device is away are debug
+                    log = logging.warning if failures == 1 else logging.debug
+                    log(f"⚠️ {self.label} error: {e!r}; polling until reconnected.")
+                self._set_connected(False)
+                self.on_disconnect()
+                # Jittered exponential backoff, so a rebooting device is not hammered
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, RECONNECT_MAX)
+
+    async def _listen(self, session):
+        async with session.ws_connect(self.url, heartbeat=self.heartbeat) as ws:
+            self.connects += 1
+            logging.info(f"🔌 {self.label} connected ({self.url}).")
+            try:
+                await self.on_connect(session, ws)
+                async for message in ws:
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    self.on_message(json.loads(message.data))
+            finally:
+                for task in self._tasks:
+                    task.cancel()
+                self._tasks.clear()
+        logging.warning(f"⚠️ {self.label} closed; polling until reconnected.")
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
-import requests, time, sys, logging, argparse
-from requests.auth import HTTPBasicAuth
+import sys, logging, argparse
+from nulleinspeisung.http_client import DeviceClient, format_connection_stats
+from nulleinspeisung.scheduler import CycleScheduler
+from nulleinspeisung.probe import probe, log_results, has_inverters, has_grid_power, known_serials
 
 # ------------------------------------------------------------------------------
 # Configuration (Update these as needed)
@@ -9,17 +11,30 @@ serial = "116492226387"         # Serial number of the Hoymiles inverter
 maximum_wr = 2000               # Maximum inverter output (W)
 minimum_wr = 200                # Minimum inverter output (W)
 
+# Cycle timing
+cycle_interval = 10             # Seconds between two control cycles (fixed rate, monotonic clock)
+adaptive_polling = False        # Poll faster on grid power steps or saturation, back off when steady
+fast_interval = 2               # Seconds between cycles in fast mode (adaptive_polling only)
+
 dtu_ip = '192.168.179.152'      # IP address of OpenDTU
 dtu_nutzer = 'admin'            # OpenDTU username
 dtu_passwort = 'openDTU42'      # OpenDTU password
 
 shelly_ip = '192.168.179.112'    # IP address of Shelly 3EM
 
+# Startup check: read-only GETs to all endpoints in parallel, no limit is changed
+startup_deadline = 2            # Seconds the whole check may take
+
 # API Endpoints
 dtu_status_url = f'http://{dtu_ip}/api/livedata/status/inverters'
 dtu_config_url = f'http://{dtu_ip}/api/limit/config'
+dtu_limit_status_url = f'http://{dtu_ip}/api/limit/status'
 shelly_status_url = f'http://{shelly_ip}/rpc/EM.GetStatus?id=0'
 
+# Shared keep-alive HTTP clients (one connection pool per device, auth built once)
+dtu_client = DeviceClient('dtu', auth=(dtu_nutzer, dtu_passwort), pool_maxsize=2)
+shelly_client = DeviceClient('shelly', headers={'Content-Type': 'application/json'}, pool_maxsize=1)
+
 # ------------------------------------------------------------------------------
 # Argument parsing for debug mode
 # ------------------------------------------------------------------------------
@@ -40,43 +55,13 @@ logging.basicConfig(
 # ------------------------------------------------------------------------------
 # Connection test functions
 # ------------------------------------------------------------------------------
-def test_connection(url, headers=None, auth=None, timeout=5):
-    """Test connectivity to a given URL using a GET request."""
-    try:
-        response = requests.get(url, headers=headers, auth=auth, timeout=timeout)
-        response.raise_for_status()
-        logging.info(f"Connection test successful for {url}")
-        return True
-    except Exception as e:
-        logging.error(f"Connection test failed for {url}: {e}")
-        return False
-
 def test_api_endpoints():
-    """Test connectivity for DTU status, Shelly status, and DTU configuration endpoints."""
-    all_ok = True
-
-    if not test_connection(dtu_status_url):
-        all_ok = False
-    if not test_connection(shelly_status_url, headers={'Content-Type': 'application/json'}):
-        all_ok = False
-
-    # Test DTU configuration endpoint with a harmless payload (using the minimum value)
-    try:
-        data_payload = f'data={{"serial":"{serial}", "limit_type":0, "limit_value":{minimum_wr}}}'
-        response = requests.post(
-            dtu_config_url,
-            data=data_payload,
-            auth=HTTPBasicAuth(dtu_nutzer, dtu_passwort),
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=5
-        )
-        response.raise_for_status()
-        logging.info(f"Configuration endpoint test successful for {dtu_config_url}")
-    except Exception as e:
-        logging.error(f"Configuration endpoint test failed for {dtu_config_url}: {e}")
-        all_ok = False
-
-    return all_ok
+    """Check DTU status, Shelly status and the DTU limit API in parallel without changing any limit."""
+    return log_results(probe({
+        'DTU status': (dtu_client, dtu_status_url, has_inverters),
+        'Shelly status': (shelly_client, shelly_status_url, has_grid_power),
+        'DTU limit API': (dtu_client, dtu_limit_status_url, known_serials([serial])),
+    }, deadline=startup_deadline))
 
 # ------------------------------------------------------------------------------
 # Data fetching functions
@@ -84,9 +69,7 @@ def test_api_endpoints():
 def fetch_dtu_data():
     """Fetch and parse data from the OpenDTU API."""
     try:
-        response = requests.get(dtu_status_url, timeout=5)
-        response.raise_for_status()
-        r = response.json()
+        r = dtu_client.get_json(dtu_status_url)
         logging.debug(f"DTU response: {r}")
         inverter = r.get('inverters', [{}])[0]
 
@@ -103,9 +86,7 @@ def fetch_dtu_data():
 def fetch_shelly_data():
     """Fetch and parse data from the Shelly 3EM API."""
     try:
-        response = requests.get(shelly_status_url, headers={'Content-Type': 'application/json'}, timeout=5)
-        response.raise_for_status()
-        r = response.json()
+        r = shelly_client.get_json(shelly_status_url)
         logging.debug(f"Shelly response: {r}")
         grid_sum = r.get('total_act_power', None)
         if grid_sum is None:
@@ -123,14 +104,11 @@ def update_inverter_limit(new_limit):
     try:
         data_payload = f'data={{"serial":"{serial}", "limit_type":0, "limit_value":{new_limit}}}'
         logging.debug(f"Sending configuration payload: {data_payload}")
-        response = requests.post(
+        response = dtu_client.post(
             dtu_config_url,
             data=data_payload,
-            auth=HTTPBasicAuth(dtu_nutzer, dtu_passwort),
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=5
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}
         )
-        response.raise_for_status()
         result = response.json()
         logging.info(f"Configuration sent successfully: {result.get('type', 'No type in response')}")
     except Exception as e:
@@ -140,17 +118,19 @@ def update_inverter_limit(new_limit):
 # Main loop
 # ------------------------------------------------------------------------------
 def main_loop():
+    scheduler = CycleScheduler(interval=cycle_interval, adaptive=adaptive_polling, fast_interval=fast_interval)
     while True:
         dtu_data = fetch_dtu_data()
         shelly_data = fetch_shelly_data()
         if dtu_data is None or shelly_data is None:
             logging.warning("Skipping iteration due to previous errors.")
-            time.sleep(10)
+            scheduler.wait()
             continue
 
         reachable, producing, altes_limit, power_dc, power = dtu_data
         grid_sum = shelly_data
 
+        saturated = False
         logging.info(f"Grid Power: {round(grid_sum, 0)} W, Inverter AC Power: {round(power, 0)} W, Combined: {round(grid_sum + power, 0)} W")
         if reachable:
             # Calculate new setpoint
@@ -160,6 +140,7 @@ def main_loop():
             # Enforce maximum and minimum limits
             if setpoint > maximum_wr:
                 setpoint = maximum_wr
+                saturated = True
                 logging.info(f"Setpoint capped at maximum: {maximum_wr} W")
             elif setpoint < minimum_wr:
                 setpoint = minimum_wr
@@ -176,8 +157,9 @@ def main_loop():
         else:
             logging.warning("DTU not reachable; skipping update.")
 
+        logging.debug(f"Connection reuse: {format_connection_stats()} | Scheduler: {scheduler.format_stats()}")
         sys.stdout.flush()
-        time.sleep(10)
+        scheduler.wait(grid_power=grid_sum, saturated=saturated)
 
 # ------------------------------------------------------------------------------
 # Main entry point
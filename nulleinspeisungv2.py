@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
-import requests, time, sys, logging, argparse
-from requests.auth import HTTPBasicAuth
+import sys, logging, argparse
+from nulleinspeisung.logsetup import setup_logging
+from nulleinspeisung.http_client import DeviceClient, format_connection_stats
+from nulleinspeisung.scheduler import CycleScheduler
+from nulleinspeisung.limits import LimitCache
+from nulleinspeisung.probe import probe, log_results, has_inverters, has_grid_power, known_serials
 
 # ------------------------------------------------------------------------------
 # Configuration (Update these as needed)
@@ -18,61 +22,51 @@ minimum_wr2 = 200               # Minimum output (W) for inverter 2
 # Note: Inverter2 is now always updated so its load is controlled
 default_altes_limit2 = 100      # Fallback current limit for inverter 2 if DTU data is not available
 
+# Limit write suppression
+limit_deadband = 50             # Changes smaller than this (W) are not sent to the DTU
+limit_min_hold = 30             # Minimum seconds between two limit commands to the same inverter
+
+# Cycle timing
+cycle_interval = 10             # Seconds between two control cycles (fixed rate, monotonic clock)
+adaptive_polling = False        # Poll faster on grid power steps or saturation, back off when steady
+fast_interval = 2               # Seconds between cycles in fast mode (adaptive_polling only)
+
 # OpenDTU and Shelly connection configuration
 dtu_ip = '192.168.179.152'      # IP address of OpenDTU
 dtu_nutzer = 'admin'            # OpenDTU username
 dtu_passwort = 'openDTU42'      # OpenDTU password
 shelly_ip = '192.168.179.112'    # IP address of Shelly 3EM
 
+# Startup check: read-only GETs to all endpoints in parallel, no limit is changed
+startup_deadline = 2            # Seconds the whole check may take
+
 # API Endpoints
 dtu_status_url = f'http://{dtu_ip}/api/livedata/status/inverters'
 dtu_config_url = f'http://{dtu_ip}/api/limit/config'
+dtu_limit_status_url = f'http://{dtu_ip}/api/limit/status'
 shelly_status_url = f'http://{shelly_ip}/rpc/EM.GetStatus?id=0'
 
-# ------------------------------------------------------------------------------
-# Custom Color Formatter for logging with emojis
-# ------------------------------------------------------------------------------
-class ColorFormatter(logging.Formatter):
-    # ANSI escape codes for colors
-    COLORS = {
-        "DEBUG": "\033[34m",    # Blue
-        "INFO": "\033[32m",     # Green
-        "WARNING": "\033[33m",  # Yellow
-        "ERROR": "\033[31m",    # Red
-        "CRITICAL": "\033[1;31m"  # Bold Red
-    }
-    RESET = "\033[0m"
-
-    # Emojis per level
-    EMOJIS = {
-        "DEBUG": "🔍",
-        "INFO": "💡",
-        "WARNING": "⚠️",
-        "ERROR": "❌",
-        "CRITICAL": "🛑"
-    }
+# Shared keep-alive HTTP clients (one connection pool per device, auth built once)
+dtu_client = DeviceClient('dtu', auth=(dtu_nutzer, dtu_passwort), pool_maxsize=2)
+shelly_client = DeviceClient('shelly', headers={'Content-Type': 'application/json'}, pool_maxsize=1)
 
-    def format(self, record):
-        levelname = record.levelname
-        if levelname in self.COLORS:
-            record.levelname = f"{self.COLORS[levelname]}{self.EMOJIS[levelname]} {levelname}{self.RESET}"
-        return super().format(record)
+# Last commanded / acknowledged limit per inverter serial
+limit_cache = LimitCache(deadband=limit_deadband, min_hold=limit_min_hold)
 
 # ------------------------------------------------------------------------------
 # Argument parsing for debug mode
 # ------------------------------------------------------------------------------
 parser = argparse.ArgumentParser(description="Script to communicate with Shelly 3EM Pro and OpenDTU")
 parser.add_argument('--debug', action='store_true', help="Enable debug mode with detailed logging output")
+parser.add_argument('--json-logs', action='store_true', help="Write log records as JSON lines")
 args = parser.parse_args()
 
 # ------------------------------------------------------------------------------
-# Logging configuration based on debug flag using our ColorFormatter
+# Logging configuration: records go through a queue and are written by a
+# background thread (colors only on a terminal, JSON lines with --json-logs)
 # ------------------------------------------------------------------------------
 log_level = logging.DEBUG if args.debug else logging.INFO
-handler = logging.StreamHandler(sys.stdout)
-formatter = ColorFormatter(fmt='%(asctime)s [%(levelname)s] %(message)s', datefmt='%H:%M:%S')
-handler.setFormatter(formatter)
-logging.basicConfig(level=log_level, handlers=[handler])
+setup_logging(log_level, json_output=args.json_logs)
 
 # ------------------------------------------------------------------------------
 # DTU status fetching
@@ -82,13 +76,11 @@ def fetch_dtu_status():
     Fetch the complete DTU status JSON, which contains both inverters and total production.
     """
     try:
-        response = requests.get(dtu_status_url, timeout=5)
-        response.raise_for_status()
-        r = response.json()
-        logging.debug(f"DTU response: {r}")
+        r = dtu_client.get_json(dtu_status_url)
+        logging.debug("DTU response: %s", r)
         return r
     except Exception as e:
-        logging.error("❌ Error fetching DTU status: " + str(e), exc_info=True)
+        logging.error("❌ Error fetching DTU status: %s", e, exc_info=True)
         return None
 
 # ------------------------------------------------------------------------------
@@ -97,16 +89,14 @@ def fetch_dtu_status():
 def fetch_shelly_data():
     """Fetch and parse data from the Shelly 3EM API."""
     try:
-        response = requests.get(shelly_status_url, headers={'Content-Type': 'application/json'}, timeout=5)
-        response.raise_for_status()
-        r = response.json()
-        logging.debug(f"Shelly response: {r}")
+        r = shelly_client.get_json(shelly_status_url)
+        logging.debug("Shelly response: %s", r)
         grid_sum = r.get('total_act_power', None)
         if grid_sum is None:
             raise ValueError("total_act_power not found in Shelly response")
         return grid_sum
     except Exception as e:
-        logging.error("❌ Error fetching Shelly data: " + str(e), exc_info=True)
+        logging.error("❌ Error fetching Shelly data: %s", e, exc_info=True)
         return None
 
 # ------------------------------------------------------------------------------
@@ -136,88 +126,55 @@ def update_inverter_limit(serial_param, new_limit):
     """Send a new inverter limit to OpenDTU for a given inverter serial."""
     try:
         data_payload = f'data={{"serial":"{serial_param}", "limit_type":0, "limit_value":{new_limit}}}'
-        logging.debug(f"Sending configuration payload for serial {serial_param}: {data_payload}")
-        response = requests.post(
+        logging.debug("Sending configuration payload for serial %s: %s", serial_param, data_payload)
+        response = dtu_client.post(
             dtu_config_url,
             data=data_payload,
-            auth=HTTPBasicAuth(dtu_nutzer, dtu_passwort),
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=5
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}
         )
-        response.raise_for_status()
         result = response.json()
-        logging.info(f"✅ Updated inverter ({serial_param}) limit successfully: {result.get('type', 'No type in response')}")
+        logging.info("✅ Updated inverter (%s) limit successfully: %s", serial_param, result.get('type', 'No type in response'))
+        return True
     except Exception as e:
-        logging.error(f"❌ Error updating inverter limit for serial {serial_param}: {e}", exc_info=True)
+        logging.error("❌ Error updating inverter limit for serial %s: %s", serial_param, e, exc_info=True)
+        return False
 
 # ------------------------------------------------------------------------------
-# Connection test functions
+# Send a limit only if it really changed (deadband + hold time per serial)
 # ------------------------------------------------------------------------------
-def test_connection(url, headers=None, auth=None, timeout=5):
-    """Test connectivity to a given URL using a GET request."""
-    try:
-        response = requests.get(url, headers=headers, auth=auth, timeout=timeout)
-        response.raise_for_status()
-        logging.info(f"✅ Connection test successful for {url}")
-        return True
-    except Exception as e:
-        logging.error(f"❌ Connection test failed for {url}: {e}")
-        return False
+def send_limit_if_changed(serial_param, name, old_limit, new_limit):
+    if not limit_cache.should_send(serial_param, new_limit):
+        logging.info("👌 No significant change in %s setpoint; no update necessary (%s limit writes).",
+                     name, limit_cache.format_stats())
+        return
+    logging.info("🔄 Updating %s limit from %s W to %s W", name, old_limit, new_limit)
+    if update_inverter_limit(serial_param, new_limit):
+        limit_cache.record_sent(serial_param, new_limit)
 
+# ------------------------------------------------------------------------------
+# Connection test functions
+# ------------------------------------------------------------------------------
 def test_api_endpoints():
-    """Test connectivity for DTU status, Shelly status, and DTU configuration endpoints."""
-    all_ok = True
-
-    if not test_connection(dtu_status_url):
-        all_ok = False
-    if not test_connection(shelly_status_url, headers={'Content-Type': 'application/json'}):
-        all_ok = False
-
-    # Test configuration endpoint for inverter 1
-    try:
-        data_payload = f'data={{"serial":"{serial}", "limit_type":0, "limit_value":{minimum_wr}}}'
-        response = requests.post(
-            dtu_config_url,
-            data=data_payload,
-            auth=HTTPBasicAuth(dtu_nutzer, dtu_passwort),
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=5
-        )
-        response.raise_for_status()
-        logging.info(f"✅ Configuration endpoint test successful for inverter 1 at {dtu_config_url}")
-    except Exception as e:
-        logging.error(f"❌ Configuration endpoint test failed for inverter 1 at {dtu_config_url}: {e}")
-        all_ok = False
-
-    # Test configuration endpoint for inverter 2 if enabled
-    if enable_second_inverter:
-        try:
-            data_payload = f'data={{"serial":"{serial2}", "limit_type":0, "limit_value":{minimum_wr2}}}'
-            response = requests.post(
-                dtu_config_url,
-                data=data_payload,
-                auth=HTTPBasicAuth(dtu_nutzer, dtu_passwort),
-                headers={'Content-Type': 'application/x-www-form-urlencoded'},
-                timeout=5
-            )
-            response.raise_for_status()
-            logging.info(f"✅ Configuration endpoint test successful for inverter 2 at {dtu_config_url}")
-        except Exception as e:
-            logging.error(f"❌ Configuration endpoint test failed for inverter 2 at {dtu_config_url}: {e}")
-            all_ok = False
-
-    return all_ok
+    """Check DTU status, Shelly status and the DTU limit API in parallel without changing any limit."""
+    serials = [serial, serial2] if enable_second_inverter else [serial]
+    return log_results(probe({
+        'DTU status': (dtu_client, dtu_status_url, has_inverters),
+        'Shelly status': (shelly_client, shelly_status_url, has_grid_power),
+        'DTU limit API': (dtu_client, dtu_limit_status_url, known_serials(serials)),
+    }, deadline=startup_deadline))
 
 # ------------------------------------------------------------------------------
 # Main loop
 # ------------------------------------------------------------------------------
 def main_loop():
+    scheduler = CycleScheduler(interval=cycle_interval, adaptive=adaptive_polling, fast_interval=fast_interval)
+    setpoint2 = None                # Inverter 2 setpoint of the last cycle, sent or not
     while True:
         # Fetch DTU status once
         dtu_status = fetch_dtu_status()
         if dtu_status is None:
             logging.warning("⚠️ Skipping iteration due to DTU errors.")
-            time.sleep(10)
+            scheduler.wait()
             continue
 
         # Extract total inverter production from DTU data
@@ -225,17 +182,21 @@ def main_loop():
         inverters = dtu_status.get('inverters', [])
         if len(inverters) < 1:
             logging.error("❌ No inverter data available in DTU response.")
-            time.sleep(10)
+            scheduler.wait()
             continue
 
         # Extract inverter 1 data
         inverter1 = inverters[0]
         reachable1, producing1, altes_limit1, power1, name1 = extract_inverter_data(inverter1, "Inverter 1")
+        if reachable1:
+            limit_cache.record_ack(serial, altes_limit1)
 
         # Extract inverter 2 data (if available and enabled)
         if enable_second_inverter and len(inverters) >= 2:
             inverter2 = inverters[1]
             reachable2, producing2, altes_limit2, power2, name2 = extract_inverter_data(inverter2, "Inverter 2")
+            if reachable2:
+                limit_cache.record_ack(serial2, altes_limit2)
         else:
             logging.warning("⚠️ Inverter 2 data not available; using fallback values.")
             altes_limit2 = default_altes_limit2
@@ -245,58 +206,57 @@ def main_loop():
         grid_sum = fetch_shelly_data()
         if grid_sum is None:
             logging.warning("⚠️ Skipping iteration due to Shelly errors.")
-            time.sleep(10)
+            scheduler.wait()
             continue
 
         # Log the current status using total production from DTU
-        logging.info(f"⚡ Grid Power: {round(grid_sum, 0)} W | 🔋 {name1} AC Power: {round(power1, 0)} W | 🏭 Total Production: {round(total_power, 0)} W")
+        logging.info("⚡ Grid Power: %s W | 🔋 %s AC Power: %s W | 🏭 Total Production: %s W",
+                     round(grid_sum, 0), name1, round(power1, 0), round(total_power, 0))
 
         # Process inverter 1
         if reachable1:
             setpoint1 = grid_sum + altes_limit1 - 5
             if setpoint1 > maximum_wr:
                 setpoint1 = maximum_wr
-                logging.info(f"🚀 {name1} setpoint capped at maximum: {maximum_wr} W")
+                logging.info("🚀 %s setpoint capped at maximum: %s W", name1, maximum_wr)
             elif setpoint1 < minimum_wr:
                 setpoint1 = minimum_wr
-                logging.info(f"🔋 {name1} setpoint raised to minimum: {minimum_wr} W")
+                logging.info("🔋 %s setpoint raised to minimum: %s W", name1, minimum_wr)
             else:
-                logging.info(f"💡 {name1} setpoint calculated: {setpoint1} W")
+                logging.info("💡 %s setpoint calculated: %s W", name1, setpoint1)
 
-            if round(setpoint1 / 50, 0) != round(altes_limit1 / 50, 0):
-                logging.info(f"🔄 Updating {name1} limit from {altes_limit1} W to {setpoint1} W")
-                update_inverter_limit(serial, setpoint1)
-            else:
-                logging.info("👌 No significant change in inverter 1 setpoint; no update necessary.")
+            send_limit_if_changed(serial, name1, altes_limit1, setpoint1)
         else:
-            logging.warning(f"⚠️ {name1} DTU not reachable; skipping update.")
+            logging.warning("⚠️ %s DTU not reachable; skipping update.", name1)
 
         # Process inverter 2 if enabled
         if enable_second_inverter:
             # Determine shortfall: if inverter 1 is not saturated, shortfall is zero.
             if setpoint1 < maximum_wr:
                 shortfall = 0
-                logging.info(f"😊 {name1} is not saturated; no shortfall detected.")
+                logging.info("😊 %s is not saturated; no shortfall detected.", name1)
             else:
                 shortfall = max(0, grid_sum - maximum_wr)
-                logging.info(f"⚠️ {name1} is saturated; shortfall = {shortfall} W")
+                logging.info("⚠️ %s is saturated; shortfall = %s W", name1, shortfall)
 
-            # Calculate setpoint for inverter 2 using its own limit (from DTU data if available) plus the shortfall.
-            setpoint2 = altes_limit2 + shortfall - 5
+            # Calculate setpoint for inverter 2 from its last setpoint (at start: its DTU limit) plus the shortfall.
+            # Building on the last setpoint instead of the applied limit lets the 5 W steps add up until
+            # they pass the deadband and are sent.
+            setpoint2 = (altes_limit2 if setpoint2 is None else setpoint2) + shortfall - 5
             if setpoint2 > maximum_wr2:
                 setpoint2 = maximum_wr2
-                logging.info(f"🚀 {name2} setpoint capped at maximum: {maximum_wr2} W")
+                logging.info("🚀 %s setpoint capped at maximum: %s W", name2, maximum_wr2)
             elif setpoint2 < minimum_wr2:
                 setpoint2 = minimum_wr2
-                logging.info(f"🔋 {name2} setpoint raised to minimum: {minimum_wr2} W")
+                logging.info("🔋 %s setpoint raised to minimum: %s W", name2, minimum_wr2)
             else:
-                logging.info(f"💡 {name2} setpoint calculated: {setpoint2} W")
+                logging.info("💡 %s setpoint calculated: %s W", name2, setpoint2)
 
-            logging.info(f"🔄 Updating {name2} limit to {setpoint2} W")
-            update_inverter_limit(serial2, setpoint2)
+            send_limit_if_changed(serial2, name2, altes_limit2, setpoint2)
 
-        sys.stdout.flush()
-        time.sleep(10)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Connection reuse: %s | Scheduler: %s", format_connection_stats(), scheduler.format_stats())
+        scheduler.wait(grid_power=grid_sum, saturated=reachable1 and setpoint1 >= maximum_wr)
 
 # ------------------------------------------------------------------------------
 # Main entry point
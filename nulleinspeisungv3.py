@@ -1,21 +1,58 @@
 #!/usr/bin/env python3
-import requests, time, sys, logging, argparse, sqlite3, datetime
-from requests.auth import HTTPBasicAuth
+import sys, time, logging, argparse, atexit, signal
+from nulleinspeisung.logsetup import LazyQueueHandler, setup_logging
+from nulleinspeisung.http_client import DeviceClient, format_connection_stats
+from nulleinspeisung.scheduler import CycleScheduler, IdleMonitor
+from nulleinspeisung.acquisition import acquire, timed_fetch
+from nulleinspeisung.storage import PowerDataWriter
+from nulleinspeisung.limits import LimitCache
+from nulleinspeisung.controller import Controller, Inverter, make_law, parse_inverters
+from nulleinspeisung import metrics
+from nulleinspeisung.probe import probe, log_results, has_inverters, has_grid_power, known_serials
+from nulleinspeisung.state import StateFile, StateWriter
+from nulleinspeisung.commands import LimitCommandQueue, QUEUED
+from nulleinspeisung.limit_status import LimitStatusPoller
+from nulleinspeisung.breaker import CircuitBreaker, CircuitOpenError, ERROR_CIRCUIT_OPEN, ERROR_REASONS
+from nulleinspeisung.sampling import ShellySampler
+from nulleinspeisung.status import StatusStore
 
 # ------------------------------------------------------------------------------
 # Configuration (Update these as needed)
 # ------------------------------------------------------------------------------
-# Inverter 1 configuration
-serial = "116492226387"         # Serial number of the Hoymiles inverter
-maximum_wr = 2000               # Maximum inverter output (W) for inverter 1
-minimum_wr = 200                # Minimum inverter output (W) for inverter 1
-
-# Inverter 2 configuration
-enable_second_inverter = True   # Enable/disable second inverter support
-serial2 = "1164a00b64e3"         # Serial number for inverter 2 (if enabled)
-maximum_wr2 = 1500              # Maximum output (W) for inverter 2
-minimum_wr2 = 200               # Minimum output (W) for inverter 2
-default_altes_limit2 = 200      # Fallback current limit for inverter 2 if DTU data is not available
+# Inverter configuration: one entry per Hoymiles inverter on the DTU, matched by serial.
+# Inverters with a lower priority value are filled first; inside one priority
+# group the required power is split by weight.
+inverters = [
+    Inverter(serial="116492226387", name="Inverter 1", minimum=200, maximum=2000, priority=0),
+    Inverter(serial="1164a00b64e3", name="Inverter 2", minimum=200, maximum=1500, priority=1),
+]
+power_offset = 5                # W of grid import the controller keeps as a margin
+
+# Control law for the total inverter power: 'proportional' (grid power + reported limits,
+# the original rule), 'pi' (PI with anti-windup) or 'feedforward' (grid power + measured
+# inverter power). Compare them with benchmarks/bench_control_loop.py --control-laws
+control_law = 'proportional'
+
+# Limit write suppression
+limit_deadband = 20             # Changes smaller than this (W) are not sent to the DTU
+limit_min_hold = 30             # Minimum seconds between two limit commands to the same inverter
+limit_command_rate = 2.0        # Limit POSTs per second over all inverters (sent in the background)
+limit_ack_timeout = 30          # Seconds a sent limit may take until the DTU reports it applied
+limit_status_interval = 1       # Seconds between /api/limit/status polls while a limit is pending
+                                # (None = only compare limit_absolute once per cycle)
+
+# Cycle timing
+cycle_interval = 10             # Seconds between two control cycles (fixed rate, monotonic clock)
+adaptive_polling = False        # Poll faster on grid power steps or saturation, back off when steady
+fast_interval = 2               # Seconds between cycles in fast mode (adaptive_polling only)
+
+# Idle mode (night): after idle_enter_cycles cycles in which no inverter was producing, only
+# the DTU is probed every idle_interval seconds, no limits are sent and instead of a full row
+# every cycle one idle marker row is stored every idle_marker_interval seconds. The first
+# cycle with a producing inverter returns to normal operation.
+idle_interval = 60
+idle_enter_cycles = 3
+idle_marker_interval = 900
 
 # OpenDTU and Shelly connection configuration
 dtu_ip = '192.168.179.152'      # IP address of OpenDTU
@@ -23,334 +60,572 @@ dtu_nutzer = 'admin'            # OpenDTU username
 dtu_passwort = 'openDTU42'      # OpenDTU password
 shelly_ip = '192.168.179.112'    # IP address of Shelly 3EM
 
+# Circuit breaker per device: after circuit_failure_threshold timeouts/refused connections in a
+# row, requests to that device are skipped instead of waiting for the timeout every cycle. A
+# single probe request goes out after circuit_base_delay seconds, doubled after every failed
+# probe up to circuit_max_delay (each +/- 20 % jitter).
+circuit_failure_threshold = 2
+circuit_base_delay = 10
+circuit_max_delay = 300
+
+# Startup check: read-only GETs to all endpoints in parallel, no limit is changed
+startup_deadline = 2            # Seconds the whole check may take
+
+# OpenDTU livedata mode: inverter state comes from the /livedata WebSocket instead
+# of downloading the full status JSON every cycle; polling takes over while it is down
+dtu_livedata = False
+
+# Shelly push mode: grid power arrives via NotifyStatus on the RPC WebSocket
+# instead of being polled; polling takes over while the socket is down
+shelly_push = False
+shelly_push_threshold = 150     # W grid power change that starts a control cycle right away
+
+# Shelly sampling: a background thread polls the Shelly every shelly_sample_interval seconds
+# and the control cycle uses the filtered value of the last shelly_sample_window samples
+# ('median', 'ema' or 'latest'), so single spikes do not move the limits. Not used in push mode.
+shelly_sampling = False
+shelly_sample_interval = 1
+shelly_sample_window = 10
+shelly_filter = 'median'
+
 # API Endpoints
 dtu_status_url = f'http://{dtu_ip}/api/livedata/status/inverters'
 dtu_config_url = f'http://{dtu_ip}/api/limit/config'
+dtu_limit_status_url = f'http://{dtu_ip}/api/limit/status'
+dtu_ws_url = f'ws://{dtu_ip}/livedata'
 shelly_status_url = f'http://{shelly_ip}/rpc/EM.GetStatus?id=0'
+shelly_ws_url = f'ws://{shelly_ip}/rpc'
+
+# Shared keep-alive HTTP clients (one connection pool per device, auth built once)
+dtu_client = DeviceClient('dtu', auth=(dtu_nutzer, dtu_passwort), pool_maxsize=4,
+                          breaker=CircuitBreaker('DTU', failure_threshold=circuit_failure_threshold,
+                                                 base_delay=circuit_base_delay, max_delay=circuit_max_delay))
+shelly_client = DeviceClient('shelly', headers={'Content-Type': 'application/json'}, pool_maxsize=1,
+                             breaker=CircuitBreaker('Shelly', failure_threshold=circuit_failure_threshold,
+                                                    base_delay=circuit_base_delay, max_delay=circuit_max_delay))
+
+# Last commanded / acknowledged limit per inverter serial
+limit_cache = LimitCache(deadband=limit_deadband, min_hold=limit_min_hold, ack_timeout=limit_ack_timeout)
+
+# Distributes the required power across all configured inverters
+controller = Controller(inverters, offset=power_offset, law=make_law(control_law))
+
+# Night detection from the producing flag of the configured inverters
+idle_monitor = IdleMonitor([inverter.serial for inverter in inverters], enter_cycles=idle_enter_cycles)
 
 # SQLite database file
 db_file = "power_data.db"
+db_batch_size = 50              # Rows per commit
+db_flush_interval = 60          # Max. seconds a row waits in memory before it is committed
+db_retention_days = 30          # Days of raw 10 s rows to keep (None = keep forever)
+db_minute_retention_days = 365  # Days of minute rollups to keep; hour and day rollups are kept forever
 
-# ------------------------------------------------------------------------------
-# Custom Color Formatter for logging with emojis
-# ------------------------------------------------------------------------------
-class ColorFormatter(logging.Formatter):
-    COLORS = {
-        "DEBUG": "\033[34m",    # Blue
-        "INFO": "\033[32m",     # Green
-        "WARNING": "\033[33m",  # Yellow
-        "ERROR": "\033[31m",    # Red
-        "CRITICAL": "\033[1;31m"  # Bold Red
-    }
-    RESET = "\033[0m"
-    EMOJIS = {
-        "DEBUG": "🔍",
-        "INFO": "💡",
-        "WARNING": "⚠️",
-        "ERROR": "❌",
-        "CRITICAL": "🛑"
-    }
-    def format(self, record):
-        levelname = record.levelname
-        if levelname in self.COLORS:
-            record.levelname = f"{self.COLORS[levelname]}{self.EMOJIS[levelname]} {levelname}{self.RESET}"
-        return super().format(record)
+# Warm start: limit cache and polling state are saved in the background and reloaded after a
+# restart if they are at most state_max_age seconds old (None disables the state file). The
+# file is written when a commanded limit changed, otherwise at most every state_save_interval s
+state_file = "nulleinspeisung_state.json"
+state_max_age = 300
+state_save_interval = 60
+
+# Prometheus metrics on http://<host>:<metrics_port>/metrics (None disables the endpoint)
+metrics_port = 9464
+
+# Status API on the same port: /api/status (last cycle) and /api/history (last status_history
+# cycles), served from memory, so consumers never cause a DTU or Shelly request
+status_history = 360
+
+# MQTT for Home Assistant (None disables): readings and setpoints as one JSON message on
+# <mqtt_topic>/state with discovery configs under <mqtt_discovery_prefix>. A message is only
+# sent when a value changed by its deadband (at most every mqtt_min_interval seconds) or
+# mqtt_heartbeat seconds passed
+mqtt_host = None
+mqtt_port = 1883
+mqtt_user = None
+mqtt_password = None
+mqtt_topic = 'nulleinspeisung'
+mqtt_discovery_prefix = 'homeassistant'
+mqtt_min_interval = 30
+mqtt_heartbeat = 300
 
 # ------------------------------------------------------------------------------
 # Argument parsing for debug mode
 # ------------------------------------------------------------------------------
 parser = argparse.ArgumentParser(description="Script to communicate with Shelly 3EM Pro and OpenDTU")
 parser.add_argument('--debug', action='store_true', help="Enable debug mode with detailed logging output")
+parser.add_argument('--json-logs', action='store_true', help="Write log records as JSON lines")
 args = parser.parse_args()
 
 # ------------------------------------------------------------------------------
-# Logging configuration based on debug flag using our ColorFormatter
+# Logging configuration: records go through a queue and are written by a
+# background thread (colors only on a terminal, JSON lines with --json-logs)
 # ------------------------------------------------------------------------------
 log_level = logging.DEBUG if args.debug else logging.INFO
-handler = logging.StreamHandler(sys.stdout)
-formatter = ColorFormatter(fmt='%(asctime)s [%(levelname)s] %(message)s', datefmt='%H:%M:%S')
-handler.setFormatter(formatter)
-logging.basicConfig(level=log_level, handlers=[handler])
+setup_logging(log_level, json_output=args.json_logs)
 
 # ------------------------------------------------------------------------------
-# SQLite Database Initialization
+# SQLite Database Initialization (background writer, WAL mode, batched commits)
 # ------------------------------------------------------------------------------
+db_writer = None
+
 def init_db():
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS power_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            grid_power REAL,
-            inverter1_power REAL,
-            inverter2_power REAL,
-            total_production REAL,
-            inverter1_setpoint REAL,
-            inverter2_setpoint REAL,
-            inverter1_reachable INTEGER,
-            inverter2_reachable INTEGER,
-            dtus_error INTEGER,
-            shelly_error INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    global db_writer
+    db_writer = PowerDataWriter(db_file, batch_size=db_batch_size, flush_interval=db_flush_interval,
+                                retention_days=db_retention_days,
+                                minute_retention_days=db_minute_retention_days).start()
+    atexit.register(db_writer.close)
     logging.info("✅ SQLite database initialized.")
 
-def store_data(grid_power, inverter1_power, inverter2_power, total_production,
-               inverter1_setpoint, inverter2_setpoint,
-               inverter1_reachable, inverter2_reachable,
-               dtus_error, shelly_error):
-    try:
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO power_data (
-                grid_power, inverter1_power, inverter2_power, total_production,
-                inverter1_setpoint, inverter2_setpoint,
-                inverter1_reachable, inverter2_reachable,
-                dtus_error, shelly_error
-            ) VALUES (?,?,?,?,?,?,?,?,?,?)
-        ''', (grid_power, inverter1_power, inverter2_power, total_production,
-              inverter1_setpoint, inverter2_setpoint,
-              inverter1_reachable, inverter2_reachable,
-              dtus_error, shelly_error))
-        conn.commit()
-        conn.close()
-        logging.debug("Data stored in SQLite database.")
-    except Exception as e:
-        logging.error(f"❌ Error storing data in SQLite DB: {e}", exc_info=True)
+def store_data(grid_power, total_production, dtus_error, shelly_error,
+               inverter1_power=None, inverter2_power=None,
+               inverter1_setpoint=None, inverter2_setpoint=None,
+               inverter1_reachable=0, inverter2_reachable=0, inverters=()):
+    # Only queues the row; the writer thread commits it later
+    db_writer.submit(
+        inverters=inverters,
+        grid_power=grid_power, inverter1_power=inverter1_power, inverter2_power=inverter2_power,
+        total_production=total_production,
+        inverter1_setpoint=inverter1_setpoint, inverter2_setpoint=inverter2_setpoint,
+        inverter1_reachable=inverter1_reachable, inverter2_reachable=inverter2_reachable,
+        dtus_error=dtus_error, shelly_error=shelly_error
+    )
+
+# ------------------------------------------------------------------------------
+# Warm-start state (written atomically by a background thread, reloaded once at startup)
+# ------------------------------------------------------------------------------
+state_store = None
+state_writer = None
+
+def restore_state(scheduler):
+    global state_store, state_writer
+    if not state_file:
+        return
+    state_store = StateFile(state_file, max_age=state_max_age)
+    state_writer = StateWriter(state_store, interval=state_save_interval,
+                               on_write=lambda seconds: metrics.STAGE_DURATION.observe(seconds, stage='state_write'))
+    state_writer.start()
+    atexit.register(state_writer.close)
+    sections = state_store.load()
+    if sections is None:
+        return
+    limit_cache.restore(sections.get('limits', {}), serials={inverter.serial for inverter in inverters})
+    scheduler.restore(sections.get('scheduler', {}))
+    controller.restore(sections.get('controller', {}))
+    logging.info(f"♻️ Restored controller state from {state_file} ({len(limit_cache.entries)} inverters).")
+
+def save_state(scheduler):
+    if state_writer is None:
+        return
+    limits = limit_cache.snapshot()
+    # A new command is written right away; acknowledgement times and law state only every state_save_interval
+    state_writer.submit(key={serial: entry['commanded'] for serial, entry in limits.items()},
+                        limits=limits, scheduler=scheduler.snapshot(), controller=controller.snapshot())
 
 # ------------------------------------------------------------------------------
 # DTU status fetching
 # ------------------------------------------------------------------------------
+dtu_live_client = None
+
+def init_dtu_livedata():
+    global dtu_live_client
+    # aiohttp is only needed for livedata mode
+    from nulleinspeisung.dtu_ws import DtuLiveClient
+    dtu_live_client = DtuLiveClient(dtu_ws_url, dtu_status_url, auth=(dtu_nutzer, dtu_passwort)).start()
+    logging.info(f"✅ OpenDTU livedata mode enabled ({dtu_ws_url}).")
+
 def fetch_dtu_status():
+    if dtu_live_client is not None:
+        r = dtu_live_client.dtu_status()
+        if r is not None:
+            return r
+        logging.debug("OpenDTU livedata cache not current; polling the status endpoint.")
     try:
-        response = requests.get(dtu_status_url, timeout=5)
-        response.raise_for_status()
-        r = response.json()
-        logging.debug(f"DTU response: {r}")
+        r = dtu_client.get_json(dtu_status_url)
+        logging.debug("DTU response: %s", r)
         return r
+    except CircuitOpenError as e:
+        logging.debug("Skipping DTU status request: %s", e)
+        return None
     except Exception as e:
-        logging.error("❌ Error fetching DTU status: " + str(e), exc_info=True)
+        logging.error(f"❌ Error fetching DTU status: {e!r}")
         return None
 
 # ------------------------------------------------------------------------------
 # Shelly data fetching
 # ------------------------------------------------------------------------------
+shelly_push_client = None
+shelly_sampler = None
+
+def init_shelly_sampling():
+    global shelly_sampler
+    shelly_sampler = ShellySampler(shelly_client, shelly_status_url, interval=shelly_sample_interval,
+                                   window=shelly_sample_window, filter=shelly_filter,
+                                   max_age=5 * shelly_sample_interval).start()
+    logging.info(f"✅ Shelly sampling enabled ({shelly_sample_interval} s, {shelly_filter} of "
+                 f"{shelly_sample_window} samples).")
+
+def init_shelly_push():
+    global shelly_push_client
+    # aiohttp is only needed for push mode
+    from nulleinspeisung.shelly_ws import ShellyPushClient
+    shelly_push_client = ShellyPushClient(shelly_ws_url, threshold=shelly_push_threshold).start()
+    logging.info(f"✅ Shelly push mode enabled ({shelly_ws_url}).")
+
 def fetch_shelly_data():
+    if shelly_push_client is not None:
+        grid_sum = shelly_push_client.grid_power()
+        if grid_sum is not None:
+            return grid_sum
+        logging.debug("Pushed Shelly data not current; polling EM.GetStatus.")
+    if shelly_sampler is not None:
+        grid_sum = shelly_sampler.grid_power()
+        if grid_sum is not None:
+            return grid_sum
+        logging.debug("Shelly samples not current; polling EM.GetStatus.")
     try:
-        response = requests.get(shelly_status_url, headers={'Content-Type': 'application/json'}, timeout=5)
-        response.raise_for_status()
-        r = response.json()
-        logging.debug(f"Shelly response: {r}")
+        r = shelly_client.get_json(shelly_status_url)
+        logging.debug("Shelly response: %s", r)
         grid_sum = r.get('total_act_power', None)
         if grid_sum is None:
             raise ValueError("total_act_power not found in Shelly response")
         return grid_sum
+    except CircuitOpenError as e:
+        logging.debug("Skipping Shelly request: %s", e)
+        return None
     except Exception as e:
-        logging.error("❌ Error fetching Shelly data: " + str(e), exc_info=True)
+        logging.error(f"❌ Error fetching Shelly data: {e!r}")
         return None
 
-# ------------------------------------------------------------------------------
-# Helper function to extract inverter data from DTU status
-# ------------------------------------------------------------------------------
-def extract_inverter_data(inverter, default_name):
-    reachable = inverter.get('reachable', False)
-    producing = 1 if inverter.get('producing', False) else 0
-    limit_absolute = int(inverter.get('limit_absolute', 0))
-    # Try to extract power data from AC; if absent, default to 0.
-    if 'AC' in inverter:
-        power = inverter.get('AC', {}).get('0', {}).get('Power', {}).get('v', 0)
-    else:
-        power = 0
-    name = inverter.get('name', default_name)
-    return reachable, producing, limit_absolute, power, name
-
 # ------------------------------------------------------------------------------
 # Update function for inverter limit
 # ------------------------------------------------------------------------------
 def update_inverter_limit(serial_param, new_limit):
+    started = time.perf_counter()
     try:
         data_payload = f'data={{"serial":"{serial_param}", "limit_type":0, "limit_value":{new_limit}}}'
-        logging.debug(f"Sending configuration payload for serial {serial_param}: {data_payload}")
-        response = requests.post(
+        logging.debug("Sending configuration payload for serial %s: %s", serial_param, data_payload)
+        response = dtu_client.post(
             dtu_config_url,
             data=data_payload,
-            auth=HTTPBasicAuth(dtu_nutzer, dtu_passwort),
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=5
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}
         )
-        response.raise_for_status()
         result = response.json()
-        logging.info(f"✅ Updated inverter ({serial_param}) limit successfully: {result.get('type', 'No type in response')}")
+        logging.info("✅ Updated inverter (%s) limit successfully: %s", serial_param, result.get('type', 'No type in response'))
+        return True
     except Exception as e:
-        logging.error(f"❌ Error updating inverter limit for serial {serial_param}: {e}", exc_info=True)
+        metrics.ERRORS.inc(source='limit_update')
+        logging.error("❌ Error updating inverter limit for serial %s: %r", serial_param, e)
+        return False
+    finally:
+        metrics.STAGE_DURATION.observe(time.perf_counter() - started, stage='limit_post', inverter=serial_param)
 
 # ------------------------------------------------------------------------------
-# Connection test functions
+# Send a limit only if it really changed (deadband + hold time per serial)
 # ------------------------------------------------------------------------------
-def test_connection(url, headers=None, auth=None, timeout=5):
-    try:
-        response = requests.get(url, headers=headers, auth=auth, timeout=timeout)
-        response.raise_for_status()
-        logging.info(f"✅ Connection test successful for {url}")
-        return True
-    except Exception as e:
-        logging.error(f"❌ Connection test failed for {url}: {e}")
+def send_limit_if_changed(serial_param, name, old_limit, new_limit):
+    if not limit_cache.should_send(serial_param, new_limit):
+        logging.info("👌 No significant change in %s setpoint; no update necessary (%s limit writes).",
+                     name, limit_cache.format_stats())
+        return
+    logging.info("🔄 Updating %s limit from %s W to %s W", name, old_limit, new_limit)
+    result = limit_queue.submit(serial_param, new_limit)
+    if result != QUEUED:
+        metrics.LIMIT_COMMANDS_DROPPED.inc(inverter=name, reason=result)
+
+# ------------------------------------------------------------------------------
+# Limit command queue: POSTs go out on background threads, latest value per
+# inverter wins, at most one request per inverter and limit_command_rate overall.
+# A sent limit is pending (no new command to that inverter) until the DTU
+# reports it applied.
+# ------------------------------------------------------------------------------
+limit_queue = None
+limit_status_poller = None
+
+def limit_command_done(serial_param, new_limit, ok):
+    if ok:
+        limit_cache.record_sent(serial_param, new_limit)
+        if limit_status_poller is not None:
+            limit_status_poller.notify()
+
+def limit_applied(serial_param, new_limit, latency):
+    name = next((inverter.name for inverter in inverters if inverter.serial == serial_param), serial_param)
+    logging.info("✅ %s applied %s W after %.1f s", name, new_limit, latency)
+    metrics.STAGE_DURATION.observe(latency, stage='limit_apply', inverter=serial_param)
+    if shelly_sampler is not None:
+        # Grid samples from before the new limit would be corrected for a second time
+        shelly_sampler.reset()
+
+def init_limit_queue():
+    global limit_queue, limit_status_poller
+    limit_cache.on_applied = limit_applied
+    if limit_status_interval:
+        limit_status_poller = LimitStatusPoller(dtu_client, dtu_limit_status_url, limit_cache,
+                                                interval=limit_status_interval).start()
+    limit_queue = LimitCommandQueue(update_inverter_limit, rate=limit_command_rate,
+                                    on_done=limit_command_done).start()
+    atexit.register(limit_queue.close)
+
+# ------------------------------------------------------------------------------
+# Status API: snapshot of every cycle for /api/status and /api/history
+# ------------------------------------------------------------------------------
+status_store = StatusStore(history=status_history)
+mqtt_publisher = None
+
+def init_mqtt():
+    global mqtt_publisher
+    # paho-mqtt is only needed when MQTT is configured
+    from nulleinspeisung.mqtt_publisher import MqttPublisher
+    mqtt_publisher = MqttPublisher(mqtt_host, inverters, port=mqtt_port, username=mqtt_user,
+                                   password=mqtt_password, topic=mqtt_topic,
+                                   discovery_prefix=mqtt_discovery_prefix, min_interval=mqtt_min_interval,
+                                   heartbeat=mqtt_heartbeat).start()
+    atexit.register(mqtt_publisher.close)
+    logging.info(f"📡 Publishing to MQTT broker {mqtt_host}:{mqtt_port} ({mqtt_topic}/state).")
+
+def publish_status(scheduler, grid_sum, total_production, statuses, allocation, dtus_error, shelly_error):
+    setpoints = allocation.setpoints if allocation else {}
+    inverter_states = []
+    for inverter in inverters:
+        status = statuses.get(inverter.serial)
+        inverter_states.append({
+            'serial': inverter.serial,
+            'name': inverter.name,
+            'power': status.power if status is not None else None,
+            'limit': status.limit if status is not None else None,
+            'setpoint': setpoints.get(inverter.serial),
+            'reachable': status is not None and status.reachable,
+            'producing': status is not None and status.producing,
+            'limit_pending': limit_cache.entry(inverter.serial).pending,
+        })
+    snapshot = {
+        'grid_power': grid_sum,
+        'total_production': total_production,
+        'idle': idle_monitor.idle,
+        'inverters': inverter_states,
+        'cycle': {
+            'interval': scheduler.idle_interval if idle_monitor.idle else scheduler.current_interval,
+            'duration_ms': round(scheduler.elapsed() * 1000, 1),
+            'cycles': scheduler.cycles,
+            'missed': scheduler.missed,
+        },
+        'devices': {
+            'dtu': {'error': dtus_error, 'circuit': dtu_client.breaker.state},
+            'shelly': {'error': shelly_error, 'circuit': shelly_client.breaker.state},
+        },
+    }
+    status_store.update(snapshot, {
+        'grid_power': grid_sum,
+        'total_production': total_production,
+        'setpoints': {inverter.name: setpoints.get(inverter.serial) for inverter in inverters},
+    })
+    if mqtt_publisher is not None:
+        mqtt_publisher.update(snapshot)
+
+# ------------------------------------------------------------------------------
+# Idle mode: one DTU request per idle_interval, no Shelly requests, no limit
+# commands and a compact marker row instead of a full row every cycle
+# ------------------------------------------------------------------------------
+last_idle_marker = None
+
+def set_idle(idle):
+    global last_idle_marker
+    metrics.IDLE.set(1 if idle else 0)
+    if shelly_sampler is not None:
+        shelly_sampler.paused = idle
+    if not idle:
+        last_idle_marker = None
+
+def store_idle_marker(dtus_error):
+    global last_idle_marker
+    now = time.monotonic()
+    if last_idle_marker is not None and now - last_idle_marker < idle_marker_interval:
+        return
+    last_idle_marker = now
+    db_writer.submit(idle=1, dtus_error=dtus_error)
+
+def idle_probe(scheduler):
+    """One idle cycle; returns False as soon as an inverter produces again (run a full cycle then)."""
+    sample = timed_fetch(fetch_dtu_status)
+    metrics.STAGE_DURATION.observe(sample.latency, stage='dtu_fetch')
+    dtu_status = sample.value
+    statuses = parse_inverters(dtu_status) if dtu_status is not None else None
+    if not idle_monitor.update(statuses):
+        set_idle(False)
         return False
+    logging.debug("🌙 Idle: no inverter producing; next probe in %s s.", idle_interval)
+    dtus_error = 0 if dtu_status is not None else dtu_client.breaker.error_code()
+    store_idle_marker(dtus_error)
+    publish_status(scheduler, None, None, statuses or {}, None, dtus_error, None)
+    metrics.CYCLES.inc()
+    metrics.LOG_RECORDS_DROPPED.set_total(LazyQueueHandler.dropped)
+    scheduler.wait(idle=True)
+    return True
 
+# ------------------------------------------------------------------------------
+# Connection test functions
+# ------------------------------------------------------------------------------
 def test_api_endpoints():
-    all_ok = True
-    if not test_connection(dtu_status_url):
-        all_ok = False
-    if not test_connection(shelly_status_url, headers={'Content-Type': 'application/json'}):
-        all_ok = False
-    try:
-        data_payload = f'data={{"serial":"{serial}", "limit_type":0, "limit_value":{minimum_wr}}}'
-        response = requests.post(
-            dtu_config_url,
-            data=data_payload,
-            auth=HTTPBasicAuth(dtu_nutzer, dtu_passwort),
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=5
-        )
-        response.raise_for_status()
-        logging.info(f"✅ Configuration endpoint test successful for inverter 1 at {dtu_config_url}")
-    except Exception as e:
-        logging.error(f"❌ Configuration endpoint test failed for inverter 1 at {dtu_config_url}: {e}")
-        all_ok = False
-    if enable_second_inverter:
-        try:
-            data_payload = f'data={{"serial":"{serial2}", "limit_type":0, "limit_value":{minimum_wr2}}}'
-            response = requests.post(
-                dtu_config_url,
-                data=data_payload,
-                auth=HTTPBasicAuth(dtu_nutzer, dtu_passwort),
-                headers={'Content-Type': 'application/x-www-form-urlencoded'},
-                timeout=5
-            )
-            response.raise_for_status()
-            logging.info(f"✅ Configuration endpoint test successful for inverter 2 at {dtu_config_url}")
-        except Exception as e:
-            logging.error(f"❌ Configuration endpoint test failed for inverter 2 at {dtu_config_url}: {e}")
-            all_ok = False
-    return all_ok
+    """Check DTU status, Shelly status and the DTU limit API in parallel without changing any limit."""
+    return log_results(probe({
+        'DTU status': (dtu_client, dtu_status_url, has_inverters),
+        'Shelly status': (shelly_client, shelly_status_url, has_grid_power),
+        'DTU limit API': (dtu_client, dtu_limit_status_url,
+                          known_serials([inverter.serial for inverter in inverters])),
+    }, deadline=startup_deadline))
 
 # ------------------------------------------------------------------------------
 # Main loop
 # ------------------------------------------------------------------------------
 def main_loop():
+    scheduler = CycleScheduler(interval=cycle_interval, adaptive=adaptive_polling, fast_interval=fast_interval,
+                               wake=shelly_push_client.wake if shelly_push_client is not None else None,
+                               idle_interval=idle_interval)
+    restore_state(scheduler)
+    init_limit_queue()
+    set_idle(False)
     while True:
+        if idle_monitor.idle and idle_probe(scheduler):
+            continue
         dtus_error = 0
         shelly_error = 0
-        # Fetch DTU status
-        dtu_status = fetch_dtu_status()
+        # Fetch DTU status and Shelly data in parallel
+        samples = acquire(dtu=fetch_dtu_status, shelly=fetch_shelly_data)
+        dtu_sample, shelly_sample = samples['dtu'], samples['shelly']
+        metrics.STAGE_DURATION.observe(dtu_sample.latency, stage='dtu_fetch')
+        metrics.STAGE_DURATION.observe(shelly_sample.latency, stage='shelly_fetch')
+        logging.debug("Acquisition: DTU %.0f ms, Shelly %.0f ms, skew %.0f ms",
+                      dtu_sample.latency * 1000, shelly_sample.latency * 1000,
+                      abs(dtu_sample.timestamp - shelly_sample.timestamp) * 1000)
+        dtu_status = dtu_sample.value
+        # 1 = request failed, 2 = device skipped while its circuit is open (logged once by the breaker)
         if dtu_status is None:
-            dtus_error = 1
-            logging.warning("⚠️ DTU error encountered; DTU data will be stored as NULL.")
-        # Fetch Shelly data
-        grid_sum = fetch_shelly_data()
+            dtus_error = dtu_client.breaker.error_code()
+            metrics.ERRORS.inc(source='dtu', reason=ERROR_REASONS[dtus_error])
+            if dtus_error != ERROR_CIRCUIT_OPEN:
+                logging.warning("⚠️ DTU error encountered; DTU data will be stored as NULL.")
+        grid_sum = shelly_sample.value
         if grid_sum is None:
-            shelly_error = 1
-            logging.warning("⚠️ Shelly error encountered; grid power will be stored as NULL.")
+            shelly_error = shelly_client.breaker.error_code()
+            metrics.ERRORS.inc(source='shelly', reason=ERROR_REASONS[shelly_error])
+            if shelly_error != ERROR_CIRCUIT_OPEN:
+                logging.warning("⚠️ Shelly error encountered; grid power will be stored as NULL.")
 
         # Initialize variables for DTU data
-        inverter1_power = None
-        inverter2_power = None
         total_production = None
-        inverter1_setpoint = None
-        inverter2_setpoint = None
-        inverter1_reachable = 0
-        inverter2_reachable = 0
+        statuses = {}
+        allocation = None
 
         if dtu_status is not None:
             total_production = dtu_status.get('total', {}).get('Power', {}).get('v', 0)
-            inverters = dtu_status.get('inverters', [])
-            if len(inverters) < 1:
+            statuses = parse_inverters(dtu_status)
+            if not statuses:
                 logging.error("❌ No inverter data available in DTU response.")
-            else:
-                # Process inverter 1
-                inverter1 = inverters[0]
-                inverter1_data = extract_inverter_data(inverter1, "Inverter 1")
-                inverter1_reachable = 1 if inverter1_data[0] else 0
-                _, _, altes_limit1, inverter1_power, name1 = inverter1_data
-                if inverter1_reachable:
-                    inverter1_setpoint = (grid_sum + altes_limit1 - 5) if grid_sum is not None else None
-                    if inverter1_setpoint is not None:
-                        if inverter1_setpoint > maximum_wr:
-                            inverter1_setpoint = maximum_wr
-                            logging.info(f"🚀 {name1} setpoint capped at maximum: {maximum_wr} W")
-                        elif inverter1_setpoint < minimum_wr:
-                            inverter1_setpoint = minimum_wr
-                            logging.info(f"🔋 {name1} setpoint raised to minimum: {minimum_wr} W")
-                        else:
-                            logging.info(f"💡 {name1} setpoint calculated: {inverter1_setpoint} W")
-                        logging.info(f"🔄 Updating {name1} limit from {altes_limit1} W to {inverter1_setpoint} W")
-                        update_inverter_limit(serial, inverter1_setpoint)
+            for inverter in inverters:
+                status = statuses.get(inverter.serial)
+                if status is None:
+                    logging.warning("⚠️ %s (%s) not found in DTU response; skipping update.", inverter.name, inverter.serial)
+                elif not status.reachable:
+                    logging.warning("⚠️ %s DTU not reachable; skipping update.", inverter.name)
                 else:
-                    logging.warning(f"⚠️ {name1} DTU not reachable; skipping update.")
-
-                # Process inverter 2 if enabled
-                if enable_second_inverter:
-                    if len(inverters) >= 2:
-                        inverter2 = inverters[1]
-                        inverter2_data = extract_inverter_data(inverter2, "Inverter 2")
-                        inverter2_reachable = 1 if inverter2_data[0] else 0
-                        _, _, altes_limit2, inverter2_power, name2 = inverter2_data
-                    else:
-                        logging.warning("⚠️ Inverter 2 data not available; using fallback values.")
-                        altes_limit2 = default_altes_limit2
-                        name2 = "Inverter 2"
-                    # Determine shortfall for inverter 2:
-                    if inverter1_setpoint is not None and inverter1_setpoint < maximum_wr:
-                        shortfall = 0
-                        logging.info(f"😊 {name1} is not saturated; no shortfall detected.")
-                    else:
-                        shortfall = max(0, grid_sum - maximum_wr) if grid_sum is not None else 0
-                        logging.info(f"⚠️ {name1} is saturated; shortfall = {shortfall} W")
-                    inverter2_setpoint = altes_limit2 + shortfall - 5
-                    if inverter2_setpoint > maximum_wr2:
-                        inverter2_setpoint = maximum_wr2
-                        logging.info(f"🚀 {name2} setpoint capped at maximum: {maximum_wr2} W")
-                    elif inverter2_setpoint < minimum_wr2:
-                        inverter2_setpoint = minimum_wr2
-                        logging.info(f"🔋 {name2} setpoint raised to minimum: {minimum_wr2} W")
+                    limit_cache.record_ack(inverter.serial, status.limit)
+            if idle_monitor.update(statuses):
+                # Night: nothing to regulate; this full row is the last one until production starts
+                set_idle(True)
+
+            if grid_sum is not None and not idle_monitor.idle:
+                compute_started = time.perf_counter()
+                allocation = controller.allocate(grid_sum, statuses)
+                for inverter in controller.active(statuses):
+                    setpoint = allocation.setpoints[inverter.serial]
+                    if setpoint >= inverter.maximum:
+                        logging.info("🚀 %s setpoint capped at maximum: %s W", inverter.name, inverter.maximum)
+                    elif setpoint <= inverter.minimum:
+                        logging.info("🔋 %s setpoint raised to minimum: %s W", inverter.name, inverter.minimum)
                     else:
-                        logging.info(f"💡 {name2} setpoint calculated: {inverter2_setpoint} W")
-                    logging.info(f"🔄 Updating {name2} limit to {inverter2_setpoint} W")
-                    update_inverter_limit(serial2, inverter2_setpoint)
-        else:
+                        logging.info("💡 %s setpoint calculated: %s W", inverter.name, setpoint)
+                    send_limit_if_changed(inverter.serial, inverter.name, statuses[inverter.serial].limit, setpoint)
+                if allocation.unserved > 0:
+                    logging.info("⚠️ All inverters saturated; shortfall = %s W", round(allocation.unserved))
+                metrics.STAGE_DURATION.observe(time.perf_counter() - compute_started, stage='compute')
+        elif dtus_error != ERROR_CIRCUIT_OPEN:
             logging.warning("⚠️ DTU data is unavailable; DTU fields will be stored as NULL.")
 
-        # Log overall status with total production
-        logging.info(f"⚡ Grid Power: {round(grid_sum, 1) if grid_sum is not None else 'NULL'} W | "
-                     f"🔋 Inverter 1 Power: {round(inverter1_power, 1) if inverter1_power is not None else 'NULL'} W | "
-                     f"🏭 Total Production: {round(total_production, 1) if total_production is not None else 'NULL'} W")
+        # Log overall status with the power of every inverter and total production
+        inverter_powers = " | ".join(
+            f"🔋 {inverter.name} Power: {round(statuses[inverter.serial].power, 1) if inverter.serial in statuses else 'NULL'} W"
+            for inverter in inverters)
+        logging.info("⚡ Grid Power: %s W | %s | 🏭 Total Production: %s W",
+                     round(grid_sum, 1) if grid_sum is not None else 'NULL', inverter_powers,
+                     round(total_production, 1) if total_production is not None else 'NULL')
+
+        metrics.GRID_POWER.set(grid_sum)
+        metrics.TOTAL_PRODUCTION.set(total_production)
+        metrics.record_circuit(dtu_client.breaker)
+        metrics.record_circuit(shelly_client.breaker)
+        for inverter in inverters:
+            metrics.record_inverter(inverter, statuses.get(inverter.serial),
+                                    allocation.setpoints.get(inverter.serial) if allocation else None)
+            metrics.LIMIT_QUEUE_DEPTH.set(limit_queue.depth(inverter.serial), inverter=inverter.name)
+
+        # Every inverter gets an inverter_data row; power_data keeps its columns for the first two
+        inverter_rows = []
+        for inverter in inverters:
+            status = statuses.get(inverter.serial)
+            inverter_rows.append((inverter.serial, status.power if status is not None else None,
+                                  allocation.setpoints.get(inverter.serial) if allocation else None,
+                                  1 if status is not None and status.reachable else 0))
+        inverter_columns = {}
+        for index, (_, power, setpoint, reachable) in enumerate(inverter_rows[:2], start=1):
+            inverter_columns[f'inverter{index}_power'] = power
+            inverter_columns[f'inverter{index}_reachable'] = reachable
+            inverter_columns[f'inverter{index}_setpoint'] = setpoint
 
         # Store data in SQLite (storing NULLs if data is missing)
         store_data(
             grid_power = grid_sum,
-            inverter1_power = inverter1_power,
-            inverter2_power = inverter2_power,
             total_production = total_production,
-            inverter1_setpoint = inverter1_setpoint,
-            inverter2_setpoint = inverter2_setpoint,
-            inverter1_reachable = inverter1_reachable,
-            inverter2_reachable = inverter2_reachable,
             dtus_error = dtus_error,
-            shelly_error = shelly_error
+            shelly_error = shelly_error,
+            inverters = inverter_rows,
+            **inverter_columns
         )
-        sys.stdout.flush()
-        time.sleep(10)
+        save_state(scheduler)
+        publish_status(scheduler, grid_sum, total_production, statuses, allocation, dtus_error, shelly_error)
+        # The stats strings are only built when someone reads them
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Connection reuse: %s | Circuits: %s, %s | Scheduler: %s, %s | Limit queue: %s%s%s%s",
+                          format_connection_stats(), dtu_client.breaker.format_stats(),
+                          shelly_client.breaker.format_stats(), scheduler.format_stats(), idle_monitor.format_stats(),
+                          limit_queue.format_stats(),
+                          f" | Shelly push: {shelly_push_client.format_stats()}" if shelly_push_client else
+                          f" | Shelly samples: {shelly_sampler.format_stats()}" if shelly_sampler else "",
+                          f" | DTU livedata: {dtu_live_client.format_stats()}" if dtu_live_client else "",
+                          f" | MQTT: {mqtt_publisher.format_stats()}" if mqtt_publisher else "")
+        metrics.CYCLES.inc()
+        metrics.LOG_RECORDS_DROPPED.set_total(LazyQueueHandler.dropped)
+        metrics.STAGE_DURATION.observe(scheduler.elapsed(), stage='cycle')
+        scheduler.wait(grid_power=grid_sum, saturated=allocation is not None and allocation.saturated,
+                       idle=idle_monitor.idle)
 
 # ------------------------------------------------------------------------------
 # Main entry point
 # ------------------------------------------------------------------------------
 if __name__ == "__main__":
+    # Turn SIGTERM (systemd stop) into a normal exit so queued rows are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     init_db()
-    logging.info("🚀 Starting nulleinspeisung script with enhanced logging, SQLite storage, and dual inverter support")
+    if shelly_push:
+        init_shelly_push()
+    elif shelly_sampling:
+        init_shelly_sampling()
+    if dtu_livedata:
+        init_dtu_livedata()
+    if metrics_port:
+        metrics.start_http_server(metrics_port, routes=status_store.routes())
+        logging.info(f"📈 Prometheus metrics and status API available on port {metrics_port} "
+                     f"(/metrics, /api/status, /api/history).")
+    if mqtt_host:
+        init_mqtt()
+    logging.info("🚀 Starting nulleinspeisung script with enhanced logging, SQLite storage, and multi-inverter support")
     if not test_api_endpoints():
         logging.error("❌ One or more API endpoints are not reachable. Exiting.")
         sys.exit(1)
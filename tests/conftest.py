@@ -0,0 +1,4 @@
+import os, sys
+
+# Tests run from a checkout, like the benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,25 @@
+"""Inverter configuration checks of the controller and the fleet config."""
+import json, os
+
+import pytest
+
+from nulleinspeisung.controller import Controller, Inverter
+from nulleinspeisung.fleet import sites_from_config
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fleet.example.json')
+
+@pytest.mark.parametrize('inverter, message', [
+    (Inverter('1', 0, 800, weight=0), 'weight must be greater than 0'),
+    (Inverter('1', 0, 800, weight=-1.0), 'weight must be greater than 0'),
+    (Inverter('1', 900, 800), 'minimum (900 W) is above maximum (800 W)'),
+])
+def test_controller_rejects_invalid_inverters(inverter, message):
+    with pytest.raises(ValueError, match=message.replace('(', r'\(').replace(')', r'\)')):
+        Controller([inverter])
+
+def test_fleet_config_names_the_site():
+    with open(EXAMPLE_CONFIG) as f:
+        config = json.load(f)
+    config['sites'][0]['inverters'][0]['weight'] = 0
+    with pytest.raises(ValueError, match=f"Site {config['sites'][0]['name']}: "):
+        sites_from_config(config)
@@ -0,0 +1,58 @@
+"""DeviceClient timeouts and the circuit breaker."""
+import socket
+
+import pytest
+import requests
+
+from nulleinspeisung.breaker import OPEN, CircuitBreaker, CircuitOpenError
+from nulleinspeisung.http_client import DeviceClient
+
+@pytest.fixture
+def hung_listener():
+    """A listening socket whose accept backlog is full, so new connects time out."""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(0)
+    fillers = []
+    for _ in range(8):
+        filler = socket.socket()
+        filler.setblocking(False)
+        filler.connect_ex(server.getsockname())
+        fillers.append(filler)
+    yield server.getsockname()
+    for filler in fillers:
+        filler.close()
+    server.close()
+
+@pytest.fixture
+def silent_server():
+    """Accepts connections but never answers, so reads time out."""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(8)
+    yield server.getsockname()
+    server.close()
+
+def make_client(failure_threshold=1):
+    breaker = CircuitBreaker('test', failure_threshold=failure_threshold, base_delay=60, jitter=0)
+    return DeviceClient('test', timeout=0.3, breaker=breaker)
+
+def test_connect_timeout_trips_the_breaker(hung_listener):
+    client = make_client()
+    host, port = hung_listener
+    with pytest.raises(requests.ConnectTimeout):
+        client.get(f'http://{host}:{port}/')
+    assert client.breaker.state == OPEN
+    assert client.breaker.trips == 1
+    with pytest.raises(CircuitOpenError):
+        client.get(f'http://{host}:{port}/')
+    client.close()
+
+def test_read_timeout_trips_the_breaker(silent_server):
+    client = make_client()
+    host, port = silent_server
+    with pytest.raises(requests.ReadTimeout):
+        client.get(f'http://{host}:{port}/')
+    assert client.breaker.state == OPEN
+    assert client.stats()['connections'] == 1     # Not retried
+    client.close()
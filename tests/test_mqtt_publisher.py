@@ -0,0 +1,182 @@
+"""MqttPublisher: discovery configs, change detection and the outbound queue (against the broker stand-in)."""
+import json, time
+
+import pytest
+
+pytest.importorskip('paho.mqtt.client', reason="paho-mqtt is optional (MQTT only)")
+
+from nulleinspeisung.controller import Inverter
+from nulleinspeisung.mqtt_broker import LocalBroker
+from nulleinspeisung.mqtt_publisher import MqttPublisher
+
+INVERTERS = [Inverter('116492226387', 0, 800, name='Balkon'), Inverter('1164a00b64e3', 0, 600, name='Garage')]
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+def snapshot(grid=300.0, production=900.0, setpoint=450, reachable=True, idle=False):
+    return {
+        'grid_power': grid,
+        'total_production': production,
+        'idle': idle,
+        'inverters': [{'serial': inverter.serial, 'name': inverter.name, 'power': production / 2,
+                       'limit': setpoint, 'setpoint': setpoint, 'reachable': reachable}
+                      for inverter in INVERTERS],
+    }
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def publisher(clock):
+    # Never started: without a connection every message stays in the local queue
+    return MqttPublisher('127.0.0.1', INVERTERS, topic='test/nulleinspeisung', min_interval=30, heartbeat=300,
+                         clock=clock)
+
+# ------------------------------------------------------------------------------
+# Discovery
+# ------------------------------------------------------------------------------
+def test_discovery_topics(publisher):
+    topics = [topic for topic, _ in publisher.discovery_messages()]
+    assert len(topics) == 3 + 4 * len(INVERTERS)
+    assert 'homeassistant/sensor/test_nulleinspeisung/grid_power/config' in topics
+    assert 'homeassistant/binary_sensor/test_nulleinspeisung/idle/config' in topics
+    for inverter in INVERTERS:
+        for suffix in ('power', 'setpoint', 'limit'):
+            assert f'homeassistant/sensor/test_nulleinspeisung/{inverter.serial}_{suffix}/config' in topics
+        assert f'homeassistant/binary_sensor/test_nulleinspeisung/{inverter.serial}_reachable/config' in topics
+
+def test_discovery_payloads(publisher):
+    configs = {topic.split('/')[-2]: json.loads(payload) for topic, payload in publisher.discovery_messages()}
+    grid = configs['grid_power']
+    assert grid['state_topic'] == 'test/nulleinspeisung/state'
+    assert grid['availability_topic'] == 'test/nulleinspeisung/availability'
+    assert grid['unique_id'] == 'test_nulleinspeisung_grid_power'
+    assert grid['value_template'] == '{{ value_json.grid_power }}'
+    assert (grid['unit_of_measurement'], grid['device_class'], grid['state_class']) == ('W', 'power', 'measurement')
+    assert grid['device']['identifiers'] == ['test_nulleinspeisung']
+
+    # Keys starting with a digit need the subscript form in the Jinja template
+    power = configs['116492226387_power']
+    assert power['name'] == 'Balkon power'
+    assert power['value_template'] == "{{ value_json['116492226387_power'] }}"
+
+    reachable = configs['1164a00b64e3_reachable']
+    assert reachable['device_class'] == 'connectivity'
+    assert 'unit_of_measurement' not in reachable
+    assert len({config['unique_id'] for config in configs.values()}) == len(configs)
+
+def test_state_keys_match_discovery_templates(publisher):
+    values = publisher.values(snapshot())
+    keys = {topic.split('/')[-2] for topic, _ in publisher.discovery_messages()}
+    assert set(values) == keys
+    assert values['idle'] == 'OFF' and values['116492226387_reachable'] == 'ON'
+
+# ------------------------------------------------------------------------------
+# Change detection
+# ------------------------------------------------------------------------------
+def test_first_update_is_sent(publisher):
+    assert publisher.update(snapshot())
+    assert publisher.published == 1
+
+def test_unchanged_state_waits_for_the_heartbeat(publisher, clock):
+    publisher.update(snapshot())
+    clock.now += 290
+    assert not publisher.update(snapshot())
+    clock.now += 10
+    assert publisher.update(snapshot())
+    assert (publisher.published, publisher.suppressed) == (2, 1)
+
+@pytest.mark.parametrize('changed, sent', [
+    (dict(grid=315.0), False),              # below the 20 W grid deadband
+    (dict(grid=320.0), True),
+    (dict(production=908.0), False),        # 4 W per inverter, total 8 W: below 10 W
+    (dict(production=930.0), True),
+    (dict(setpoint=451), True),             # setpoints: every change
+    (dict(reachable=False), True),          # flags: every change
+    (dict(idle=True), True),
+])
+def test_deadbands(publisher, clock, changed, sent):
+    publisher.update(snapshot())
+    clock.now += 60
+    assert publisher.update(snapshot(**changed)) is sent
+
+def test_deadband_compares_with_the_last_sent_value(publisher, clock):
+    # A slow drift is sent once it adds up to the deadband
+    publisher.update(snapshot(grid=300.0))
+    for grid in (310.0, 315.0, 319.0):
+        clock.now += 60
+        assert not publisher.update(snapshot(grid=grid))
+    clock.now += 60
+    assert publisher.update(snapshot(grid=321.0))
+
+def test_changes_within_min_interval_are_batched(publisher, clock):
+    publisher.update(snapshot(grid=300.0))
+    clock.now += 10
+    assert not publisher.update(snapshot(grid=800.0))
+    clock.now += 10
+    assert not publisher.update(snapshot(grid=900.0))
+    clock.now += 10
+    # The message after min_interval carries the newest values
+    assert publisher.update(snapshot(grid=950.0))
+    payload, retain = publisher._pending[publisher.state_topic]
+    assert json.loads(payload)['grid_power'] == 950.0 and retain
+
+def test_offline_queue_keeps_the_newest_message_per_topic(publisher, clock):
+    for grid in (100.0, 500.0, 900.0):
+        publisher.update(snapshot(grid=grid))
+        clock.now += 60
+    assert list(publisher._pending) == [publisher.state_topic]
+    assert json.loads(publisher._pending[publisher.state_topic][0])['grid_power'] == 900.0
+
+# ------------------------------------------------------------------------------
+# Broker
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def broker():
+    broker = LocalBroker().start()
+    yield broker
+    broker.stop()
+
+def test_reconnect_delivers_the_newest_state(broker, clock):
+    publisher = MqttPublisher(broker.host, INVERTERS, port=broker.port, topic='test/outage', min_interval=0,
+                              heartbeat=300, client_id='test-outage', clock=clock).start()
+    try:
+        assert wait_for(lambda: publisher.connected)
+        publisher.update(snapshot(grid=100.0))
+        assert wait_for(lambda: 'test/outage/state' in broker.retained)
+        assert broker.retained['test/outage/availability'] == b'online'
+        assert len([topic for topic in broker.retained if topic.startswith('homeassistant/')]) == 3 + 4 * len(INVERTERS)
+
+        broker.stop()
+        assert wait_for(lambda: not publisher.connected)
+        for grid in (500.0, 900.0):
+            clock.now += 60
+            assert publisher.update(snapshot(grid=grid))
+        assert list(publisher._pending) == ['test/outage/state']
+
+        broker.start()
+        assert wait_for(lambda: publisher.connected, timeout=30)
+        newest = json.dumps(publisher.values(snapshot(grid=900.0)), separators=(',', ':')).encode()
+        assert wait_for(lambda: broker.retained.get('test/outage/state') == newest)
+        assert broker.retained['test/outage/availability'] == b'online'
+        # Only the newest of the two queued states went out
+        states = [json.loads(payload)['grid_power'] for topic, payload in broker.messages('test/outage/state')]
+        assert states == [100.0, 900.0]
+        assert not publisher._pending
+    finally:
+        publisher.close()
+    assert wait_for(lambda: broker.retained.get('test/outage/availability') == b'offline')
@@ -0,0 +1,77 @@
+"""Rollup queries for ranges that do not start or end on a bucket boundary."""
+import pytest
+
+from nulleinspeisung import query
+from nulleinspeisung.storage import PowerDataWriter, utc_timestamp
+
+START = 1735689600      # 2025-01-01 00:00:00 UTC
+HOURS = 30
+SERIALS = ('116400000001', '116400000002', '116400000003', '116400000004')
+
+@pytest.fixture
+def conn(tmp_path):
+    db_file = str(tmp_path / 'power.db')
+    writer = PowerDataWriter(db_file, batch_size=1000).start()
+    for epoch in range(START, START + HOURS * 3600, 10):
+        writer.submit(timestamp=utc_timestamp(epoch), grid_power=0.0, inverter1_power=float(epoch % 7 * 100),
+                      inverter2_power=200.0,
+                      inverters=[(serial, 100.0 * index, 100.0 * index + 10, 1)
+                                 for index, serial in enumerate(SERIALS, start=1)])
+    writer.close()
+    conn = query.connect(db_file)
+    yield conn
+    conn.close()
+
+def raw_count(conn, start, end):
+    return sum(1 for _ in query.range_rows(conn, start, end))
+
+@pytest.mark.parametrize('resolution', ['minute', 'hour', 'day'])
+@pytest.mark.parametrize('start, end', [
+    (START + 630, START + 8415),                # Partial minutes and hours at both edges
+    (START + 3 * 3600, START + 26 * 3600 + 5),  # Aligned start, end just past an hour (and a day)
+    (START + 40, START + 50),                   # Start and end inside one minute
+])
+def test_edge_buckets_count_every_raw_row(conn, resolution, start, end):
+    items = list(query.aggregates(conn, start, end, resolution, fields=('inverter2_power',)))
+    assert sum(item.samples for item in items) == raw_count(conn, start, end)
+    assert items[0].bucket == start
+    assert [item.bucket for item in items] == sorted(item.bucket for item in items)
+    assert sum(item.energy_wh for item in items) == pytest.approx(200.0 * (end - start) / 3600)
+
+def test_summary_matches_raw_rows(conn):
+    start, end = '2025-01-01 00:10:30', START + 27 * 3600 + 45
+    summary = {item.field: item for item in query.inverter_summary(conn, start, end,
+                                                                   fields=('inverter1_power', 'inverter2_power'))}
+    rows = list(query.range_rows(conn, start, end))
+    assert summary['inverter1_power'].samples == len(rows)
+    assert summary['inverter1_power'].average == pytest.approx(sum(row.inverter1_power for row in rows) / len(rows))
+    assert summary['inverter1_power'].bucket == query.to_epoch(start)
+    assert summary['inverter2_power'].energy_wh == pytest.approx(200.0 * (end - query.to_epoch(start)) / 3600)
+
+def test_every_inverter_is_stored(conn):
+    start, end = START + 630, START + 8415
+    rows = list(query.inverter_rows(conn, start, end))
+    assert len(rows) == len(SERIALS) * raw_count(conn, start, end)
+    assert {row.serial for row in rows} == set(SERIALS)
+    fourth = list(query.inverter_rows(conn, start, end, serial=SERIALS[3]))
+    assert {(row.power, row.setpoint, row.reachable) for row in fourth} == {(400.0, 410.0, 1)}
+
+@pytest.mark.parametrize('resolution', ['minute', 'hour'])
+def test_per_inverter_aggregates(conn, resolution):
+    start, end = START + 630, START + 8415
+    items = list(query.aggregates(conn, start, end, resolution, fields=('power', 'setpoint')))
+    for index, serial in enumerate(SERIALS, start=1):
+        power = [item for item in items if item.serial == serial and item.field == 'power']
+        assert sum(item.samples for item in power) == raw_count(conn, start, end)
+        assert {item.average for item in power} == {100.0 * index}
+        assert sum(item.energy_wh for item in power) == pytest.approx(100.0 * index * (end - start) / 3600)
+    assert {item.average for item in items if item.field == 'setpoint' and item.serial == SERIALS[3]} == {410.0}
+
+def test_per_inverter_summary(conn):
+    start, end = START + 630, START + 27 * 3600 + 45
+    summary = {item.serial: item for item in query.inverter_summary(conn, start, end)}
+    assert set(summary) == set(SERIALS)
+    assert summary[SERIALS[3]].samples == raw_count(conn, start, end)
+    assert summary[SERIALS[3]].energy_wh == pytest.approx(400.0 * (end - start) / 3600)
+    only = list(query.inverter_summary(conn, start, end, serial=SERIALS[2]))
+    assert [(item.serial, item.average) for item in only] == [(SERIALS[2], 300.0)]
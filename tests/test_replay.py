@@ -0,0 +1,52 @@
+"""load_history() on a database written by PowerDataWriter."""
+import sqlite3
+
+import pytest
+
+from nulleinspeisung.replay import load_history
+from nulleinspeisung.storage import PowerDataWriter, utc_timestamp
+
+START = 1735689600      # 2025-01-01 00:00:00 UTC
+SERIALS = ('116400000001', '116400000002', '116400000003', '116400000004')
+
+@pytest.fixture
+def db_file(tmp_path):
+    db_file = str(tmp_path / 'power.db')
+    writer = PowerDataWriter(db_file).start()
+    for index in range(360):    # One hour of 10 s cycles, written out of order
+        epoch = START + 3590 - index * 10
+        writer.submit(timestamp=utc_timestamp(epoch), grid_power=float(index), inverter1_power=100.0,
+                      inverter2_power=200.0, inverter1_setpoint=110, inverter2_setpoint=210,
+                      inverters=[(serial, 100.0 * index, 100.0 * index + 10, 1)
+                                 for index, serial in enumerate(SERIALS, start=1)])
+    writer.close()
+    return db_file
+
+def test_range_is_half_open_and_sorted(db_file):
+    history = load_history(db_file, start='2025-01-01 00:10', end=START + 1200)
+    assert len(history.time) == 60
+    assert history.time[0] == START + 600
+    assert history.time[-1] == START + 1190
+    assert list(history.time) == sorted(history.time)
+
+def test_serials_load_one_column_per_inverter(db_file):
+    history = load_history(db_file, start=START + 600, end=START + 1200, serials=SERIALS)
+    assert history.power.shape == history.setpoint.shape == (60, 4)
+    assert list(history.power[0]) == [100.0, 200.0, 300.0, 400.0]
+    assert list(history.setpoint[-1]) == [110.0, 210.0, 310.0, 410.0]
+    assert list(history.time) == sorted(history.time)
+
+def test_range_uses_the_epoch_index(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT epoch FROM power_data WHERE grid_power IS NOT NULL AND epoch IS NOT NULL '
+            'AND epoch >= ? AND epoch < ? ORDER BY epoch, id', (START, START + 600)))
+    finally:
+        conn.close()
+    assert 'power_data_epoch' in plan
+
+def test_empty_range(db_file):
+    history = load_history(db_file, start=START + 7200, serials=SERIALS)
+    assert len(history.time) == 0
+    assert history.power.shape == (0, 4)
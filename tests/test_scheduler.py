@@ -0,0 +1,37 @@
+"""CycleScheduler with a fake clock."""
+from nulleinspeisung.scheduler import CycleScheduler
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def make_scheduler(fake):
+    return CycleScheduler(interval=10.0, idle_interval=60.0, clock=fake.clock, sleep=fake.sleep)
+
+def test_idle_wait_returns_the_idle_interval():
+    fake = FakeTime()
+    scheduler = make_scheduler(fake)
+    fake.now += 1
+    assert scheduler.wait(idle=True) == 60.0
+    assert fake.now == 60.0
+
+def test_idle_overrun_returns_the_idle_interval():
+    fake = FakeTime()
+    scheduler = make_scheduler(fake)
+    fake.now += 75
+    assert scheduler.wait(idle=True) == 60.0
+    assert scheduler.missed == 1
+    assert fake.now == 75.0
+
+def test_normal_wait_returns_the_cycle_interval():
+    fake = FakeTime()
+    scheduler = make_scheduler(fake)
+    assert scheduler.wait() == 10.0
+    fake.now += 15
+    assert scheduler.wait() == 10.0
@@ -0,0 +1,84 @@
+"""Shelly push mode (ShellyPushClient) against the Shelly stand-in of the simulator."""
+import threading, time
+
+import pytest
+
+from nulleinspeisung.http_client import DeviceClient
+from nulleinspeisung.scheduler import CycleScheduler
+from nulleinspeisung.shelly_ws import ShellyPushClient
+from nulleinspeisung.simulator import Simulation, SimulatorServer
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+@pytest.fixture
+def server():
+    # No noise, a constant load and inverters at full power right away: the grid power only
+    # moves when a test changes the load. speed=10 makes the stand-in check every 0.1 s
+    sim = Simulation(load_steps=[(0, 600)], noise=0.0, ramp=1e6, speed=10.0, seed=1)
+    server = SimulatorServer(sim).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def client(server):
+    # refresh_interval is long, so every value after the first comes from a NotifyStatus
+    client = ShellyPushClient(server.shelly_ws_url, threshold=150, refresh_interval=60.0).start()
+    assert wait_for(lambda: client.grid_power() is not None)
+    yield client
+    client.stop()
+
+def set_load(sim, watts):
+    with sim.lock:
+        sim.load_steps = [(0, watts)]
+
+def test_notify_status_updates_the_reading(server, client):
+    before = client.grid_power()
+    notified = server.sim.requests.get('shelly_notify', 0)
+    set_load(server.sim, 2600)
+    assert wait_for(lambda: client.grid_power() is not None and client.grid_power() >= before + 1900)
+    assert server.sim.requests['shelly_notify'] > notified
+    assert client.grid_power() == pytest.approx(server.sim.grid_power(), abs=1)
+
+def test_push_wakes_the_loop_early(server, client):
+    client.grid_power()             # the control loop used the current value
+    scheduler = CycleScheduler(interval=30.0, wake=client.wake)
+    threading.Timer(0.3, set_load, (server.sim, 2600)).start()
+    started = time.monotonic()
+    scheduler.wait()
+    assert time.monotonic() - started < 5
+    assert scheduler.triggered == 1
+    assert client.triggers == 1
+
+def test_small_changes_do_not_wake_the_loop(server, client):
+    before = client.grid_power()
+    set_load(server.sim, 650)
+    assert wait_for(lambda: client.grid_power() >= before + 40)
+    assert not client.wake.is_set()
+    assert client.triggers == 0
+
+def test_polling_takes_over_when_the_socket_drops(server, client):
+    sim = server.sim
+    sim.shelly_faults.offline = True
+    assert wait_for(lambda: not client.connected)
+    # None tells the control loop to poll EM.GetStatus over HTTP instead
+    assert client.grid_power() is None
+
+    # The device answers HTTP again before the socket is back
+    sim.shelly_faults.offline = False
+    set_load(sim, 1200)
+    http = DeviceClient('shelly', timeout=2)
+    try:
+        polled = http.get_json(f'{server.shelly_url}/rpc/EM.GetStatus?id=0')['total_act_power']
+    finally:
+        http.close()
+    assert polled == pytest.approx(sim.grid_power(), abs=1)
+
+    # ... and push mode resumes after the reconnect
+    assert wait_for(lambda: client.grid_power() is not None, timeout=15)
+    assert client.connects >= 2